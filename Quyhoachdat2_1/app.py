@@ -12,10 +12,20 @@ from flask import (
     session,
     Response,
     send_file,
+    jsonify,
+    abort,
 )
+from flask.json.tag import JSONTag
 import uuid
 import traceback
 import io 
+import csv
+import json
+import base64
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
 
 import matplotlib
 matplotlib.use("Agg") 
@@ -57,30 +67,72 @@ except ImportError:
 # --- KẾT THÚC TỰ ĐỊNH NGHĨA 'pt' ---
 
 from model.model import (
-    get_criteria_from_db,
-    get_all_alternatives,
     add_criteria,
     add_alternative,
-    save_criteria_weights,
-    save_alternative_scores,
-    save_criteria_comparison_matrix,
-    get_criteria_by_ids,
-    get_alternatives_by_ids,
+    save_criteria_step,
     get_or_create_session_db_id,
     save_ahp_analysis,
-    get_ahp_analyses_by_session_db_id,
+    get_ahp_analyses_page,
     get_ahp_analysis_by_id,
+    save_land_allocation,
+    get_land_allocation_by_id,
+    get_db_pool_stats,
+)
+from model.catalog import (
+    criteria_catalog,
+    alternatives_catalog,
+    get_criteria_by_ids,
+    get_alternatives_by_ids,
 )
 from controller.ahp import (
     get_sorted_criteria_with_weights,
-    parse_saaty_value,
+    parse_saaty_matrix,
+    parse_comparison_matrix,
+    stack_comparison_matrices,
+    is_fuzzy_matrix,
+    SaatyMatrixError,
     calculate_ahp,
+    calculate_ahp_batch,
+    unpack_ahp_batch,
+    create_incremental_state,
+    update_ahp_judgment,
+    configure_ahp_cache,
+    DirectoryCacheBackend,
+    AHPResult,
+    compact_ahp_result,
+    CONSISTENCY_THRESHOLD,
 )
+from controller.sensitivity import analyze_sensitivity, SWEEP_DEFAULT_POINTS
+from controller.simulation import simulate_ahp_uncertainty
+from controller.consistency import suggest_consistency_repairs
+from controller.group import GroupAHPAccumulator
+from controller.hierarchy import compile_hierarchy, evaluate_hierarchy, hierarchy_to_records
+from controller.ratings import evaluate_ratings, encode_grades
+from controller.parcel_scoring import parcel_suitability_matrix
+from controller.allocation import allocate_land, ALLOCATION_METHODS, available_allocation_methods
 
 app = Flask(__name__)
 app.secret_key = b'_5#y2L"F4Q8z\n\xec]/'
 app.jinja_env.globals.update(enumerate=enumerate)
 
+
+class TagAHPResult(JSONTag):
+    """Lưu AHPResult vào session cookie ở dạng gọn, đọc lại thành AHPResult."""
+    __slots__ = ()
+    key = " ahp"
+
+    def check(self, value):
+        return isinstance(value, AHPResult)
+
+    def to_json(self, value):
+        return value.to_compact()
+
+    def to_python(self, value):
+        return AHPResult.from_compact(value)
+
+
+app.session_interface.serializer.register(TagAHPResult, index=0)
+
 # --- ĐĂNG KÝ FONT VỚI PDFMETRICS (QUAN TRỌNG CHO REPORTLAB) ---
 FONT_NAME_REGULAR = "MyDejaVuSans"
 FONT_NAME_BOLD = "MyDejaVuSansBold"
@@ -124,7 +176,46 @@ SHEET_NAME_LISTS = "DanhSach"
 SHEET_NAME_CRITERIA_MATRIX = "MaTranTieuChi"
 SHEET_NAME_ALL_ALT_MATRICES = "TatCaMaTranPA"
 CRITERION_BLOCK_MARKER = "Tiêu chí: "
+# Workbook phân cấp: cây (nút cha, nút con) và ma trận so sánh các nút con của từng nhánh
+SHEET_NAME_CRITERIA_TREE = "CayTieuChi"
+SHEET_NAME_BRANCH_MATRICES = "MaTranNhanh"
+BRANCH_BLOCK_MARKER = "Nhánh: "
+# Workbook chấm điểm thửa đất theo thang mức (ratings): khối "Tiêu chí: <tên>" so sánh các mức, bảng thửa đất
+SHEET_NAME_GRADES = "MucDanhGia"
+SHEET_NAME_PARCELS = "ThuaDat"
+RATINGS_TOP_K = 50
+# Phân bổ đất: file CSV thuộc tính thửa đất (cột tiêu chí trùng tên tiêu chí của các phân tích)
+PARCEL_ID_COLUMN = "MaThua"
+PARCEL_AREA_COLUMN = "DienTich"
 ALLOWED_EXTENSIONS = {'xlsx'}
+# Phương pháp tính trọng số: "approx" (trung bình hàng, mặc định), "eigen" (vector riêng chính) hoặc "geometric" (RGMM)
+AHP_PRIORITIZATION_METHOD = "approx"
+# Mô phỏng Monte Carlo độ bất định xếp hạng sau bước tính cuối (0 = tắt); nhiễu ±1 bậc thang Saaty
+MONTE_CARLO_SAMPLES = 2000
+MONTE_CARLO_RADIUS = 1
+MONTE_CARLO_WORKERS = None  # > 1 để chia lô cho nhiều tiến trình
+# Cache kết quả AHP theo nội dung ma trận: số mục trong bộ nhớ và thư mục dùng chung giữa các worker (None = tắt)
+AHP_CACHE_MAX_ENTRIES = 4096
+AHP_CACHE_SHARED_DIR = os.environ.get("AHP_CACHE_DIR")
+configure_ahp_cache(
+    max_entries=AHP_CACHE_MAX_ENTRIES,
+    backend=DirectoryCacheBackend(AHP_CACHE_SHARED_DIR) if AHP_CACHE_SHARED_DIR else None,
+)
+
+# Mức log của tầng CSDL (model.*): DEBUG để xem chi tiết từng truy vấn, mặc định chỉ cảnh báo/lỗi
+MODEL_LOG_LEVEL = os.environ.get("AHP_MODEL_LOG_LEVEL", "WARNING").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("model").setLevel(MODEL_LOG_LEVEL)
+# /db_pool_stats lộ chi tiết pool CSDL: chỉ mở khi chạy debug hoặc đặt AHP_DB_POOL_STATS=1
+DB_POOL_STATS_ENABLED = os.environ.get("AHP_DB_POOL_STATS") == "1"
+
+# Số phân tích mỗi trang /history (model giới hạn tối đa AHP_HISTORY_MAX_PAGE_SIZE)
+HISTORY_PAGE_SIZE = 20
+
+# Trạng thái tính CR trực tiếp theo từng ô: (flask_session_id, matrix_key) -> (state, kết quả gần nhất)
+LIVE_CHECK_MAX_STATES = 512
+_live_check_states = OrderedDict()
+_live_check_lock = threading.Lock()
 
 CHARTS_FOLDER = os.path.join(app.static_folder, "generated_charts")
 if not os.path.exists(CHARTS_FOLDER):
@@ -136,10 +227,11 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_matrix_from_sheet(sheet, expected_headers, expected_row_labels, sheet_title_for_error=""):
+def parse_matrix_from_sheet(sheet, expected_headers, expected_row_labels, sheet_title_for_error="", allow_fuzzy=False):
     """
     Hàm chung để đọc ma trận từ một sheet (cho MaTranTieuChi).
     Trả về ma trận dạng numpy array hoặc None nếu có lỗi.
+    allow_fuzzy: chấp nhận ô "l-m-u" (ma trận mờ (n, n, 3)).
     """
     if not sheet_title_for_error:
         sheet_title_for_error = sheet.title
@@ -175,40 +267,32 @@ def parse_matrix_from_sheet(sheet, expected_headers, expected_row_labels, sheet_
     row_label_map_excel = {name: i for i, name in enumerate(row_labels_excel)}
 
     n = len(expected_headers)
-    matrix_str = np.ones((n, n), dtype=object)
-
-    for r_idx_expected, r_name_expected in enumerate(expected_headers): # Dùng expected_headers cho cả row và col
-        excel_r_idx = row_label_map_excel.get(r_name_expected)
-        if excel_r_idx is None: # Lỗi logic, đã check ở trên
-             flash(f"Lỗi nội bộ: Không tìm thấy row label '{r_name_expected}' trong map Excel.", "error"); return None
-
-        for c_idx_expected, c_name_expected in enumerate(expected_headers):
-            excel_c_idx = header_map_excel.get(c_name_expected)
-            if excel_c_idx is None: # Lỗi logic
-                flash(f"Lỗi nội bộ: Không tìm thấy header '{c_name_expected}' trong map Excel.", "error"); return None
-            
-            cell_value = sheet.cell(row=excel_r_idx + 2, column=excel_c_idx + 2).value
-            matrix_str[r_idx_expected, c_idx_expected] = str(cell_value) if cell_value is not None else "1"
+    # Đọc toàn bộ vùng giá trị một lần rồi sắp xếp lại theo thứ tự mong đợi bằng chỉ số numpy
+    sheet_values = np.array(
+        list(sheet.iter_rows(min_row=2, max_row=len(row_labels_excel) + 1, min_col=2,
+                             max_col=len(headers_excel) + 1, values_only=True)),
+        dtype=object,
+    )
+    row_order = [row_label_map_excel[name] for name in expected_headers] # Dùng expected_headers cho cả row và col
+    col_order = [header_map_excel[name] for name in expected_headers]
+    matrix_raw = sheet_values[np.ix_(row_order, col_order)]
+    # Chỉ đường chéo trống mới mặc định "1"; ô trống ở tam giác trên là phán đoán còn thiếu
+    diagonal = np.diagonal(matrix_raw).copy()
+    diagonal[diagonal == None] = "1"  # noqa: E711 - so sánh từng phần tử của mảng object
+    np.fill_diagonal(matrix_raw, diagonal)
 
-    parsed_matrix_values = np.ones((n, n), dtype=float)
     try:
-        for i in range(n):
-            for j in range(n):
-                value_s = matrix_str[i, j]
-                if i == j:
-                    parsed_matrix_values[i, j] = parse_saaty_value(value_s.strip(), is_diagonal=True)
-                elif i < j:
-                    parsed_val = parse_saaty_value(value_s.strip())
-                    parsed_matrix_values[i, j] = parsed_val
-                    parsed_matrix_values[j, i] = 1.0 / parsed_val if abs(parsed_val) > 1e-9 else np.inf
-    except ValueError as e:
+        parse_matrix = parse_comparison_matrix if allow_fuzzy else parse_saaty_matrix
+        parsed_matrix_values = parse_matrix(matrix_raw, labels=expected_headers)
+    except SaatyMatrixError as e:
         flash(f"Lỗi giá trị Saaty không hợp lệ trong sheet '{sheet_title_for_error}': {e}", "error")
         return None
     return parsed_matrix_values
 
-def parse_single_matrix_block(sheet, start_row_header, num_alternatives, alternative_names_ordered, sheet_title_for_error=""):
+def parse_single_matrix_block(sheet, start_row_header, num_alternatives, alternative_names_ordered, sheet_title_for_error="", allow_fuzzy=False):
     """
     Đọc một khối ma trận phương án từ sheet `TatCaMaTranPA`.
+    allow_fuzzy: chấp nhận ô "l-m-u" (ma trận mờ (n, n, 3)).
     """
     if not sheet_title_for_error:
         sheet_title_for_error = sheet.title
@@ -235,37 +319,245 @@ def parse_single_matrix_block(sheet, start_row_header, num_alternatives, alterna
     header_map_excel = {name: i for i, name in enumerate(headers_excel)}
     row_label_map_excel = {name: i for i, name in enumerate(row_labels_excel)}
 
-    matrix_str = np.ones((num_alternatives, num_alternatives), dtype=object)
-    for r_idx_expected, r_name_expected in enumerate(alternative_names_ordered):
-        excel_r_idx = row_label_map_excel.get(r_name_expected)
-        if excel_r_idx is None: flash(f"Lỗi nội bộ: Không tìm thấy Phương án '{r_name_expected}' trong row labels map.", "error"); return None
+    sheet_values = np.array(
+        list(sheet.iter_rows(min_row=start_row_header + 1, max_row=start_row_header + num_alternatives,
+                             min_col=2, max_col=1 + num_alternatives, values_only=True)),
+        dtype=object,
+    )
+    row_order = [row_label_map_excel[name] for name in alternative_names_ordered]
+    col_order = [header_map_excel[name] for name in alternative_names_ordered]
+    matrix_raw = sheet_values[np.ix_(row_order, col_order)]
+    # Chỉ đường chéo trống mới mặc định "1"; ô trống ở tam giác trên là phán đoán còn thiếu
+    diagonal = np.diagonal(matrix_raw).copy()
+    diagonal[diagonal == None] = "1"  # noqa: E711 - so sánh từng phần tử của mảng object
+    np.fill_diagonal(matrix_raw, diagonal)
 
-        for c_idx_expected, c_name_expected in enumerate(alternative_names_ordered):
-            excel_c_idx = header_map_excel.get(c_name_expected)
-            if excel_c_idx is None: flash(f"Lỗi nội bộ: Không tìm thấy Phương án '{c_name_expected}' trong headers map.", "error"); return None
-            
-            cell_value = sheet.cell(row=start_row_header + 1 + excel_r_idx, column=2 + excel_c_idx).value
-            matrix_str[r_idx_expected, c_idx_expected] = str(cell_value) if cell_value is not None else "1"
-            
-    parsed_matrix_values = np.ones((num_alternatives, num_alternatives), dtype=float)
     try:
-        for i in range(num_alternatives):
-            for j in range(num_alternatives):
-                value_s = matrix_str[i,j]
-                if i == j:
-                    parsed_matrix_values[i, j] = parse_saaty_value(value_s.strip(), is_diagonal=True)
-                elif i < j:
-                    parsed_val = parse_saaty_value(value_s.strip())
-                    parsed_matrix_values[i, j] = parsed_val
-                    parsed_matrix_values[j, i] = 1.0 / parsed_val if abs(parsed_val) > 1e-9 else np.inf
-    except ValueError as e:
+        parse_matrix = parse_comparison_matrix if allow_fuzzy else parse_saaty_matrix
+        parsed_matrix_values = parse_matrix(matrix_raw, labels=alternative_names_ordered)
+    except SaatyMatrixError as e:
         flash(f"Lỗi giá trị Saaty không hợp lệ trong ma trận Phương án (bắt đầu dòng header {start_row_header}) sheet '{sheet_title_for_error}': {e}", "error")
         return None
     return parsed_matrix_values
 
+def parse_marked_matrix_blocks(sheet, marker, labels_by_name, source_sheet_name, allow_fuzzy=False):
+    """
+    Đọc các khối ma trận trong một sheet, mỗi khối bắt đầu bằng dòng "<marker><tên>" ở cột A.
+    labels_by_name: tên khối -> nhãn hàng/cột mong đợi. Trả về dict tên -> ma trận, None nếu lỗi (đã flash).
+    """
+    blocks = {}
+    current_row = 1
+    while current_row <= sheet.max_row:
+        cell_value = sheet.cell(row=current_row, column=1).value
+        if cell_value and isinstance(cell_value, str) and cell_value.startswith(marker):
+            block_name = cell_value[len(marker):].strip()
+            if block_name not in labels_by_name:
+                flash(f"Tên '{block_name}' (dòng {current_row}) trong '{sheet.title}' không khớp '{source_sheet_name}'.", "error")
+                return None
+            block_labels = labels_by_name[block_name]
+            matrix_np = parse_single_matrix_block(sheet, current_row + 1, len(block_labels), block_labels, allow_fuzzy=allow_fuzzy)
+            if matrix_np is None: return None
+            blocks[block_name] = matrix_np
+            current_row += (1 + len(block_labels))
+        current_row += 1
+
+    if len(blocks) != len(labels_by_name):
+        missing = set(labels_by_name) - set(blocks)
+        flash(f"Thiếu ma trận cho: {', '.join(missing)} trong sheet '{sheet.title}'.", "error")
+        return None
+    return blocks
+
+def read_ahp_workbook(workbook, allow_fuzzy=False):
+    """
+    Đọc một workbook theo mẫu import (DanhSach, MaTranTieuChi, TatCaMaTranPA).
+    Trả về dict gồm criteria_names, alternative_names, criteria_matrix (m, m) và
+    alternative_matrices (m, n, n) theo thứ tự tiêu chí; None nếu có lỗi (đã flash).
+    allow_fuzzy: ô "l-m-u" cho ma trận mờ; criteria_matrix thành (m, m, 3) và nếu có một ma trận
+    phương án mờ thì alternative_matrices thành (m, n, n, 3).
+    """
+    if SHEET_NAME_LISTS not in workbook.sheetnames:
+        flash(f"Không tìm thấy sheet '{SHEET_NAME_LISTS}' trong file Excel.", "error"); return None
+
+    sheet_lists = workbook[SHEET_NAME_LISTS]
+    criteria_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, max_col=1) if row[0].value]
+    alternative_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, min_col=2, max_col=2) if row[0].value]
+
+    if not criteria_names or len(criteria_names) < 4:
+        flash('Cần ít nhất 4 tiêu chí trong sheet "DanhSach".', 'error'); return None
+    if not alternative_names or len(alternative_names) < 3:
+        flash('Cần ít nhất 3 phương án trong sheet "DanhSach".', 'error'); return None
+
+    if SHEET_NAME_CRITERIA_MATRIX not in workbook.sheetnames:
+        flash(f"Không tìm thấy sheet '{SHEET_NAME_CRITERIA_MATRIX}'.", "error"); return None
+    sheet_crit_matrix = workbook[SHEET_NAME_CRITERIA_MATRIX]
+    criteria_matrix_np = parse_matrix_from_sheet(sheet_crit_matrix, criteria_names, criteria_names, allow_fuzzy=allow_fuzzy)
+    if criteria_matrix_np is None: return None
+
+    if SHEET_NAME_ALL_ALT_MATRICES not in workbook.sheetnames:
+        flash(f"Không tìm thấy sheet '{SHEET_NAME_ALL_ALT_MATRICES}'.", "error"); return None
+    alternative_blocks = parse_marked_matrix_blocks(
+        workbook[SHEET_NAME_ALL_ALT_MATRICES], CRITERION_BLOCK_MARKER,
+        {name: alternative_names for name in criteria_names}, SHEET_NAME_LISTS, allow_fuzzy=allow_fuzzy,
+    )
+    if alternative_blocks is None: return None
+    alternative_matrices_np = stack_comparison_matrices(
+        [alternative_blocks[name] for name in criteria_names], len(alternative_names))
+    return {
+        "criteria_names": criteria_names,
+        "alternative_names": alternative_names,
+        "criteria_matrix": criteria_matrix_np,
+        "alternative_matrices": alternative_matrices_np,
+    }
+
+def read_hierarchy_workbook(workbook):
+    """
+    Đọc workbook AHP phân cấp: DanhSach (tiêu chí lá, phương án), CayTieuChi (nút cha, nút con;
+    nút cha trống = mức cao nhất), MaTranTieuChi (các nút mức cao nhất), MaTranNhanh (khối "Nhánh: <tên>"
+    cho mỗi nút có từ 2 con) và TatCaMaTranPA (cho mỗi tiêu chí lá). Trả về None nếu có lỗi (đã flash).
+    """
+    for sheet_name in (SHEET_NAME_LISTS, SHEET_NAME_CRITERIA_TREE, SHEET_NAME_CRITERIA_MATRIX, SHEET_NAME_ALL_ALT_MATRICES):
+        if sheet_name not in workbook.sheetnames:
+            flash(f"Không tìm thấy sheet '{sheet_name}' trong file Excel.", "error"); return None
+
+    sheet_lists = workbook[SHEET_NAME_LISTS]
+    criteria_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, max_col=1) if row[0].value]
+    alternative_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, min_col=2, max_col=2) if row[0].value]
+    if not criteria_names or not alternative_names or len(alternative_names) < 3:
+        flash('Cần danh sách tiêu chí lá và ít nhất 3 phương án trong sheet "DanhSach".', 'error'); return None
+
+    top_level_names, children_by_parent, parent_of = [], {}, {}
+    for parent_name, child_name in workbook[SHEET_NAME_CRITERIA_TREE].iter_rows(min_row=2, max_col=2, values_only=True):
+        if not child_name: continue
+        child_name, parent_name = str(child_name).strip(), str(parent_name).strip() if parent_name else None
+        if child_name in parent_of or child_name in top_level_names:
+            flash(f"Nút '{child_name}' xuất hiện nhiều lần trong sheet '{SHEET_NAME_CRITERIA_TREE}'.", "error"); return None
+        if parent_name:
+            parent_of[child_name] = parent_name
+            children_by_parent.setdefault(parent_name, []).append(child_name)
+        else:
+            top_level_names.append(child_name)
+
+    leaf_names = (set(parent_of) | set(top_level_names)) - set(children_by_parent)
+    if leaf_names != set(criteria_names):
+        flash(f"Tiêu chí lá trong '{SHEET_NAME_CRITERIA_TREE}' ({sorted(leaf_names)}) không khớp danh sách tiêu chí '{SHEET_NAME_LISTS}'.", "error")
+        return None
+
+    top_matrix = parse_matrix_from_sheet(workbook[SHEET_NAME_CRITERIA_MATRIX], top_level_names, top_level_names)
+    if top_matrix is None: return None
+    branch_labels = {name: children for name, children in children_by_parent.items() if len(children) > 1}
+    branch_matrices = {}
+    if branch_labels:
+        if SHEET_NAME_BRANCH_MATRICES not in workbook.sheetnames:
+            flash(f"Không tìm thấy sheet '{SHEET_NAME_BRANCH_MATRICES}' trong file Excel.", "error"); return None
+        branch_matrices = parse_marked_matrix_blocks(
+            workbook[SHEET_NAME_BRANCH_MATRICES], BRANCH_BLOCK_MARKER, branch_labels, SHEET_NAME_CRITERIA_TREE)
+        if branch_matrices is None: return None
+
+    # Dựng cây lồng nhau; nút không đi tới được từ mức cao nhất nghĩa là có chu trình hoặc cha không tồn tại
+    nodes = {name: {"name": name} for name in set(parent_of) | set(top_level_names) | set(children_by_parent)}
+    for parent_name, children in children_by_parent.items():
+        nodes[parent_name]["children"] = [nodes[child] for child in children]
+        nodes[parent_name]["matrix"] = branch_matrices.get(parent_name)
+    tree = {"name": "Mục tiêu", "children": [nodes[name] for name in top_level_names], "matrix": top_matrix}
+    reachable, stack = set(), list(top_level_names)
+    while stack:
+        name = stack.pop()
+        reachable.add(name)
+        stack.extend(children_by_parent.get(name, []))
+    if reachable != set(nodes):
+        flash(f"Cây tiêu chí không hợp lệ (chu trình hoặc nút cha không có): {', '.join(sorted(set(nodes) - reachable))}.", "error")
+        return None
+
+    alternative_blocks = parse_marked_matrix_blocks(
+        workbook[SHEET_NAME_ALL_ALT_MATRICES], CRITERION_BLOCK_MARKER,
+        {name: alternative_names for name in criteria_names}, SHEET_NAME_LISTS,
+    )
+    if alternative_blocks is None: return None
+    return {
+        "tree": tree,
+        "criteria_names": criteria_names,
+        "alternative_names": alternative_names,
+        "alternative_matrices": np.stack([alternative_blocks[name] for name in criteria_names]),
+    }
+
+
+def read_ratings_workbook(workbook, criteria_names):
+    """
+    Đọc workbook ratings: MucDanhGia (mỗi tiêu chí một khối "Tiêu chí: <tên>", dòng tiếp theo là tên các mức
+    rồi ma trận so sánh cặp các mức) và ThuaDat (cột A mã thửa, các cột tiêu chí ghi tên mức).
+    Mở được ở chế độ read_only cho bảng thửa lớn. Trả về None nếu có lỗi (đã flash).
+    """
+    for sheet_name in (SHEET_NAME_GRADES, SHEET_NAME_PARCELS):
+        if sheet_name not in workbook.sheetnames:
+            flash(f"Không tìm thấy sheet '{sheet_name}' trong file Excel.", "error"); return None
+
+    sheet_grades = workbook[SHEET_NAME_GRADES]
+    grade_rows = list(sheet_grades.iter_rows(values_only=True))
+    grade_names, grade_matrices = {}, {}
+    for row_idx, row in enumerate(grade_rows):
+        cell_value = row[0] if row else None
+        if not (isinstance(cell_value, str) and cell_value.startswith(CRITERION_BLOCK_MARKER)):
+            continue
+        criterion_name = cell_value[len(CRITERION_BLOCK_MARKER):].strip()
+        if criterion_name not in criteria_names:
+            flash(f"Tiêu chí '{criterion_name}' (dòng {row_idx + 1}) trong '{SHEET_NAME_GRADES}' không thuộc các tiêu chí đã chọn.", "error")
+            return None
+        header = grade_rows[row_idx + 1] if row_idx + 1 < len(grade_rows) else ()
+        names = [str(value).strip() for value in header[1:] if value is not None]
+        if not names:
+            flash(f"Thiếu tên các mức cho tiêu chí '{criterion_name}' trong '{SHEET_NAME_GRADES}'.", "error"); return None
+        matrix_np = parse_single_matrix_block(sheet_grades, row_idx + 2, len(names), names)
+        if matrix_np is None: return None
+        grade_names[criterion_name], grade_matrices[criterion_name] = names, matrix_np
+    if set(grade_names) != set(criteria_names):
+        flash(f"Thiếu mức đánh giá cho: {', '.join(sorted(set(criteria_names) - set(grade_names)))} trong sheet '{SHEET_NAME_GRADES}'.", "error")
+        return None
+
+    parcel_rows = workbook[SHEET_NAME_PARCELS].iter_rows(values_only=True)
+    header = [str(value).strip() if value is not None else "" for value in next(parcel_rows, ())]
+    missing_columns = [name for name in criteria_names if name not in header[1:]]
+    if missing_columns:
+        flash(f"Sheet '{SHEET_NAME_PARCELS}' thiếu cột tiêu chí: {', '.join(missing_columns)}.", "error"); return None
+    column_idx = [header.index(name) for name in criteria_names]
+    parcel_ids, columns = [], [[] for _ in criteria_names]
+    for row in parcel_rows:
+        if not row or row[0] is None: continue
+        parcel_ids.append(str(row[0]))
+        for k, col in enumerate(column_idx):
+            columns[k].append(row[col] if col < len(row) else None)
+    if not parcel_ids:
+        flash(f"Sheet '{SHEET_NAME_PARCELS}' không có thửa đất nào.", "error"); return None
+
+    try:
+        grade_indices = np.column_stack([
+            encode_grades(columns[k], grade_names[name], name) for k, name in enumerate(criteria_names)
+        ])
+    except ValueError as e:
+        flash(f"Lỗi dữ liệu sheet '{SHEET_NAME_PARCELS}': {e}", "error"); return None
+    return {
+        "grade_names": [grade_names[name] for name in criteria_names],
+        "grade_matrices": [grade_matrices[name] for name in criteria_names],
+        "parcel_ids": parcel_ids,
+        "grade_indices": grade_indices,
+    }
+
+def format_saaty_value(value):
+    """Giá trị so sánh -> chuỗi nhập trên form (3, 1/5, ...); NaN (ô thiếu) thành chuỗi rỗng."""
+    if np.isnan(value): # Ô thiếu (ma trận không đầy đủ) để trống
+        return ""
+    if 0 < value < 1:
+        inv_value = 1.0 / value
+        if abs(inv_value - round(inv_value)) < 1e-6 :
+             return f"1/{int(round(inv_value))}"
+        return f"{value:.4f}".rstrip('0').rstrip('.')
+    if value >=1:
+        return str(int(value)) if abs(value - round(value)) < 1e-6 else f"{value:.4f}".rstrip('0').rstrip('.')
+    return str(value) # value = 0 or inf, ... để thể hiện lỗi nếu có
+
 def convert_numpy_matrix_to_form_data(matrix_np, form_prefix, crit_idx=None):
     form_data = {}
-    n_rows, n_cols = matrix_np.shape
+    matrix_np = np.asarray(matrix_np, dtype=float)
+    n_rows, n_cols = matrix_np.shape[:2]
     for r in range(n_rows):
         for c in range(n_cols):
             key_base = f"[{r}][{c}]"
@@ -275,17 +567,22 @@ def convert_numpy_matrix_to_form_data(matrix_np, form_prefix, crit_idx=None):
                 form_data[key] = "1"
             elif r < c: # Chỉ điền nửa trên cho form
                 value = matrix_np[r, c]
-                if 0 < value < 1:
-                    inv_value = 1.0 / value
-                    if abs(inv_value - round(inv_value)) < 1e-6 :
-                         form_data[key] = f"1/{int(round(inv_value))}"
-                    else:
-                         form_data[key] = f"{value:.4f}".rstrip('0').rstrip('.')
-                elif value >=1:
-                    form_data[key] = str(int(value)) if abs(value - round(value)) < 1e-6 else f"{value:.4f}".rstrip('0').rstrip('.')
-                else: # value = 0 or inf, ...
-                    form_data[key] = str(value) # Để thể hiện lỗi nếu có
+                if matrix_np.ndim == 3 and value[0] != value[2]: # Số mờ (l, m, u) viết lại dạng "l-m-u"
+                    form_data[key] = "-".join(format_saaty_value(v) for v in value)
+                else:
+                    form_data[key] = format_saaty_value(value[1] if matrix_np.ndim == 3 else value)
     return form_data
+def read_raw_matrix_from_form(form_data, n, form_prefix, crit_idx=None):
+    """
+    Lấy các ô tam giác trên của ma trận từ form thành list (n, n) chuỗi thô cho parse_saaty_matrix.
+    Đường chéo và tam giác dưới (chỉ hiển thị, không nhập) được đặt là "1"; ô trống giữ nguyên (ô thiếu).
+    """
+    prefix = form_prefix if crit_idx is None else f"{form_prefix}[{crit_idx}]"
+    return [
+        [form_data.get(f"{prefix}[{r}][{c}]") if r < c else "1" for c in range(n)]
+        for r in range(n)
+    ]
+
 def convert_all_alt_matrices_to_form_data(imported_alternative_matrices, criteria_tuples, alternatives_tuples):
     """
     Chuyển đổi tất cả các ma trận phương án (import từ Excel) thành dict form_data cho render template.
@@ -316,8 +613,8 @@ def home():
         session.pop(key, None)
     return render_template(
         "matrix.html",
-        criteria=get_criteria_from_db(), # Dùng cho form chọn thủ công ban đầu
-        alternatives=get_all_alternatives(), # Dùng cho form chọn thủ công
+        criteria=criteria_catalog().rows, # Dùng cho form chọn thủ công ban đầu
+        alternatives=alternatives_catalog().rows, # Dùng cho form chọn thủ công
         show_input_forms=True,
         show_ahp_steps=False,
         show_alternatives_form=False,
@@ -415,61 +712,22 @@ def import_excel_route():
         try:
             workbook = load_workbook(filename=io.BytesIO(file.read()))
 
-            if SHEET_NAME_LISTS not in workbook.sheetnames:
-                flash(f"Không tìm thấy sheet '{SHEET_NAME_LISTS}' trong file Excel.", "error"); return redirect(url_for('home'))
-            
-            sheet_lists = workbook[SHEET_NAME_LISTS]
-            criteria_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, max_col=1) if row[0].value]
-            alternative_names = [row[0].value for row in sheet_lists.iter_rows(min_row=2, min_col=2, max_col=2) if row[0].value]
+            workbook_data = read_ahp_workbook(workbook, allow_fuzzy=True)
+            if workbook_data is None: return redirect(url_for('home'))
+            criteria_names = workbook_data["criteria_names"]
+            alternative_names = workbook_data["alternative_names"]
+            criteria_matrix_np = workbook_data["criteria_matrix"]
             # Lấy ID thực tế từ DB
-            criteria_db = get_criteria_from_db()  # [(id, name), ...]
-            criteria_name_to_id = {name: id for id, name in criteria_db}
-            alternatives_db = get_all_alternatives()
-            alternative_name_to_id = {name: id for id, name in alternatives_db}
-
-            if not criteria_names or len(criteria_names) < 4:
-                flash('Cần ít nhất 4 tiêu chí trong sheet "DanhSach".', 'error'); return redirect(url_for('home'))
-            if not alternative_names or len(alternative_names) < 3:
-                flash('Cần ít nhất 3 phương án trong sheet "DanhSach".', 'error'); return redirect(url_for('home'))
-            
+            criteria_name_to_id = criteria_catalog().id_by_name
+            alternative_name_to_id = alternatives_catalog().id_by_name
+
             # Dùng đúng ID thực tế
             session['current_criteria_tuples'] = [(criteria_name_to_id[name], name) for name in criteria_names if name in criteria_name_to_id]
             session['current_alternatives_tuples'] = [(alternative_name_to_id[name], name) for name in alternative_names if name in alternative_name_to_id]
-            num_alternatives = len(alternative_names)
-
-            if SHEET_NAME_CRITERIA_MATRIX not in workbook.sheetnames:
-                flash(f"Không tìm thấy sheet '{SHEET_NAME_CRITERIA_MATRIX}'.", "error"); return redirect(url_for('home'))
-            sheet_crit_matrix = workbook[SHEET_NAME_CRITERIA_MATRIX]
-            criteria_matrix_np = parse_matrix_from_sheet(sheet_crit_matrix, criteria_names, criteria_names)
-            if criteria_matrix_np is None: return redirect(url_for('home'))
             session['imported_criteria_matrix'] = criteria_matrix_np.tolist()
-
-            if SHEET_NAME_ALL_ALT_MATRICES not in workbook.sheetnames:
-                flash(f"Không tìm thấy sheet '{SHEET_NAME_ALL_ALT_MATRICES}'.", "error"); return redirect(url_for('home'))
-            sheet_all_pa = workbook[SHEET_NAME_ALL_ALT_MATRICES]
-            imported_alternative_matrices = {}
-            found_criteria_in_pa_sheet = set()
-            current_row = 1
-            while current_row <= sheet_all_pa.max_row:
-                cell_value = sheet_all_pa.cell(row=current_row, column=1).value
-                if cell_value and isinstance(cell_value, str) and cell_value.startswith(CRITERION_BLOCK_MARKER):
-                    criterion_name_from_marker = cell_value[len(CRITERION_BLOCK_MARKER):].strip()
-                    if criterion_name_from_marker not in criteria_names:
-                        flash(f"Tên tiêu chí '{criterion_name_from_marker}' (dòng {current_row}) trong '{SHEET_NAME_ALL_ALT_MATRICES}' không khớp '{SHEET_NAME_LISTS}'.", "error")
-                        return redirect(url_for('home'))
-                    crit_idx = criteria_names.index(criterion_name_from_marker)
-                    found_criteria_in_pa_sheet.add(criterion_name_from_marker)
-                    
-                    alt_matrix_np = parse_single_matrix_block(sheet_all_pa, current_row + 1, num_alternatives, alternative_names)
-                    if alt_matrix_np is None: return redirect(url_for('home'))
-                    imported_alternative_matrices[str(crit_idx)] = alt_matrix_np.tolist()
-                    current_row += (1 + num_alternatives) 
-                current_row += 1
-            
-            if len(found_criteria_in_pa_sheet) != len(criteria_names):
-                missing = set(criteria_names) - found_criteria_in_pa_sheet
-                flash(f"Thiếu ma trận Phương án cho các tiêu chí: {', '.join(missing)} trong sheet '{SHEET_NAME_ALL_ALT_MATRICES}'.", "error")
-                return redirect(url_for('home'))
+            imported_alternative_matrices = {
+                str(crit_idx): alt_matrix_np.tolist() for crit_idx, alt_matrix_np in enumerate(workbook_data["alternative_matrices"])
+            }
 
             session['imported_alternative_matrices'] = imported_alternative_matrices
             session['data_imported_from_excel'] = True
@@ -494,6 +752,141 @@ def import_excel_route():
         return redirect(url_for('home'))
 
 
+@app.route('/import_group_excel', methods=['POST'])
+def import_group_excel_route():
+    """AHP nhóm: mỗi file Excel là một chuyên gia; đọc và gộp lần lượt, không lưu ma trận vào session."""
+    expert_files = [f for f in request.files.getlist('expert_files') if f and f.filename]
+    if len(expert_files) < 2:
+        flash('Cần ít nhất 2 file Excel (mỗi chuyên gia một file) để gộp ý kiến nhóm.', 'error')
+        return redirect(url_for('home'))
+    current_session_db_id = get_or_create_session_db_id(session.get("flask_session_id"))
+    if not current_session_db_id:
+        flash("Lỗi phiên làm việc. Vui lòng thử lại.", "error")
+        return redirect(url_for('home'))
+
+    accumulator = None
+    try:
+        for file in expert_files:
+            if not allowed_file(file.filename):
+                flash(f"File '{file.filename}' không hợp lệ. Chỉ chấp nhận file .xlsx.", 'error')
+                return redirect(url_for('home'))
+            workbook_data = read_ahp_workbook(load_workbook(filename=io.BytesIO(file.read())))
+            if workbook_data is None:
+                flash(f"Không đọc được file của chuyên gia '{file.filename}'.", 'error')
+                return redirect(url_for('home'))
+
+            if accumulator is None:
+                criteria_names = workbook_data["criteria_names"]
+                alternative_names = workbook_data["alternative_names"]
+                accumulator = GroupAHPAccumulator(
+                    len(criteria_names), len(alternative_names), method=AHP_PRIORITIZATION_METHOD,
+                    weight_by_cr=request.form.get('weight_by_cr') == 'on',
+                )
+            elif (sorted(workbook_data["criteria_names"]) != sorted(criteria_names)
+                  or sorted(workbook_data["alternative_names"]) != sorted(alternative_names)):
+                flash(f"Danh sách tiêu chí/phương án trong file '{file.filename}' khác file đầu tiên.", 'error')
+                return redirect(url_for('home'))
+            # Sắp xếp lại theo thứ tự tiêu chí/phương án của file đầu tiên
+            crit_order = [workbook_data["criteria_names"].index(name) for name in criteria_names]
+            alt_order = [workbook_data["alternative_names"].index(name) for name in alternative_names]
+            accumulator.add_expert(
+                workbook_data["criteria_matrix"][np.ix_(crit_order, crit_order)],
+                workbook_data["alternative_matrices"][crit_order][:, alt_order][:, :, alt_order],
+                name=file.filename,
+            )
+        group_result = accumulator.result()
+    except ValueError as e:
+        flash(f"Lỗi khi gộp ý kiến nhóm: {e}", 'error')
+        return redirect(url_for('home'))
+
+    criteria_results = group_result["criteria_results"]
+    final_scores = group_result["aij_scores"]
+    result_data = {
+        "analysis_name": f"AHP nhóm ({group_result['n_experts']} chuyên gia)",
+        "criteria_names": criteria_names, "criteria_weights": criteria_results["weights"],
+        "alternatives": alternative_names, "alternative_scores": final_scores.tolist(),
+        "ranked_alternatives": sorted(zip(alternative_names, final_scores.tolist()), key=lambda x: x[1], reverse=True),
+        "cr_criteria": criteria_results.get("CR"), "is_consistent_criteria": criteria_results.get("is_consistent"),
+        "alternative_crs": {str(idx): compact_ahp_result(res) for idx, res in enumerate(group_result["alternative_results"])},
+        "local_alternative_weights_matrix": group_result["local_alternative_weights_matrix"].tolist(),
+        "notes": f"Gộp AIJ từ {group_result['n_experts']} chuyên gia"
+                 + (", trọng số theo CR." if group_result["weight_by_cr"] else "."),
+        "group": {
+            "n_experts": group_result["n_experts"],
+            "weight_by_cr": group_result["weight_by_cr"],
+            "experts": group_result["experts"],
+            "aip_scores": group_result["aip_scores"].tolist(),
+        },
+    }
+    result_data["charts"] = generate_charts_to_files(
+        result_data["ranked_alternatives"], criteria_names, result_data["criteria_weights"])
+    saved_analysis_id = save_ahp_analysis(current_session_db_id, result_data)
+    if saved_analysis_id:
+        flash(f"Kết quả AHP nhóm đã được lưu (ID: {saved_analysis_id}).", "success")
+        result_data["analysis_id_for_report"] = saved_analysis_id
+    else: flash("Lưu kết quả AHP nhóm thất bại.", "error")
+    return render_template("result.html", **result_data)
+
+
+@app.route('/import_hierarchy_excel', methods=['POST'])
+def import_hierarchy_excel_route():
+    """AHP phân cấp (tiêu chí con) từ một file Excel; tính toàn bộ cây và phương án trong một lần."""
+    file = request.files.get('hierarchy_file')
+    if not file or file.filename == '' or not allowed_file(file.filename):
+        flash('Vui lòng chọn một file .xlsx cây tiêu chí.', 'error')
+        return redirect(url_for('home'))
+    current_session_db_id = get_or_create_session_db_id(session.get("flask_session_id"))
+    if not current_session_db_id:
+        flash("Lỗi phiên làm việc. Vui lòng thử lại.", "error")
+        return redirect(url_for('home'))
+
+    try:
+        workbook_data = read_hierarchy_workbook(load_workbook(filename=io.BytesIO(file.read())))
+        if workbook_data is None: return redirect(url_for('home'))
+        hierarchy = evaluate_hierarchy(compile_hierarchy(workbook_data["tree"]), method=AHP_PRIORITIZATION_METHOD)
+        criteria_names = workbook_data["criteria_names"]
+        alternative_names = workbook_data["alternative_names"]
+        leaf_weight_by_name = {hierarchy["names"][idx]: hierarchy["global_weights"][idx] for idx in hierarchy["leaves"]}
+        criteria_weights_vector = np.array([leaf_weight_by_name[name] for name in criteria_names])
+
+        alt_batch_results = calculate_ahp_batch(
+            workbook_data["alternative_matrices"], [f"Phương án (TC: {name})" for name in criteria_names],
+            method=AHP_PRIORITIZATION_METHOD,
+        )
+        alt_errors = [err for err in alt_batch_results["error"] if err]
+        if alt_errors: raise ValueError("; ".join(alt_errors))
+    except ValueError as e:
+        flash(f"Lỗi khi tính AHP phân cấp: {e}", 'error')
+        return redirect(url_for('home'))
+
+    inconsistent_branches = [hierarchy["names"][node_idx] for b, (node_idx, _, _, _) in enumerate(hierarchy["branches"])
+                             if not hierarchy["branch_consistent"][b]]
+    if inconsistent_branches:
+        flash(f"Ma trận nhánh KHÔNG nhất quán: {', '.join(inconsistent_branches)}. Kết quả có thể không đáng tin cậy.", "warning")
+    if not alt_batch_results["is_consistent"].all():
+        flash("ÍT NHẤT MỘT ma trận Phương án KHÔNG nhất quán. Kết quả có thể không đáng tin cậy.", "warning")
+
+    alternative_local_scores_matrix_np = alt_batch_results["weights"].T
+    final_scores_np = alternative_local_scores_matrix_np @ criteria_weights_vector
+    result_data = {
+        "analysis_name": f"AHP phân cấp ({len(criteria_names)} tiêu chí lá)",
+        "criteria_names": criteria_names, "criteria_weights": criteria_weights_vector.tolist(),
+        "alternatives": alternative_names, "alternative_scores": final_scores_np.tolist(),
+        "ranked_alternatives": sorted(zip(alternative_names, final_scores_np.tolist()), key=lambda x: x[1], reverse=True),
+        "cr_criteria": float(hierarchy["branch_crs"].max()), "is_consistent_criteria": hierarchy["is_consistent"],
+        "alternative_crs": {str(idx): compact_ahp_result(res) for idx, res in enumerate(unpack_ahp_batch(alt_batch_results))},
+        "local_alternative_weights_matrix": alternative_local_scores_matrix_np.tolist(),
+        "hierarchy": hierarchy_to_records(hierarchy),
+    }
+    result_data["charts"] = generate_charts_to_files(
+        result_data["ranked_alternatives"], criteria_names, result_data["criteria_weights"])
+    saved_analysis_id = save_ahp_analysis(current_session_db_id, result_data)
+    if saved_analysis_id:
+        flash(f"Kết quả AHP phân cấp đã được lưu (ID: {saved_analysis_id}).", "success")
+        result_data["analysis_id_for_report"] = saved_analysis_id
+    else: flash("Lưu kết quả AHP phân cấp thất bại.", "error")
+    return render_template("result.html", **result_data)
+
 @app.route("/calculate_criteria", methods=["POST"])
 def calculate_criteria_route():
     flask_session_id_value = session.get("flask_session_id")
@@ -531,17 +924,10 @@ def calculate_criteria_route():
             form_data_criteria_to_render = session.pop("form_data_criteria_temp") 
             session.pop("specific_criteria_matrix_imported", None) 
 
-            criteria_matrix_parsed_np = np.ones((n_criteria, n_criteria), dtype=float)
-            for i in range(n_criteria):
-                for j in range(n_criteria):
-                    value_str = form_data_criteria_to_render.get(f"matrix[{i}][{j}]", "1" if i == j else None)
-                    if value_str is None and i < j:
-                        raise ValueError(f"Lỗi dữ liệu (sau import TC): Thiếu ô TC [{criteria_names_ordered[i]}] vs [{criteria_names_ordered[j]}]")
-                    value_str = value_str if value_str is not None else ("1" if i == j else "")
-                    if i == j: criteria_matrix_parsed_np[i,j] = parse_saaty_value(value_str.strip(), True)
-                    elif i < j:
-                        pv = parse_saaty_value(value_str.strip()); criteria_matrix_parsed_np[i,j] = pv
-                        criteria_matrix_parsed_np[j,i] = 1.0/pv if abs(pv)>1e-9 else np.inf
+            criteria_matrix_parsed_np = parse_comparison_matrix(
+                read_raw_matrix_from_form(form_data_criteria_to_render, n_criteria, "matrix"),
+                labels=criteria_names_ordered,
+            )
             session['imported_criteria_matrix'] = criteria_matrix_parsed_np.tolist() # Cập nhật lại session import đầy đủ
         
         # Ưu tiên 2: Nếu có import đầy đủ từ Excel (Bước 0 hoặc nút "Cập nhật")
@@ -558,21 +944,17 @@ def calculate_criteria_route():
             form_data_from_html = request.form.to_dict()
             session["form_data_criteria_temp"] = form_data_from_html # Lưu lại form hiện tại
             form_data_criteria_to_render = form_data_from_html
-            criteria_matrix_parsed_np = np.ones((n_criteria, n_criteria), dtype=float)
-            for i in range(n_criteria):
-                for j in range(n_criteria):
-                    value_str = request.form.get(f"matrix[{i}][{j}]", "1" if i == j else None)
-                    if value_str is None and i < j:
-                        raise ValueError(f"Vui lòng điền ô Tiêu chí [{criteria_names_ordered[i]}] vs [{criteria_names_ordered[j]}]")
-                    value_str = value_str if value_str is not None else ("1" if i == j else "")
-                    if i == j: criteria_matrix_parsed_np[i,j] = parse_saaty_value(value_str.strip(), True)
-                    elif i < j:
-                        pv = parse_saaty_value(value_str.strip()); criteria_matrix_parsed_np[i,j] = pv
-                        criteria_matrix_parsed_np[j,i] = 1.0/pv if abs(pv)>1e-9 else np.inf
+            criteria_matrix_parsed_np = parse_comparison_matrix(
+                read_raw_matrix_from_form(request.form, n_criteria, "matrix"),
+                labels=criteria_names_ordered,
+            )
         
-        ahp_results_criteria = calculate_ahp(criteria_matrix_parsed_np, "Ma trận Tiêu chí")
+        ahp_results_criteria = calculate_ahp(criteria_matrix_parsed_np, "Ma trận Tiêu chí", method=AHP_PRIORITIZATION_METHOD)
         session["criteria_ahp_results"] = ahp_results_criteria
+        # Ma trận mờ: lưu CSDL và gợi ý sửa CR dùng ma trận trung tâm (thành phần m)
+        criteria_modal_np = criteria_matrix_parsed_np[..., 1] if is_fuzzy_matrix(criteria_matrix_parsed_np) else criteria_matrix_parsed_np
         sorted_crit_weights_template = get_sorted_criteria_with_weights(ahp_results_criteria, db_criteria_tuples)
+        criteria_repairs = None
 
         if ahp_results_criteria.get("error"):
             flash(ahp_results_criteria["error"], "error")
@@ -582,16 +964,19 @@ def calculate_criteria_route():
             cr_disp = f"{cr_val:.4f}" if isinstance(cr_val, (float,int)) else str(cr_val)
             if is_consistent:
                 flash(f"Ma trận tiêu chí NHẤT QUÁN (CR = {cr_disp}). Đã lưu thông số.", "success")
-                if ahp_results_criteria.get("weights"):
-                    save_criteria_weights(current_session_db_id, db_criteria_tuples, ahp_results_criteria["weights"])
-                # Chỉ lưu ma trận nếu không phải từ import hoặc nếu muốn ghi đè
-                # Cân nhắc: nếu người dùng import rồi sửa trên form, có nên lưu lại ma trận đã sửa không?
-                # Hiện tại: chỉ lưu nếu không phải từ 'data_imported_from_excel' (import toàn bộ)
+                # Trọng số và ma trận so sánh ghi trong cùng một giao dịch.
+                # Chỉ lưu ma trận nếu không phải từ 'data_imported_from_excel' (import toàn bộ)
                 # và không phải từ 'specific_criteria_matrix_imported' (đã bị xóa ở trên)
-                if not session.get('data_imported_from_excel'): 
-                     save_criteria_comparison_matrix(current_session_db_id, db_criteria_tuples, criteria_matrix_parsed_np)
+                if ahp_results_criteria.get("weights"):
+                    save_criteria_step(
+                        current_session_db_id, db_criteria_tuples, ahp_results_criteria["weights"],
+                        None if session.get('data_imported_from_excel') else criteria_modal_np,
+                    )
             else:
                 flash(f"Ma trận tiêu chí KHÔNG nhất quán (CR = {cr_disp}). Thông số KHÔNG được lưu. Vui lòng sửa lại.", "error")
+                criteria_repairs = suggest_consistency_repairs(
+                    criteria_modal_np, labels=criteria_names_ordered, method=AHP_PRIORITIZATION_METHOD
+                )
         print("AHP results:", ahp_results_criteria)
         # -- Phần render template đã được tích hợp logic chuẩn bị form_data_alt_to_render ở đầu --
         return render_template(
@@ -609,9 +994,10 @@ def calculate_criteria_route():
             ),
             form_data_criteria=form_data_criteria_to_render,
             form_data_alternatives=form_data_alt_to_render, # <<<< Đã được chuẩn bị
+            criteria_repairs=criteria_repairs,
             imported_data=session.get('data_imported_from_excel', False)
         )
-    except ValueError as e: # Lỗi từ parse_saaty_value hoặc raise ValueError ở trên
+    except ValueError as e: # Lỗi từ parse_saaty_matrix hoặc raise ValueError ở trên
         flash(f"Lỗi nhập liệu ma trận tiêu chí: {e}", "error")
         # Tạo kết quả lỗi giả để hiển thị
         ahp_err_res = {
@@ -652,6 +1038,73 @@ def calculate_criteria_route():
             form_data_alternatives=form_data_alt_to_render, # <<<< Truyền đi
             imported_data=session.get('data_imported_from_excel', False)
         )
+@app.route("/check_consistency", methods=["POST"])
+def check_consistency_route():
+    """
+    Kiểm tra CR trực tiếp khi người dùng sửa từng ô (gọi bằng fetch từ matrix.html).
+    Nếu ma trận chỉ khác lần kiểm tra trước ở một ô thì cập nhật tăng dần từ trạng thái cũ,
+    ngược lại tính lại đầy đủ.
+    """
+    payload = request.get_json(silent=True) or {}
+    flask_session_id_value = session.get("flask_session_id")
+    matrix_key = str(payload.get("matrix_key", "")).strip()
+    raw_matrix = payload.get("matrix")
+    if not flask_session_id_value or not matrix_key or not isinstance(raw_matrix, list):
+        return jsonify({"ok": False, "error": "Thiếu dữ liệu để kiểm tra tính nhất quán."}), 400
+
+    try:
+        matrix_np = parse_comparison_matrix(raw_matrix)
+    except SaatyMatrixError as e:
+        return jsonify({"ok": False, "error": str(e), "cells": [[i, j] for i, j, _ in e.cells]})
+
+    cache_key = (flask_session_id_value, matrix_key)
+    with _live_check_lock:
+        cached = _live_check_states.pop(cache_key, None)
+
+    incremental = False
+    state, ahp_res = None, None
+    if is_fuzzy_matrix(matrix_np) or np.isnan(matrix_np).any():
+        # Ma trận mờ hoặc thiếu ô (ước lượng LLSM): tính lại đầy đủ, không giữ trạng thái tăng dần
+        ahp_res = calculate_ahp(matrix_np, method=AHP_PRIORITIZATION_METHOD)
+        if ahp_res.get("error"):
+            return jsonify({"ok": False, "error": ahp_res["error"]})
+    elif cached is not None and cached[0]["matrix"].shape == matrix_np.shape and cached[0]["method"] == AHP_PRIORITIZATION_METHOD:
+        changed_cells = np.argwhere(np.triu(~np.isclose(cached[0]["matrix"], matrix_np), 1))
+        if len(changed_cells) == 0:
+            state, ahp_res = cached
+        elif len(changed_cells) == 1:
+            i, j = (int(v) for v in changed_cells[0])
+            state, ahp_res = update_ahp_judgment(cached[0], i, j, matrix_np[i, j])
+            incremental = True
+    if state is None and ahp_res is None:
+        state, ahp_res = create_incremental_state(matrix_np, AHP_PRIORITIZATION_METHOD)
+        if state is None:
+            return jsonify({"ok": False, "error": ahp_res.get("error")})
+
+    if state is not None:
+        with _live_check_lock:
+            _live_check_states[cache_key] = (state, ahp_res)
+            while len(_live_check_states) > LIVE_CHECK_MAX_STATES:
+                _live_check_states.popitem(last=False)
+
+    def finite_or_none(value):
+        return value if isinstance(value, (int, float)) and math.isfinite(value) else None
+
+    return jsonify({
+        "ok": True,
+        "n": ahp_res["n"],
+        "CR": finite_or_none(ahp_res["CR"]),
+        "ci": finite_or_none(ahp_res["ci"]),
+        "lambdaMax": finite_or_none(ahp_res["lambdaMax"]),
+        "RI": ahp_res["RI"],
+        "is_consistent": ahp_res["is_consistent"],
+        "weights": ahp_res["weights"],
+        "incremental": incremental,
+        "missing_count": ahp_res.get("missing_count") or 0,
+        "fuzzy": bool(ahp_res.get("fuzzy")),
+    })
+
+
 @app.route("/calculate_final", methods=["POST"])
 def calculate_final_route():
     flask_session_id_value = session.get("flask_session_id")
@@ -685,55 +1138,54 @@ def calculate_final_route():
     criteria_names_ordered = [name for _, name in db_criteria_tuples]
     alternative_names_ordered = [name for _, name in db_alternatives_tuples]
     
-    alternative_local_scores_matrix_np = np.zeros((n_alternatives, n_criteria))
     any_alt_matrix_inconsistent = False
     any_critical_processing_error = False
     form_data_alternatives_render = {}
     alternative_ahp_results_by_crit_idx = {}
 
     try:
+        parsed_alt_matrices = [None] * n_criteria # None = chưa có/lỗi nhập liệu: ma trận toàn 1 trong chồng để tính batch
+        input_error_crit_idxs = set()
         if session.get('data_imported_from_excel') and 'imported_alternative_matrices' in session:
             imported_alt_matrices_dict_list = session['imported_alternative_matrices']
             temp_form_data_alts = {}
             for crit_idx_str, alt_matrix_list in imported_alt_matrices_dict_list.items():
                 crit_idx = int(crit_idx_str)
-                alt_matrix_parsed_np = np.array(alt_matrix_list)
-                temp_form_data_alts.update(convert_numpy_matrix_to_form_data(alt_matrix_parsed_np, "alt_matrix", crit_idx))
-                
-                matrix_name_err = f"Phương án (TC: {criteria_names_ordered[crit_idx]})"
-                alt_ahp_res = calculate_ahp(alt_matrix_parsed_np, matrix_name_err)
-                alternative_ahp_results_by_crit_idx[str(crit_idx)] = alt_ahp_res
-                if alt_ahp_res.get("error"): any_critical_processing_error = True
-                elif not alt_ahp_res.get("is_consistent", False): any_alt_matrix_inconsistent = True
-                if alt_ahp_res.get("weights"): alternative_local_scores_matrix_np[:, crit_idx] = np.array(alt_ahp_res["weights"])
-                else: any_critical_processing_error = True; alternative_local_scores_matrix_np[:, crit_idx] = 0
+                parsed_alt_matrices[crit_idx] = np.array(alt_matrix_list, dtype=float)
+                temp_form_data_alts.update(convert_numpy_matrix_to_form_data(parsed_alt_matrices[crit_idx], "alt_matrix", crit_idx))
+            input_error_crit_idxs = set(range(n_criteria)) - {int(c) for c in imported_alt_matrices_dict_list}
             form_data_alternatives_render = temp_form_data_alts
         else:
             form_data_from_html = request.form.to_dict()
             session["form_data_alternatives_temp"] = form_data_from_html
             form_data_alternatives_render = form_data_from_html
             for crit_idx in range(n_criteria):
-                alt_matrix_parsed_np = np.ones((n_alternatives, n_alternatives), dtype=float)
-                input_err_flag_alt = False
-                for i in range(n_alternatives):
-                    for j in range(n_alternatives):
-                        val_str = request.form.get(f"alt_matrix[{crit_idx}][{i}][{j}]", "1" if i==j else None)
-                        if val_str is None and i < j: input_err_flag_alt = True; flash(f"Lỗi nhập liệu Phương án cho TC {criteria_names_ordered[crit_idx]}", "error"); break
-                        val_str = val_str if val_str is not None else ("1" if i==j else "")
-                        try:
-                            if i==j: alt_matrix_parsed_np[i,j] = parse_saaty_value(val_str.strip(), True)
-                            elif i < j: pv = parse_saaty_value(val_str.strip()); alt_matrix_parsed_np[i,j] = pv; alt_matrix_parsed_np[j,i] = 1.0/pv if abs(pv)>1e-9 else np.inf
-                        except ValueError as e_parse_alt: input_err_flag_alt = True; flash(f"Lỗi giá trị Phương án cho TC {criteria_names_ordered[crit_idx]}: {e_parse_alt}", "error"); break
-                    if input_err_flag_alt: break
-                
-                if input_err_flag_alt: any_critical_processing_error = True; alt_ahp_res = {"error": "Lỗi nhập liệu ma trận Phương án."}
-                else: alt_ahp_res = calculate_ahp(alt_matrix_parsed_np, f"Phương án (TC: {criteria_names_ordered[crit_idx]})")
-                
-                alternative_ahp_results_by_crit_idx[str(crit_idx)] = alt_ahp_res
-                if alt_ahp_res.get("error"): any_critical_processing_error = True
-                elif not alt_ahp_res.get("is_consistent", False): any_alt_matrix_inconsistent = True
-                if alt_ahp_res.get("weights"): alternative_local_scores_matrix_np[:, crit_idx] = np.array(alt_ahp_res["weights"])
-                else: any_critical_processing_error = True; alternative_local_scores_matrix_np[:, crit_idx] = 0
+                try:
+                    parsed_alt_matrices[crit_idx] = parse_comparison_matrix(
+                        read_raw_matrix_from_form(request.form, n_alternatives, "alt_matrix", crit_idx),
+                        labels=alternative_names_ordered,
+                    )
+                except SaatyMatrixError as e_parse_alt:
+                    flash(f"Lỗi giá trị Phương án cho TC {criteria_names_ordered[crit_idx]}: {e_parse_alt}", "error")
+                    input_error_crit_idxs.add(crit_idx)
+        # Có ma trận mờ thì cả chồng thành (m, n, n, 3) và được tính bằng AHP mờ
+        alt_matrices_stack_np = stack_comparison_matrices(parsed_alt_matrices, n_alternatives)
+        fuzzy_alternatives = alt_matrices_stack_np.ndim == 4
+        alt_modal_stack_np = alt_matrices_stack_np[..., 1] if fuzzy_alternatives else alt_matrices_stack_np
+
+        # Tính toàn bộ ma trận Phương án trong một lần gọi vector hóa
+        alt_batch_results = calculate_ahp_batch(
+            alt_matrices_stack_np, [f"Phương án (TC: {name})" for name in criteria_names_ordered],
+            method=AHP_PRIORITIZATION_METHOD,
+        )
+        for crit_idx, alt_ahp_res in enumerate(unpack_ahp_batch(alt_batch_results)):
+            if crit_idx in input_error_crit_idxs: alt_ahp_res = {"error": "Lỗi nhập liệu ma trận Phương án."}
+            alternative_ahp_results_by_crit_idx[str(crit_idx)] = alt_ahp_res
+            if alt_ahp_res.get("error"): any_critical_processing_error = True
+            elif not alt_ahp_res.get("is_consistent", False): any_alt_matrix_inconsistent = True
+        usable_crit_mask = alt_batch_results["valid"].copy()
+        usable_crit_mask[list(input_error_crit_idxs)] = False
+        alternative_local_scores_matrix_np = np.where(usable_crit_mask[np.newaxis, :], alt_batch_results["weights"].T, 0.0)
         
         session["alternative_crs_temp"] = alternative_ahp_results_by_crit_idx
 
@@ -753,6 +1205,13 @@ def calculate_final_route():
         
         if any_alt_matrix_inconsistent:
             flash("ÍT NHẤT MỘT ma trận Phương án KHÔNG nhất quán. Kết quả có thể không đáng tin cậy.", "warning")
+            alternative_repairs = {
+                crit_idx: suggest_consistency_repairs(
+                    alt_modal_stack_np[crit_idx], labels=alternative_names_ordered, method=AHP_PRIORITIZATION_METHOD
+                )
+                for crit_idx in range(n_criteria)
+                if usable_crit_mask[crit_idx] and not alternative_ahp_results_by_crit_idx[str(crit_idx)].get("is_consistent", False)
+            }
             return render_template(
             "matrix.html",
             criteria=db_criteria_tuples,
@@ -765,26 +1224,46 @@ def calculate_final_route():
             form_data_criteria=form_data_criteria_render,
             form_data_alternatives=form_data_alternatives_render,
             alternative_crs=alternative_ahp_results_by_crit_idx,
+            alternative_repairs=alternative_repairs,
             imported_data=session.get('data_imported_from_excel', False)
         )
         final_scores_np = np.dot(alternative_local_scores_matrix_np, criteria_weights_vector)
         total_final_score = np.sum(final_scores_np)
         if abs(total_final_score) > 1e-9 and not math.isclose(total_final_score, 1.0, abs_tol=1e-6):
             final_scores_np /= total_final_score
-        
-        save_alternative_scores(current_session_db_id, db_alternatives_tuples, db_criteria_tuples, alternative_local_scores_matrix_np)
-        
+
         result_data = {
             "criteria_names": criteria_names_ordered, "criteria_weights": criteria_weights_vector.tolist(),
             "alternatives": alternative_names_ordered, "alternative_scores": final_scores_np.tolist(),
             "ranked_alternatives": sorted(list(zip(alternative_names_ordered, final_scores_np.tolist())), key=lambda x: x[1], reverse=True),
             "cr_criteria": criteria_ahp_results.get("CR"), "is_consistent_criteria": criteria_ahp_results.get("is_consistent"),
-            "alternative_crs": alternative_ahp_results_by_crit_idx,
+            "alternative_crs": {idx: compact_ahp_result(res) for idx, res in alternative_ahp_results_by_crit_idx.items()},
             "local_alternative_weights_matrix": alternative_local_scores_matrix_np.tolist(),
         }
+        result_data["uncertainty"] = None
+        # Mô phỏng nhiễu trên thang Saaty chỉ áp dụng cho phán đoán thường, không cho số mờ
+        if (MONTE_CARLO_SAMPLES and not input_error_crit_idxs and usable_crit_mask.all()
+                and not fuzzy_alternatives and not criteria_ahp_results.get("fuzzy")):
+            try:
+                if session.get('data_imported_from_excel') and 'imported_criteria_matrix' in session:
+                    criteria_matrix_np = np.array(session['imported_criteria_matrix'], dtype=float)
+                elif form_data_criteria_render:
+                    criteria_matrix_np = parse_saaty_matrix(read_raw_matrix_from_form(form_data_criteria_render, n_criteria, "matrix"))
+                else:
+                    criteria_matrix_np = np.array(session['imported_criteria_matrix'], dtype=float)
+                result_data["uncertainty"] = simulate_ahp_uncertainty(
+                    criteria_matrix_np, alt_matrices_stack_np, n_samples=MONTE_CARLO_SAMPLES,
+                    radius=MONTE_CARLO_RADIUS, workers=MONTE_CARLO_WORKERS, method=AHP_PRIORITIZATION_METHOD,
+                )
+            except (KeyError, ValueError) as e_sim:
+                flash(f"Không thể mô phỏng độ bất định xếp hạng: {e_sim}", "warning")
         charts_data = generate_charts_to_files(result_data.get("ranked_alternatives"), result_data.get("criteria_names"), result_data.get("criteria_weights"))
         result_data["charts"] = charts_data
-        saved_analysis_id = save_ahp_analysis(current_session_db_id, result_data)
+        # Điểm cục bộ (AlternativeScores) và kết quả được ghi trong cùng một giao dịch
+        saved_analysis_id = save_ahp_analysis(
+            current_session_db_id, result_data,
+            alternative_scores=(db_alternatives_tuples, db_criteria_tuples, alternative_local_scores_matrix_np),
+        )
         if saved_analysis_id:
             flash(f"Kết quả AHP đã được lưu (ID: {saved_analysis_id}).", "success")
             result_data["analysis_id_for_report"] = saved_analysis_id
@@ -807,6 +1286,59 @@ def calculate_final_route():
             alternative_crs=session.get("alternative_crs_temp"), imported_data=session.get('data_imported_from_excel', False)
         )
 
+@app.route("/calculate_ratings", methods=["POST"])
+def calculate_ratings_route():
+    """
+    AHP đo tuyệt đối: dùng trọng số tiêu chí đã tính ở Bước 1 (trong session), chấm điểm mọi thửa đất
+    trong file theo thang mức của từng tiêu chí và xếp hạng top RATINGS_TOP_K.
+    """
+    current_session_db_id = get_or_create_session_db_id(session.get("flask_session_id"))
+    db_criteria_tuples = session.get("current_criteria_tuples")
+    criteria_ahp_results = session.get("criteria_ahp_results")
+    if not all([current_session_db_id, db_criteria_tuples, criteria_ahp_results]) or not criteria_ahp_results.get("is_consistent"):
+        flash("Cần ma trận tiêu chí nhất quán (Bước 1) trước khi chấm điểm thửa đất.", "error")
+        return redirect(url_for("home"))
+    file = request.files.get('ratings_file')
+    if not file or file.filename == '' or not allowed_file(file.filename):
+        flash('Vui lòng chọn một file .xlsx thang mức và thửa đất.', 'error')
+        return redirect(url_for('home'))
+
+    criteria_names = [name for _, name in db_criteria_tuples]
+    criteria_weights_vector = np.array(criteria_ahp_results["weights"])
+    try:
+        workbook_data = read_ratings_workbook(load_workbook(filename=io.BytesIO(file.read()), read_only=True), criteria_names)
+        if workbook_data is None: return redirect(url_for('home'))
+        ratings = evaluate_ratings(
+            criteria_weights_vector, workbook_data["grade_names"], workbook_data["grade_matrices"],
+            workbook_data["grade_indices"], criteria_names, method=AHP_PRIORITIZATION_METHOD, top_k=RATINGS_TOP_K,
+        )
+    except ValueError as e:
+        flash(f"Lỗi khi chấm điểm thửa đất: {e}", 'error')
+        return redirect(url_for('home'))
+
+    if not (ratings["grade_crs"] <= CONSISTENCY_THRESHOLD).all():
+        flash("ÍT NHẤT MỘT ma trận mức đánh giá KHÔNG nhất quán. Kết quả có thể không đáng tin cậy.", "warning")
+    top_ids = [workbook_data["parcel_ids"][idx] for idx in ratings["top"]]
+    top_scores = ratings["scores"][ratings["top"]].tolist()
+    result_data = {
+        "analysis_name": f"AHP thang mức ({ratings['summary']['n_parcels']} thửa đất)",
+        "criteria_names": criteria_names, "criteria_weights": criteria_weights_vector.tolist(),
+        "alternatives": top_ids, "alternative_scores": top_scores,
+        "ranked_alternatives": list(zip(top_ids, top_scores)),
+        "cr_criteria": criteria_ahp_results.get("CR"), "is_consistent_criteria": criteria_ahp_results.get("is_consistent"),
+        "alternative_crs": {},
+        "local_alternative_weights_matrix": ratings["local_top"].tolist(),
+        "ratings": {"grades": ratings["grades"], "summary": ratings["summary"]},
+    }
+    result_data["charts"] = generate_charts_to_files(
+        result_data["ranked_alternatives"], criteria_names, result_data["criteria_weights"])
+    saved_analysis_id = save_ahp_analysis(current_session_db_id, result_data)
+    if saved_analysis_id:
+        flash(f"Kết quả chấm điểm thửa đất đã được lưu (ID: {saved_analysis_id}).", "success")
+        result_data["analysis_id_for_report"] = saved_analysis_id
+    else: flash("Lưu kết quả chấm điểm thửa đất thất bại.", "error")
+    return render_template("result.html", **result_data)
+
 # --- generate_charts_to_files, create_excel_report, download_excel_report, download_pdf_report, view_result_route, history_list_route (GIỮ NGUYÊN) ---
 def generate_charts_to_files(
     ranked_alternatives, criteria_names, criteria_weights, unique_prefix=""
@@ -1295,14 +1827,138 @@ def download_pdf_report(analysis_id):
     else: flash("Không thể tạo PDF, dữ liệu rỗng.", "error"); return redirect(url_for("view_result_route", analysis_id=analysis_id))
 
 
+@app.route("/db_pool_stats")
+def db_pool_stats_route():
+    """Số liệu pool kết nối CSDL (đang mượn, rảnh, số lần chờ, số kết nối đã tạo...); 404 nếu chưa bật."""
+    if not (app.debug or DB_POOL_STATS_ENABLED):
+        abort(404)
+    return jsonify({"ok": True, **get_db_pool_stats()})
+
+
+def encode_history_cursor(key):
+    """
+    Khóa keyset (created_at, analysis_id) -> mã trang gọn cho URL /history. created_at giữ nguyên chuỗi
+    driver trả về (DATETIME2 đủ 7 chữ số lẻ) để SQL Server so sánh lại chính xác khi đọc trang kế.
+    """
+    created_at = key[0].isoformat() if isinstance(key[0], datetime) else str(key[0])
+    return base64.urlsafe_b64encode(json.dumps([created_at, int(key[1])]).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_history_cursor(token):
+    try:
+        created_at, analysis_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return str(created_at), int(analysis_id)
+    except (ValueError, TypeError):
+        raise ValueError("Mã trang lịch sử không hợp lệ, hiển thị lại trang mới nhất.")
+
+
+def load_history_page(session_db_id, args):
+    """Ngữ cảnh history_list.html: một trang lịch sử theo tham số URL after/before (mã trang) và per_page."""
+    try:
+        page_size = int(args.get("per_page", HISTORY_PAGE_SIZE))
+    except ValueError:
+        page_size = HISTORY_PAGE_SIZE
+    try:
+        after = decode_history_cursor(args["after"]) if args.get("after") else None
+        before = decode_history_cursor(args["before"]) if args.get("before") and not after else None
+    except ValueError as e:
+        flash(str(e), "warning")
+        after = before = None
+    page = get_ahp_analyses_page(session_db_id, page_size, after=after, before=before)
+    return {
+        "analyses": page["analyses"],
+        "per_page": page_size,
+        "next_cursor": encode_history_cursor(page["next_key"]) if page["next_key"] else None,
+        "prev_cursor": encode_history_cursor(page["prev_key"]) if page["prev_key"] else None,
+        "is_first_page": not (after or before),
+        "allocation_methods": available_allocation_methods(),
+    }
+
+
 @app.route("/history")
 def history_list_route():
     flask_session_id_value = session.get("flask_session_id")
     session_db_id = get_or_create_session_db_id(flask_session_id_value) if flask_session_id_value else None
     if not session_db_id and not flask_session_id_value:
         flash("Vui lòng bắt đầu một phiên làm việc để xem lịch sử.", "info"); return redirect(url_for("home"))
-    analyses_history = get_ahp_analyses_by_session_db_id(session_db_id) if session_db_id else []
-    return render_template("history_list.html", analyses=analyses_history)
+    return render_template("history_list.html", **load_history_page(session_db_id, request.args))
+
+
+@app.route("/allocate_land", methods=["POST"])
+def allocate_land_route():
+    """
+    Phân bổ thửa đất cho các loại sử dụng đất: mỗi phân tích đã lưu được chọn là một loại đất,
+    điểm thích hợp của thửa tính từ trọng số tiêu chí của phân tích đó trên file CSV thuộc tính.
+    """
+    current_session_db_id = get_or_create_session_db_id(session.get("flask_session_id"))
+    if not current_session_db_id:
+        flash("Không thể xác thực phiên làm việc.", "error"); return redirect(url_for("history_list_route"))
+    file = request.files.get("parcels_file")
+    if not file or not file.filename.lower().endswith(".csv"):
+        flash("Vui lòng chọn file .csv thuộc tính thửa đất.", "error"); return redirect(url_for("history_list_route"))
+
+    try:
+        analysis_ids = [int(aid) for aid in request.form.getlist("allocation_analysis_ids")]
+        demands = [float(request.form.get(f"demand_{aid}", "") or 0) for aid in analysis_ids]
+    except ValueError:
+        flash("Nhu cầu diện tích phải là số.", "error"); return redirect(url_for("history_list_route"))
+    method = request.form.get("allocation_method", "greedy")
+    if len(analysis_ids) < 1 or method not in ALLOCATION_METHODS:
+        flash("Chọn ít nhất một phân tích (loại đất) và phương pháp phân bổ hợp lệ.", "error")
+        return redirect(url_for("history_list_route"))
+
+    use_names, analyses = [], []
+    for aid in analysis_ids:
+        saved_analysis_data = get_ahp_analysis_by_id(aid, session_db_id_check=current_session_db_id)
+        if not saved_analysis_data or not saved_analysis_data.get("criteria_weights"):
+            flash(f"Không tìm thấy trọng số tiêu chí của phân tích ID {aid}.", "error")
+            return redirect(url_for("history_list_route"))
+        use_names.append(saved_analysis_data.get("analysis_name") or f"Phân tích {aid}")
+        analyses.append((saved_analysis_data["criteria_names"], saved_analysis_data["criteria_weights"]))
+
+    area_column = request.form.get("area_column", "").strip() or PARCEL_AREA_COLUMN
+    id_column = request.form.get("id_column", "").strip() or PARCEL_ID_COLUMN
+    with tempfile.TemporaryDirectory() as upload_dir:
+        csv_path = os.path.join(upload_dir, "parcels.csv")
+        file.save(csv_path)
+        try:
+            parcel_ids, areas, suitability = parcel_suitability_matrix(
+                csv_path, analyses, area_column, id_column=id_column)
+            allocation = allocate_land(suitability, areas, demands, use_names, method=method)
+        except ValueError as e:
+            flash(f"Lỗi khi phân bổ đất: {e}", "error"); return redirect(url_for("history_list_route"))
+
+    assignment = allocation.pop("assignment")
+    allocation_data = {
+        "allocation_name": f"Phân bổ đất ({len(parcel_ids)} thửa, {len(use_names)} loại đất)",
+        "method": method,
+        "analysis_ids": analysis_ids,
+        "summary": allocation,
+        "assignment": {name: [parcel_ids[p] for p in np.flatnonzero(assignment == u)] for u, name in enumerate(use_names)},
+        "total_suitability": allocation["total_suitability"],
+    }
+    allocation_id = save_land_allocation(current_session_db_id, allocation_data)
+    if allocation_id: flash(f"Đã lưu phân bổ đất ID: {allocation_id}", "success")
+    else: flash("Lỗi khi lưu phân bổ đất vào CSDL.", "warning")
+    return render_template(
+        "history_list.html", **load_history_page(current_session_db_id, {}),
+        allocation=allocation, allocation_id=allocation_id)
+
+
+@app.route("/allocation/<int:allocation_id>/download")
+def download_allocation_route(allocation_id):
+    """Tải danh sách (mã thửa, loại đất được giao) của một lần phân bổ đã lưu dưới dạng CSV."""
+    current_session_db_id = get_or_create_session_db_id(session.get("flask_session_id"))
+    allocation_data = get_land_allocation_by_id(allocation_id, session_db_id_check=current_session_db_id) if current_session_db_id else None
+    if not allocation_data:
+        flash(f"Không tìm thấy phân bổ đất ID {allocation_id}.", "error"); return redirect(url_for("history_list_route"))
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([PARCEL_ID_COLUMN, "LoaiDat"])
+    for use_name, parcel_ids in allocation_data["assignment"].items():
+        writer.writerows((parcel_id, use_name) for parcel_id in parcel_ids)
+    return Response(output.getvalue().encode("utf-8-sig"), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment;filename=Land_Allocation_{allocation_id}.csv"})
 
 
 @app.route("/result_history/<int:analysis_id>")
@@ -1324,5 +1980,23 @@ def view_result_route(analysis_id):
         return redirect(url_for("history_list_route"))
 
 
+
+@app.route("/result_history/<int:analysis_id>/sensitivity")
+def sensitivity_route(analysis_id):
+    """Ngưỡng đảo thứ hạng và đường cong độ nhạy (JSON) cho một phân tích đã lưu."""
+    flask_session_id_value = session.get("flask_session_id")
+    current_session_db_id = get_or_create_session_db_id(flask_session_id_value) if flask_session_id_value else None
+    if not current_session_db_id:
+        return jsonify({"ok": False, "error": "Không thể xác thực phiên làm việc."}), 403
+    saved_analysis_data = get_ahp_analysis_by_id(analysis_id, session_db_id_check=current_session_db_id)
+    if not saved_analysis_data:
+        return jsonify({"ok": False, "error": f"Không tìm thấy kết quả phân tích ID {analysis_id} hoặc bạn không có quyền xem."}), 404
+    try:
+        points = int(request.args.get("points", SWEEP_DEFAULT_POINTS))
+        sensitivity = analyze_sensitivity(saved_analysis_data, points=points)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "analysis_id": analysis_id, **sensitivity})
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
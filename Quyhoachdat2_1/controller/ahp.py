@@ -1,24 +1,42 @@
 # controller/ahp.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
 import numpy as np
-import math
-
-RI_lookup = {
-    1: 0.00,
-    2: 0.00,
-    3: 0.58,
-    4: 0.90,
-    5: 1.12,
-    6: 1.24,
-    7: 1.32,
-    8: 1.41,
-    9: 1.45,
-    10: 1.49,
-    11: 1.51,
-    12: 1.54,
-    13: 1.56,
-    14: 1.57,
-    15: 1.59,
+
+# RI mô phỏng cho mọi n và theo từng phương pháp (bảng controller/random_index_table.json)
+from controller.random_index import random_index
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.linalg import spsolve
+except ImportError:  # scipy không bắt buộc: hệ LLSM được giải đặc bằng numpy
+    csr_matrix = spsolve = None
+
+# --- Bảng tra thang đo Saaty (tạo một lần khi import module) ---
+# 17 giá trị hợp lệ: 1/9, ..., 1/2, 1, 2, ..., 9
+SAATY_SCALE = tuple([1.0 / d for d in range(9, 1, -1)] + [float(v) for v in range(1, 10)])
+# Chuỗi hiển thị tương ứng từng phần tử của SAATY_SCALE
+SAATY_LABELS = tuple([f"1/{d}" for d in range(9, 1, -1)] + [str(v) for v in range(1, 10)])
+# Chuỗi chuẩn -> giá trị, cho đường tắt không cần float()/split()
+_SAATY_TOKEN_LOOKUP = {
+    **{str(v): float(v) for v in range(1, 10)},
+    **{f"1/{d}": 1.0 / d for d in range(2, 10)},
 }
+# Giá trị thập phân (làm tròn) tương đương phân số Saaty, ví dụ 0.25, 0.5 từ Excel
+_SAATY_RECIPROCALS_ROUNDED = frozenset(round(1 / d, 10) for d in range(2, 10))
+
+
+class SaatyMatrixError(ValueError):
+    """Lỗi khi đọc ma trận Saaty; `cells` là list (i, j, thông báo) theo chỉ số 0."""
+
+    def __init__(self, message, cells=None):
+        super().__init__(message)
+        self.cells = cells or []
 
 
 def parse_saaty_value(value_str, is_diagonal=False):
@@ -26,6 +44,9 @@ def parse_saaty_value(value_str, is_diagonal=False):
         str(value_str).strip().replace(",", ".")
     )  # Đảm bảo xử lý dấu phẩy thập phân
 
+    if not is_diagonal and value_str in _SAATY_TOKEN_LOOKUP:
+        return _SAATY_TOKEN_LOOKUP[value_str]
+
     if is_diagonal:
         if value_str == "1":
             return 1.0
@@ -68,8 +89,7 @@ def parse_saaty_value(value_str, is_diagonal=False):
             # Kiểm tra xem có phải là giá trị nghịch đảo hợp lệ không (ví dụ 0.25, 0.5, ...)
             # Đây là phần mở rộng để chấp nhận float từ Excel
             # Danh sách các giá trị nghịch đảo Saaty hợp lệ (làm tròn để so sánh float)
-            valid_saaty_reciprocals = {round(1 / d, 10) for d in range(2, 10)}
-            if round(val, 10) in valid_saaty_reciprocals:
+            if round(val, 10) in _SAATY_RECIPROCALS_ROUNDED:
                 return val  # Chấp nhận float này nếu nó là một nghịch đảo Saaty
             raise ValueError(
                 f"Số nguyên '{value_str}' không hợp lệ. Chỉ được phép là từ 1 đến 9, hoặc giá trị thập phân tương đương phân số Saaty (ví dụ 0.25, 0.5)."
@@ -77,8 +97,7 @@ def parse_saaty_value(value_str, is_diagonal=False):
     else:
         # Nếu là số thập phân (không phải số nguyên)
         # Kiểm tra xem có phải là giá trị nghịch đảo hợp lệ không
-        valid_saaty_reciprocals = {round(1 / d, 10) for d in range(2, 10)}
-        if round(val, 10) in valid_saaty_reciprocals:
+        if round(val, 10) in _SAATY_RECIPROCALS_ROUNDED:
             return val  # Chấp nhận float này
         else:
             raise ValueError(
@@ -86,154 +105,971 @@ def parse_saaty_value(value_str, is_diagonal=False):
             )
 
 
-def calculate_ahp(matrix_input, matrix_name_for_error="Ma trận"):
-    # Khởi tạo results với các key mà template matrix.html và result.html mong đợi
-    results = {
-        "n": 0,
-        "weights": None,
-        "wsv": None,
-        "cv": None,
-        "lambdaMax": None,
-        "ci": None,
-        "RI": None,
-        "CR": None,  # Key cho matrix.html
-        "is_consistent": False,
-        "error": None,
-        "colSums": None,
-        "normMatrix": None,  # Tùy chọn
+_BLANK_TOKENS = ("", "None", "nan")
+
+
+def _parse_saaty_tokens(tokens, is_diagonal):
+    """
+    Parse một mảng token đã chuẩn hóa: mỗi giá trị khác nhau chỉ parse một lần,
+    sau đó ánh xạ ngược về toàn mảng bằng chỉ số của np.unique.
+    Trả về (values, error_messages) với error_messages[i] = None nếu hợp lệ.
+    Ô trống ngoài đường chéo là phán đoán còn thiếu (NaN), không phải lỗi.
+    """
+    unique_tokens, inverse = np.unique(tokens, return_inverse=True)
+    unique_values = np.ones(len(unique_tokens), dtype=float)
+    unique_errors = [None] * len(unique_tokens)
+    for u, token in enumerate(unique_tokens):
+        if token in _BLANK_TOKENS:
+            if is_diagonal:
+                unique_errors[u] = "Ô trống, vui lòng điền giá trị."
+            else:
+                unique_values[u] = np.nan
+            continue
+        try:
+            unique_values[u] = parse_saaty_value(token, is_diagonal=is_diagonal)
+        except ValueError as e:
+            unique_errors[u] = str(e)
+    return unique_values[inverse], [unique_errors[i] for i in inverse]
+
+
+def parse_saaty_matrix(raw_matrix, labels=None, max_reported_errors=5):
+    """
+    Đọc toàn bộ ma trận so sánh cặp từ mảng/list (n, n) các chuỗi hoặc số thô.
+    Chỉ đọc đường chéo và tam giác trên; tam giác dưới được điền nghịch đảo vector hóa.
+    Ô trống ở tam giác trên cho NaN ở cả hai nửa (ma trận thiếu, xem calculate_ahp_batch).
+    Lỗi được báo theo tọa độ ô (hoặc theo `labels` nếu có) qua SaatyMatrixError.
+    """
+    raw = np.array(raw_matrix, dtype=object)
+    if raw.ndim != 2 or raw.shape[0] != raw.shape[1] or raw.shape[0] == 0:
+        raise SaatyMatrixError("Ma trận không hợp lệ hoặc không vuông.")
+    n = raw.shape[0]
+
+    tokens = np.char.replace(np.char.strip(raw.astype(str)), ",", ".")
+    upper_rows, upper_cols = np.triu_indices(n, 1)
+    diag_idx = np.arange(n)
+
+    upper_values, upper_errors = _parse_saaty_tokens(tokens[upper_rows, upper_cols], False)
+    _, diag_errors = _parse_saaty_tokens(tokens[diag_idx, diag_idx], True)
+
+    _raise_cell_errors(
+        [(i, i, err) for i, err in zip(diag_idx, diag_errors) if err]
+        + [(i, j, err) for i, j, err in zip(upper_rows, upper_cols, upper_errors) if err],
+        labels, max_reported_errors,
+    )
+
+    matrix = np.ones((n, n), dtype=float)
+    matrix[upper_rows, upper_cols] = upper_values
+    matrix[upper_cols, upper_rows] = 1.0 / upper_values
+    return matrix
+
+
+def _raise_cell_errors(bad_cells, labels, max_reported_errors):
+    """Gom lỗi từng ô (i, j, thông báo) thành một SaatyMatrixError; không có lỗi thì không làm gì."""
+    if not bad_cells:
+        return
+
+    def cell_name(i, j):
+        return f"[{labels[i]}] vs [{labels[j]}]" if labels is not None else f"[{i+1},{j+1}]"
+
+    details = "; ".join(
+        f"Ô {cell_name(i, j)}: {err}" for i, j, err in bad_cells[:max_reported_errors]
+    )
+    if len(bad_cells) > max_reported_errors:
+        details += f" (và {len(bad_cells) - max_reported_errors} ô lỗi khác)"
+    raise SaatyMatrixError(details, [(int(i), int(j), err) for i, j, err in bad_cells])
+
+
+# Phán đoán mờ tam giác (TFN) viết "l-m-u", ví dụ "3-4-5" hay "1/4-1/3-1/2"
+FUZZY_SEPARATOR = "-"
+
+
+def _matrix_tokens(raw_matrix):
+    raw = np.array(raw_matrix, dtype=object)
+    if raw.ndim != 2 or raw.shape[0] != raw.shape[1] or raw.shape[0] == 0:
+        raise SaatyMatrixError("Ma trận không hợp lệ hoặc không vuông.")
+    return np.char.replace(np.char.strip(raw.astype(str)), ",", ".")
+
+
+def has_fuzzy_cells(raw_matrix):
+    """True nếu tam giác trên có ô viết dạng số mờ "l-m-u"."""
+    tokens = _matrix_tokens(raw_matrix)
+    upper = tokens[np.triu_indices(tokens.shape[0], 1)]
+    return bool(np.char.find(upper.astype(str), FUZZY_SEPARATOR, start=1).max(initial=-1) >= 0)
+
+
+def _parse_fuzzy_tokens(tokens):
+    """
+    Parse các token tam giác trên thành TFN (len, 3): "l-m-u" với l <= m <= u trên thang Saaty,
+    số thường v thành (v, v, v). Mỗi token khác nhau chỉ parse một lần như _parse_saaty_tokens.
+    """
+    unique_tokens, inverse = np.unique(tokens, return_inverse=True)
+    unique_values = np.ones((len(unique_tokens), 3), dtype=float)
+    unique_errors = [None] * len(unique_tokens)
+    for u, token in enumerate(unique_tokens):
+        if token in _BLANK_TOKENS:
+            unique_errors[u] = "Ô trống, ma trận mờ cần đủ mọi phán đoán."
+            continue
+        parts = token.split(FUZZY_SEPARATOR) if FUZZY_SEPARATOR in token[1:] else [token] * 3
+        try:
+            if len(parts) != 3:
+                raise ValueError(f"Số mờ '{token}' phải có dạng l-m-u (ví dụ 3-4-5).")
+            unique_values[u] = [parse_saaty_value(part) for part in parts]
+            if not unique_values[u, 0] <= unique_values[u, 1] <= unique_values[u, 2]:
+                raise ValueError(f"Số mờ '{token}' cần l <= m <= u.")
+        except ValueError as e:
+            unique_errors[u] = str(e)
+    return unique_values[inverse], [unique_errors[i] for i in inverse]
+
+
+def parse_fuzzy_matrix(raw_matrix, labels=None, max_reported_errors=5):
+    """
+    Đọc ma trận so sánh cặp mờ (n, n, 3) từ (n, n) chuỗi: tam giác trên là TFN (l, m, u),
+    tam giác dưới là nghịch đảo (1/u, 1/m, 1/l), đường chéo (1, 1, 1). Lỗi báo như parse_saaty_matrix.
+    """
+    tokens = _matrix_tokens(raw_matrix)
+    n = tokens.shape[0]
+    upper_rows, upper_cols = np.triu_indices(n, 1)
+    diag_idx = np.arange(n)
+    upper_values, upper_errors = _parse_fuzzy_tokens(tokens[upper_rows, upper_cols])
+    _, diag_errors = _parse_saaty_tokens(tokens[diag_idx, diag_idx], True)
+    _raise_cell_errors(
+        [(i, i, err) for i, err in zip(diag_idx, diag_errors) if err]
+        + [(i, j, err) for i, j, err in zip(upper_rows, upper_cols, upper_errors) if err],
+        labels, max_reported_errors,
+    )
+
+    matrix = np.ones((n, n, 3), dtype=float)
+    matrix[upper_rows, upper_cols] = upper_values
+    matrix[upper_cols, upper_rows] = 1.0 / upper_values[:, ::-1]
+    return matrix
+
+
+def parse_comparison_matrix(raw_matrix, labels=None, max_reported_errors=5):
+    """Ma trận thường (n, n) qua parse_saaty_matrix, hoặc ma trận mờ (n, n, 3) nếu có ô "l-m-u"."""
+    if has_fuzzy_cells(raw_matrix):
+        return parse_fuzzy_matrix(raw_matrix, labels, max_reported_errors)
+    return parse_saaty_matrix(raw_matrix, labels, max_reported_errors)
+
+
+def is_fuzzy_matrix(matrix):
+    """Một ma trận mờ có dạng (n, n, 3); ma trận thường là (n, n)."""
+    matrix = np.asarray(matrix)
+    return matrix.ndim == 3 and matrix.shape[2] == 3 and matrix.shape[0] == matrix.shape[1]
+
+
+def stack_comparison_matrices(matrices, n):
+    """
+    Chồng các ma trận (mỗi phần tử (n, n), (n, n, 3) hoặc None = toàn 1) thành một mảng.
+    Có ít nhất một ma trận mờ thì mọi ma trận được nâng thành TFN (v, v, v) để tính chung một lô mờ.
+    """
+    fuzzy = any(matrix is not None and is_fuzzy_matrix(matrix) for matrix in matrices)
+    stack = np.ones((len(matrices), n, n, 3) if fuzzy else (len(matrices), n, n), dtype=float)
+    for b, matrix in enumerate(matrices):
+        if matrix is None:
+            continue
+        matrix = np.asarray(matrix, dtype=float)
+        stack[b] = matrix[..., np.newaxis] if fuzzy and not is_fuzzy_matrix(matrix) else matrix
+    return stack
+
+
+AHP_RESULT_KEYS = (
+    "n",
+    "weights",
+    "wsv",
+    "cv",
+    "lambdaMax",
+    "ci",
+    "RI",
+    "CR",
+    "is_consistent",
+    "error",
+    "colSums",
+    "normMatrix",
+    "method",
+    "iterations",
+    "residual",
+    "GCI",
+    "GCI_threshold",
+    "incomplete",
+    "connected",
+    "missing_count",
+    "fuzzy",
+    "fuzzy_weights",
+)
+
+CONSISTENCY_THRESHOLD = 0.1
+_TOLERANCE = 1e-9
+
+# "approx": chuẩn hóa cột rồi lấy trung bình hàng (cách tính gốc)
+# "eigen": vector riêng chính bằng lặp lũy thừa, khởi động từ trọng số "approx"
+# "geometric": trung bình nhân theo hàng (RGMM), tính trong không gian log
+PRIORITIZATION_METHODS = ("approx", "eigen", "geometric")
+EIGEN_TOLERANCE = 1e-10
+EIGEN_MAX_ITER = 100
+
+# Ma trận thiếu ô (NaN) được ước lượng bằng LLSM; từ kích thước này giải hệ thưa bằng scipy nếu có
+LLSM_SPARSE_MIN_SIZE = 60
+
+# Cache LRU kết quả theo nội dung ma trận (số ma trận giữ trong bộ nhớ mỗi tiến trình)
+AHP_CACHE_MAX_ENTRIES = 4096
+# Giới hạn thư mục cache dùng chung: số file tối đa, tuổi tối đa (giây), dọn sau mỗi chừng này lần ghi
+AHP_CACHE_DIR_MAX_FILES = 50000
+AHP_CACHE_DIR_MAX_AGE = 7 * 24 * 3600
+AHP_CACHE_DIR_PRUNE_EVERY = 256
+_CACHED_ROW_FIELDS = (
+    "weights", "wsv", "cv", "lambdaMax", "ci", "CR", "is_consistent", "colSums", "normMatrix",
+    "valid", "iterations", "residual", "GCI", "incomplete", "connected", "missing_count",
+)
+
+# Ngưỡng GCI (Aguarón & Moreno-Jiménez, 2003) tương đương CR = 0.1
+GCI_THRESHOLDS = {3: 0.31, 4: 0.35}
+GCI_THRESHOLD_DEFAULT = 0.37
+
+
+def _geometric_consistency_index(log_matrices, weights):
+    """GCI = 2 / ((n-1)(n-2)) * Σ_{i<j} log²(a_ij · w_j / w_i), vector hóa theo trục k."""
+    n = weights.shape[1]
+    if n <= 2:
+        return np.zeros(weights.shape[0])
+    log_w = np.log(weights)
+    errors = log_matrices + log_w[:, np.newaxis, :] - log_w[:, :, np.newaxis]
+    # Ma trận lỗi log đối xứng lệch nên tổng toàn phần = 2 * tổng tam giác trên
+    return (errors ** 2).sum(axis=(1, 2)) / ((n - 1) * (n - 2))
+
+
+def _power_iteration(matrices, initial_weights, tol=EIGEN_TOLERANCE, max_iter=EIGEN_MAX_ITER):
+    """
+    Lặp lũy thừa vector hóa trên chồng ma trận (k, n, n).
+    Ma trận nào hội tụ thì dừng cập nhật; trả về (weights, iterations (k,)).
+    """
+    weights = initial_weights.copy()
+    iterations = np.zeros(weights.shape[0], dtype=int)
+    active = np.ones(weights.shape[0], dtype=bool)
+    for it in range(1, max_iter + 1):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        product = np.einsum("bij,bj->bi", matrices[idx], weights[idx])
+        new_weights = product / product.sum(axis=1, keepdims=True)
+        delta = np.abs(new_weights - weights[idx]).max(axis=1)
+        weights[idx] = new_weights
+        iterations[idx] = it
+        active[idx[delta < tol]] = False
+    return weights, iterations
+
+
+def _comparison_graph_connected(known):
+    """Đồ thị so sánh (cạnh = ô đã biết) của chồng (k, n, n) có liên thông không; bình phương ma trận kề."""
+    n = known.shape[1]
+    reach = (known | np.eye(n, dtype=bool)).astype(np.float32)
+    for _ in range(int(np.ceil(np.log2(max(n, 2))))):
+        if (reach[:, 0, :] > 0).all():
+            break
+        reach = np.minimum(reach @ reach, 1.0)
+    return (reach[:, 0, :] > 0).all(axis=1)
+
+
+def _complete_llsm(matrices, known):
+    """
+    LLSM cho ma trận thiếu ô: cực tiểu Σ_(i,j đã biết) (ln a_ij - y_i + y_j)²,
+    tức hệ Laplacian L·y = r của đồ thị so sánh (cố định y_0 = 0).
+    Trả về (ma trận đã điền a_ij = w_i / w_j vào ô thiếu, trọng số (k, n)).
+    """
+    k, n, _ = matrices.shape
+    log_known = np.where(known, np.log(np.where(known, matrices, 1.0)), 0.0)
+    laplacian = -known.astype(float)
+    laplacian[:, np.arange(n), np.arange(n)] = known.sum(axis=2)
+    rhs = log_known.sum(axis=2)
+    log_weights = np.zeros((k, n))
+    if spsolve is not None and n >= LLSM_SPARSE_MIN_SIZE:
+        for b in range(k):
+            log_weights[b, 1:] = spsolve(csr_matrix(laplacian[b, 1:, 1:]), rhs[b, 1:])
+    else:
+        log_weights[:, 1:] = np.linalg.solve(laplacian[:, 1:, 1:], rhs[:, 1:, np.newaxis])[:, :, 0]
+    weights = np.exp(log_weights - log_weights.max(axis=1, keepdims=True))
+    weights /= weights.sum(axis=1, keepdims=True)
+    completed = np.where(
+        known | np.eye(n, dtype=bool), matrices, weights[:, :, np.newaxis] / weights[:, np.newaxis, :]
+    )
+    return completed, weights
+
+
+def _batch_error_messages(matrices, finite_mask, positive_mask, diag_mask, col_sums, names,
+                          connected_mask=None):
+    # Chỉ lặp Python trên các ma trận lỗi (hiếm), phần hợp lệ đã vector hóa
+    errors = [None] * matrices.shape[0]
+    if connected_mask is None:
+        connected_mask = np.ones(matrices.shape[0], dtype=bool)
+    valid = finite_mask & positive_mask & diag_mask & connected_mask & (col_sums > _TOLERANCE).all(axis=1)
+    for b in np.flatnonzero(~valid):
+        name = names[b] if names is not None else f"Ma trận {b+1}"
+        if not connected_mask[b]:
+            msg = "Các ô đã nhập chưa nối liền mọi phần tử (đồ thị so sánh không liên thông), cần thêm phán đoán."
+        elif not positive_mask[b]:
+            msg = "Ma trận chứa giá trị không dương, không thể tính trung bình nhân."
+        elif not finite_mask[b]:
+            msg = "Ma trận chứa giá trị không hợp lệ (NaN/Infinity)."
+        elif not diag_mask[b]:
+            bad = np.flatnonzero(
+                ~np.isclose(np.diagonal(matrices[b]), 1.0, rtol=0.0, atol=_TOLERANCE)
+            )[0]
+            msg = f"Giá trị trên đường chéo tại [{bad+1},{bad+1}] ({matrices[b, bad, bad]:.3f}) phải bằng 1."
+        else:
+            problem_cols = (np.flatnonzero(col_sums[b] <= _TOLERANCE) + 1).tolist()
+            msg = f"Các cột trong ma trận ({name}) có tổng gần bằng 0: cột {problem_cols}."
+        errors[b] = f"Lỗi dữ liệu AHP ({name}): {msg}"
+        print(errors[b])
+    return errors
+
+
+def _consistency_measures(matrices, weights, log_matrices, method="approx"):
+    """
+    Từ chồng ma trận (k, n, n) và trọng số (k, n) tính WSV, CV, λmax, CI, RI, CR,
+    residual và GCI; dùng chung cho tính toán batch và cập nhật tăng dần.
+    RI lấy theo `method` vì λmax phụ thuộc cách tính trọng số.
+    """
+    k, n = weights.shape
+    wsv = np.einsum("bij,bj->bi", matrices, weights)
+    non_zero = np.abs(weights) > _TOLERANCE
+    cv = np.full_like(wsv, float(n))
+    np.divide(wsv, weights, out=cv, where=non_zero)
+    cv[~np.isfinite(cv)] = float(n)
+
+    counts = non_zero.sum(axis=1)
+    lambda_max = np.where(
+        counts > 0, (cv * non_zero).sum(axis=1) / np.maximum(counts, 1), float(n)
+    )
+    ci = (lambda_max - n) / (n - 1) if n > 1 else np.zeros(k)
+
+    ri = random_index(n, method)
+    if ri > _TOLERANCE:
+        cr = ci / ri
+    else:
+        cr = np.where(np.isclose(ci, 0.0, rtol=0.0, atol=_TOLERANCE), 0.0, np.inf)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gci = _geometric_consistency_index(log_matrices, weights)
+    return {
+        "wsv": wsv,
+        "cv": cv,
+        "lambdaMax": lambda_max,
+        "ci": ci,
+        "RI": float(ri),
+        "CR": cr,
+        "is_consistent": cr <= CONSISTENCY_THRESHOLD + _TOLERANCE,
+        "residual": np.abs(wsv - lambda_max[:, np.newaxis] * weights).max(axis=1),
+        "GCI": gci,
+        "GCI_threshold": GCI_THRESHOLDS.get(n, GCI_THRESHOLD_DEFAULT) if n > 2 else 0.0,
     }
-    n_val_for_except = 0
-    try:
-        matrix = (
-            np.array(matrix_input, dtype=float)
-            if not isinstance(matrix_input, np.ndarray)
-            else matrix_input.astype(float)
-        )
-        n = matrix.shape[0]
-        n_val_for_except = n
-        results["n"] = n
-        if n == 0 or matrix.shape[1] != n:
-            raise ValueError("Ma trận không hợp lệ hoặc không vuông.")
-        if np.isnan(matrix).any() or np.isinf(matrix).any():
-            raise ValueError("Ma trận chứa giá trị không hợp lệ (NaN/Infinity).")
 
-        tolerance = 1e-9
-        for i in range(n):
-            if not math.isclose(matrix[i, i], 1.0, abs_tol=tolerance):
-                raise ValueError(
-                    f"Giá trị trên đường chéo tại [{i+1},{i+1}] ({matrix[i,i]:.3f}) phải bằng 1."
-                )
-        # Không print warning đối xứng nữa
 
-        col_sums_np = matrix.sum(axis=0)
-        results["colSums"] = col_sums_np.tolist()  # Trả về list
+def _priority_weights(matrices, method, tol=EIGEN_TOLERANCE, max_iter=EIGEN_MAX_ITER):
+    """Trọng số ưu tiên (k, n) của chồng ma trận đã hợp lệ; trả về (weights, iterations, normMatrix)."""
+    k, n, _ = matrices.shape
+    norm_matrix = matrices / matrices.sum(axis=1)[:, np.newaxis, :]
+    iterations = np.zeros(k, dtype=int)
+    if method == "geometric":
+        # exp(trung bình log theo hàng) rồi chuẩn hóa; trừ max để tránh tràn số
+        log_row_means = np.log(matrices).mean(axis=2)
+        weights = np.exp(log_row_means - log_row_means.max(axis=1, keepdims=True))
+        return weights / weights.sum(axis=1, keepdims=True), iterations, norm_matrix
+
+    weights = norm_matrix.mean(axis=2)
+    weights_sum = weights.sum(axis=1, keepdims=True)
+    weights = np.where(
+        weights_sum > _TOLERANCE, weights / np.where(weights_sum > 0, weights_sum, 1.0), 1.0 / n
+    )
+    if method == "eigen":
+        weights, iterations = _power_iteration(matrices, weights, tol, max_iter)
+    return weights, iterations, norm_matrix
 
-        if np.any(col_sums_np <= tolerance):
-            problem_cols = [
-                idx + 1 for idx, s_val in enumerate(col_sums_np) if s_val <= tolerance
-            ]
-            raise ValueError(
-                f"Các cột trong ma trận ({matrix_name_for_error}) có tổng gần bằng 0: cột {problem_cols}."
-            )
 
-        norm_matrix_np = np.divide(
-            matrix,
-            col_sums_np[np.newaxis, :],
-            out=np.zeros_like(matrix),
-            where=col_sums_np[np.newaxis, :] != 0,
+def batch_priority_weights(matrices, method="approx", tol=EIGEN_TOLERANCE, max_iter=EIGEN_MAX_ITER):
+    """
+    Chỉ tính trọng số (k, n) cho chồng ma trận dương hợp lệ, bỏ qua kiểm tra và CR.
+    Dùng cho các vòng lặp lớn (mô phỏng) nơi ma trận được sinh ra nên luôn hợp lệ.
+    """
+    if method not in PRIORITIZATION_METHODS:
+        raise ValueError(
+            f"Phương pháp '{method}' không được hỗ trợ. Chọn một trong {PRIORITIZATION_METHODS}."
         )
-        results["normMatrix"] = norm_matrix_np.tolist()  # Trả về list
+    return _priority_weights(np.asarray(matrices, dtype=float), method, tol, max_iter)[0]
 
-        weights_np = norm_matrix_np.mean(axis=1)
-        weights_sum = weights_np.sum()
-        if weights_sum > tolerance:
-            weights_np = weights_np / weights_sum
-        else:
-            weights_np = np.ones(n) / n
-        results["weights"] = weights_np.tolist()  # Trả về list
 
-        weighted_sum_vector_np = np.dot(matrix, weights_np)
-        results["wsv"] = weighted_sum_vector_np.tolist()  # **** ĐẢM BẢO KEY 'wsv' ****
+class DirectoryCacheBackend:
+    """
+    Backend dùng chung cho AHPResultCache giữa nhiều tiến trình worker trên cùng máy:
+    mỗi kết quả là một file .npz (không pickle) đặt tên theo khóa băm.
+    Có giới hạn: file quá max_age giây coi như trượt; sau mỗi prune_every lần ghi, xóa file quá tuổi
+    rồi xóa file ít dùng nhất (mtime cũ nhất, được làm mới khi đọc trúng) cho đến khi còn max_files.
+    """
 
-        consistency_vector_calculated_np = np.zeros_like(weights_np)
-        non_zero_weights_indices = np.abs(weights_np) > tolerance
+    def __init__(self, directory, max_files=AHP_CACHE_DIR_MAX_FILES, max_age=AHP_CACHE_DIR_MAX_AGE,
+                 prune_every=AHP_CACHE_DIR_PRUNE_EVERY):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.prune()
 
-        if np.any(np.isnan(weighted_sum_vector_np)) or np.any(
-            np.isinf(weighted_sum_vector_np)
-        ):
-            raise ValueError(
-                f"Vector tổng trọng số (WSV) của {matrix_name_for_error} chứa NaN/Infinity."
-            )
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
 
-        if np.any(non_zero_weights_indices):
-            safe_weights = weights_np[non_zero_weights_indices]
-            safe_wsv = weighted_sum_vector_np[non_zero_weights_indices]
-            consistency_vector_calculated_np[non_zero_weights_indices] = np.divide(
-                safe_wsv,
-                safe_weights,
-                out=np.full_like(safe_wsv, float(n)),
-                where=np.abs(safe_weights) > tolerance * 1e-3,
-            )
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                row = {field: data[field] for field in _CACHED_ROW_FIELDS}
+            os.utime(path)  # Đọc trúng -> mới dùng gần đây, dọn sau cùng
+            return row
+        except (OSError, KeyError, ValueError):
+            return None
 
-        if np.any(np.isnan(consistency_vector_calculated_np)) or np.any(
-            np.isinf(consistency_vector_calculated_np)
-        ):
-            consistency_vector_calculated_np[
-                np.isnan(consistency_vector_calculated_np)
-                | np.isinf(consistency_vector_calculated_np)
-            ] = float(n)
-
-        results["cv"] = (
-            consistency_vector_calculated_np.tolist()
-        )  # **** ĐẢM BẢO KEY 'cv' ****
-        # Bỏ key 'consistency_vector' nếu không dùng để tránh nhầm lẫn
-
-        valid_cv_elements = consistency_vector_calculated_np[
-            non_zero_weights_indices
-            & ~np.isnan(consistency_vector_calculated_np)
-            & ~np.isinf(consistency_vector_calculated_np)
-        ]
-        lambda_max_val = (
-            valid_cv_elements.mean() if len(valid_cv_elements) > 0 else float(n)
+    def prune(self):
+        """Xóa file quá tuổi, rồi file cũ nhất cho đến khi thư mục còn tối đa max_files kết quả."""
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        continue  # Tiến trình khác vừa xóa/đổi tên
+        except OSError as e:
+            print(f"Không dọn được cache AHP '{self.directory}': {e}")
+            return 0
+        entries.sort()
+        # File .tmp mồ côi (tiến trình chết giữa chừng) cũng chỉ bị xóa khi quá tuổi
+        results = [path for _, path in entries if path.endswith(".npz")]
+        stale = {path for mtime, path in entries if now - mtime > self.max_age}
+        stale.update(path for path in results[:max(0, len(results) - self.max_files)])
+        removed = 0
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def set(self, key, row):
+        # Ghi file tạm rồi đổi tên để tiến trình khác không đọc phải file dở
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **row)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Không ghi được cache AHP '{self.directory}': {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+
+
+class AHPResultCache:
+    """
+    Cache LRU có giới hạn: khóa băm nội dung ma trận -> kết quả một dòng của calculate_ahp_batch.
+    Có đếm hits/misses/evictions; backend (get/set) tùy chọn được hỏi khi bộ nhớ cục bộ trượt.
+    """
+
+    def __init__(self, max_entries=AHP_CACHE_MAX_ENTRIES, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.backend_hits = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._entries.get(key)
+            if row is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return row
+        row = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.backend_hits += 1
+                self._store(key, row)
+        return row
+
+    def put(self, key, row):
+        with self._lock:
+            self._store(key, row)
+        if self.backend is not None:
+            self.backend.set(key, row)
+
+    def _store(self, key, row):
+        self._entries[key] = row
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.backend_hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "backend_hits": self.backend_hits,
+                "backend": type(self.backend).__name__ if self.backend is not None else None,
+            }
+
+
+_AHP_CACHE = AHPResultCache()
+
+
+def configure_ahp_cache(max_entries=None, backend=None):
+    """Đổi giới hạn và/hoặc gắn backend dùng chung cho cache kết quả AHP của tiến trình."""
+    if max_entries is not None:
+        _AHP_CACHE.max_entries = int(max_entries)
+    if backend is not None:
+        _AHP_CACHE.backend = backend
+
+
+def ahp_cache_stats():
+    return _AHP_CACHE.stats()
+
+
+def clear_ahp_cache():
+    _AHP_CACHE.clear()
+
+
+def _matrix_cache_key(matrix, method, tol, max_iter, ri):
+    # Băm đúng byte của ma trận cùng kích thước, tham số phương pháp và RI đang dùng:
+    # sinh lại bảng RI đổi RI thì CR/is_consistent đã cache không còn được tra trúng
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{method}|{tol!r}|{int(max_iter)}|{matrix.shape[0]}|{float(ri)!r}|".encode())
+    digest.update(np.ascontiguousarray(matrix, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def calculate_ahp_batch(
+    matrices_input,
+    matrix_names_for_error=None,
+    method="approx",
+    tol=EIGEN_TOLERANCE,
+    max_iter=EIGEN_MAX_ITER,
+    use_cache=True,
+):
+    """
+    Tính AHP cho một chồng ma trận so sánh cặp dạng (k, n, n), vector hóa theo trục k.
+    Trả về dict các mảng numpy: weights/wsv/cv/normMatrix (k, n[, n]),
+    colSums (k, n), lambdaMax/ci/CR/is_consistent (k,), RI (vô hướng)
+    và error (list k phần tử, None nếu ma trận hợp lệ).
+    Với method="eigen", iterations (k,) là số vòng lặp lũy thừa đã dùng;
+    residual (k,) luôn là ||A·w - λmax·w||∞ của nghiệm trả về.
+    GCI (k,) là chỉ số nhất quán hình học của Aguarón, báo cáo cho mọi phương pháp.
+    Ô NaN là phán đoán còn thiếu: nếu đồ thị so sánh liên thông, trọng số được ước lượng
+    bằng LLSM và CR/GCI tính trên ma trận đã điền w_i / w_j (incomplete, connected, missing_count).
+    Kết quả từng ma trận hợp lệ được nhớ trong cache LRU theo nội dung (xem AHPResultCache):
+    chỉ các ma trận chưa gặp mới phải tính; use_cache=False cho các lô sinh tạm (thử nghiệm, mô phỏng).
+    Chồng ma trận mờ (k, n, n, 3) được chuyển sang fuzzy_ahp_batch.
+    """
+    if method not in PRIORITIZATION_METHODS:
+        raise ValueError(
+            f"Phương pháp '{method}' không được hỗ trợ. Chọn một trong {PRIORITIZATION_METHODS}."
         )
-        results["lambdaMax"] = float(lambda_max_val)  # Key cho template matrix.html
+    matrices = np.array(matrices_input, dtype=float)
+    if matrices.ndim == 4 and matrices.shape[3] == 3:
+        return fuzzy_ahp_batch(matrices, matrix_names_for_error, method, tol, max_iter, use_cache)
+    if matrices.ndim == 2:
+        matrices = matrices[np.newaxis, :, :]
+    if matrices.ndim != 3 or matrices.shape[1] != matrices.shape[2] or matrices.shape[1] == 0:
+        raise ValueError("Chồng ma trận không hợp lệ: cần mảng (k, n, n) với n > 0.")
 
-        ci_val = (lambda_max_val - n) / (n - 1) if n > 1 else 0.0
-        results["ci"] = float(ci_val)  # Key cho template matrix.html
+    k, n, _ = matrices.shape
 
-        ri_val = RI_lookup.get(n, 1.59)
-        ri_val = 0.0 if n <= 2 else ri_val
-        results["RI"] = float(ri_val)  # Key cho template matrix.html (đã là RI)
+    if not use_cache:
+        return _compute_ahp_batch(matrices, matrix_names_for_error, method, tol, max_iter)
 
-        cr_val = (
-            ci_val / ri_val
-            if ri_val > tolerance
-            else (0.0 if math.isclose(ci_val, 0.0, abs_tol=tolerance) else float("inf"))
+    ri = random_index(n, method)
+    keys = [_matrix_cache_key(matrix, method, tol, max_iter, ri) for matrix in matrices]
+    cached_rows = [_AHP_CACHE.get(key) for key in keys]
+    miss_idx = [b for b, row in enumerate(cached_rows) if row is None]
+    if len(miss_idx) == k:
+        computed = _compute_ahp_batch(matrices, matrix_names_for_error, method, tol, max_iter)
+    elif miss_idx:
+        # Tên mặc định "Ma trận {b+1}" theo vị trí trong lô gốc, không theo lô con
+        names = matrix_names_for_error if matrix_names_for_error is not None else [
+            f"Ma trận {b + 1}" for b in range(k)
+        ]
+        computed = _compute_ahp_batch(
+            matrices[miss_idx], [names[b] for b in miss_idx], method, tol, max_iter
         )
-        results["CR"] = float(cr_val)  # Key cho template matrix.html (đã là CR)
+    else:
+        computed = None
+    for j, b in enumerate(miss_idx):
+        if computed["error"][j] is None:  # Lỗi kèm tên ma trận của người gọi nên không lưu
+            cached_rows[b] = {field: computed[field][j].copy() for field in _CACHED_ROW_FIELDS}
+            _AHP_CACHE.put(keys[b], cached_rows[b])
+    if len(miss_idx) == k:
+        return computed
+
+    errors = [None] * k
+    for j, b in enumerate(miss_idx):
+        errors[b] = computed["error"][j]
+        if errors[b] is not None:
+            cached_rows[b] = {field: computed[field][j] for field in _CACHED_ROW_FIELDS}
+    return {
+        "k": k,
+        "n": n,
+        **{field: np.stack([row[field] for row in cached_rows]) for field in _CACHED_ROW_FIELDS},
+        "RI": ri,
+        "GCI_threshold": GCI_THRESHOLDS.get(n, GCI_THRESHOLD_DEFAULT) if n > 2 else 0.0,
+        "error": errors,
+        "method": method,
+    }
+
+
+def _compute_ahp_batch(matrices, matrix_names_for_error, method, tol, max_iter):
+    """Phần tính thực sự của calculate_ahp_batch trên chồng (k, n, n) đã kiểm tra kích thước (bản sao riêng)."""
+    k, n, _ = matrices.shape
+
+    # Ô thiếu (NaN ngoài đường chéo, ở một trong hai nửa) -> ước lượng bằng LLSM rồi điền vào
+    off_diagonal = ~np.eye(n, dtype=bool)
+    missing = np.isnan(matrices) & off_diagonal
+    missing |= np.swapaxes(missing, 1, 2)
+    incomplete = missing.any(axis=(1, 2))
+    connected = np.ones(k, dtype=bool)
+    # NaN không tính là không dương; chỉ RGMM và LLSM (ma trận thiếu) bắt buộc phần tử dương
+    with np.errstate(invalid="ignore"):
+        positive = np.where(np.isnan(matrices), True, matrices > 0).all(axis=(1, 2))
+    positive_mask = positive if method == "geometric" else np.ones(k, dtype=bool)
+    llsm_idx = np.flatnonzero(incomplete)
+    if llsm_idx.size:
+        positive_mask[llsm_idx] = positive[llsm_idx]
+        known = ~missing[llsm_idx] & off_diagonal
+        connected[llsm_idx] = _comparison_graph_connected(known)
+        solvable = connected[llsm_idx] & positive[llsm_idx] & np.isfinite(
+            np.where(known, matrices[llsm_idx], 1.0)).all(axis=(1, 2))
+        llsm_idx, known = llsm_idx[solvable], known[solvable]
+    if llsm_idx.size:
+        matrices[llsm_idx], llsm_weights = _complete_llsm(matrices[llsm_idx], known)
+
+    finite_mask = np.isfinite(matrices).all(axis=(1, 2))
+    diag_mask = np.isclose(
+        np.diagonal(matrices, axis1=1, axis2=2), 1.0, rtol=0.0, atol=_TOLERANCE
+    ).all(axis=1)
+    with np.errstate(invalid="ignore", over="ignore"):
+        col_sums = matrices.sum(axis=1)
+    valid_mask = finite_mask & positive_mask & diag_mask & connected & (col_sums > _TOLERANCE).all(axis=1)
+    errors = _batch_error_messages(
+        matrices, finite_mask, positive_mask, diag_mask, col_sums, matrix_names_for_error, connected
+    )
+
+    # Thay ma trận lỗi bằng ma trận toàn 1 (nhất quán tuyệt đối) để phép tính vector hóa không sinh NaN
+    safe = np.where(valid_mask[:, None, None], matrices, 1.0)
+    weights, iterations, norm_matrix = _priority_weights(safe, method, tol, max_iter)
+    if llsm_idx.size:
+        # Ma trận thiếu ô: trọng số là nghiệm LLSM, chỉ số nhất quán tính trên ma trận đã điền
+        weights[llsm_idx] = llsm_weights
+        iterations[llsm_idx] = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_safe = np.log(safe)  # Chỉ hữu hạn khi mọi phần tử dương (luôn đúng với "geometric")
+    measures = _consistency_measures(safe, weights, log_safe, method)
+
+    return {
+        "k": k,
+        "n": n,
+        "weights": weights,
+        **measures,
+        "is_consistent": valid_mask & measures["is_consistent"],
+        "error": errors,
+        "colSums": col_sums,
+        "normMatrix": norm_matrix,
+        "valid": valid_mask,
+        "method": method,
+        "iterations": iterations,
+        "incomplete": incomplete,
+        "connected": connected,
+        "missing_count": missing.sum(axis=(1, 2)) // 2,
+    }
+
 
-        results["is_consistent"] = bool(
-            cr_val <= 0.1 + tolerance
-        )  # Key cho template matrix.html
+def fuzzy_ahp_batch(matrices_input, matrix_names_for_error=None, method="approx",
+                    tol=EIGEN_TOLERANCE, max_iter=EIGEN_MAX_ITER, use_cache=True):
+    """
+    AHP mờ (Buckley) cho chồng ma trận TFN (k, n, n, 3), vector hóa như calculate_ahp_batch:
+    r_i = (Π_j a_ij)^(1/n) theo từng thành phần l, m, u; trọng số mờ w_i = r_i ⊗ (Σ r)^-1
+    = (r_il / Σ r_u, r_im / Σ r_m, r_iu / Σ r_l); khử mờ bằng trọng tâm (l + m + u) / 3 rồi chuẩn hóa.
+    CR, GCI và các vector nhất quán lấy từ ma trận trung tâm (thành phần m) tính bằng `method`.
+    Trả về cùng key với calculate_ahp_batch, thêm fuzzy_weights (k, n, 3) và fuzzy (k,).
+    """
+    matrices = np.array(matrices_input, dtype=float)
+    if matrices.ndim != 4 or matrices.shape[1] != matrices.shape[2] or matrices.shape[3] != 3 or matrices.shape[1] == 0:
+        raise ValueError("Chồng ma trận mờ không hợp lệ: cần mảng (k, n, n, 3) với n > 0.")
+    k, n = matrices.shape[:2]
+    names = matrix_names_for_error if matrix_names_for_error is not None else [f"Ma trận {b + 1}" for b in range(k)]
+    modal = calculate_ahp_batch(matrices[..., 1], names, method=method, tol=tol, max_iter=max_iter, use_cache=use_cache)
 
-        return results
+    with np.errstate(invalid="ignore"):
+        ordered = ((matrices[..., 0] <= matrices[..., 1]) & (matrices[..., 1] <= matrices[..., 2])
+                   & (matrices[..., 0] > 0)).all(axis=(1, 2))
+    finite = np.isfinite(matrices).all(axis=(1, 2, 3))
+    valid = modal["valid"] & ordered & finite
+    errors = list(modal["error"])
+    for b in np.flatnonzero(~valid):
+        if errors[b] is None:
+            errors[b] = f"{names[b]}: Số mờ phải dương, hữu hạn và có l <= m <= u."
+
+    safe = np.where(valid[:, None, None, None], matrices, 1.0)
+    log_rows = np.log(safe).mean(axis=2)  # (k, n, 3)
+    # Nhân mọi thành phần với cùng một hằng số không đổi trọng số mờ, chỉ để tránh tràn số
+    row_means = np.exp(log_rows - log_rows[..., 1].max(axis=1)[:, np.newaxis, np.newaxis])
+    fuzzy_weights = row_means / row_means.sum(axis=1)[:, np.newaxis, ::-1]
+    centroids = fuzzy_weights.mean(axis=2)
+    return {
+        **modal,
+        "weights": centroids / centroids.sum(axis=1, keepdims=True),
+        "fuzzy_weights": fuzzy_weights,
+        "fuzzy": np.ones(k, dtype=bool),
+        "valid": valid,
+        "is_consistent": modal["is_consistent"] & valid,
+        "error": errors,
+    }
+
+
+# Nhóm key theo kiểu giá trị khi tạo view Python từ mảng
+_RESULT_LIST_KEYS = ("weights", "wsv", "cv", "colSums", "normMatrix", "fuzzy_weights")
+_RESULT_BOOL_KEYS = ("is_consistent", "incomplete", "connected", "fuzzy")
+_RESULT_INT_KEYS = ("iterations", "missing_count")
+_RESULT_BATCH_KEYS = ("n", "RI", "method", "GCI_threshold")
+# Bỏ khi tuần tự hóa gọn: normMatrix (n²) và colSums chỉ là bước trung gian, không hiển thị ở đâu
+_RESULT_COMPACT_OMIT_KEYS = ("colSums", "normMatrix")
+
+
+class AHPResult(Mapping):
+    """
+    Kết quả AHP của một ma trận, đọc trực tiếp từ mảng của lô calculate_ahp_batch (không sao chép).
+    Dùng như dict chỉ đọc (key như AHP_RESULT_KEYS, template Jinja đọc được res.CR);
+    list/float Python chỉ được tạo khi key được đọc lần đầu rồi giữ lại.
+    to_compact()/from_compact() cho dạng JSON gọn để lưu session và CSDL.
+    """
+
+    __slots__ = ("_batch", "_index", "_views")
+
+    def __init__(self, batch, index=0):
+        self._batch = batch
+        self._index = index
+        self._views = None
+
+    def __getitem__(self, key):
+        if key not in AHP_RESULT_KEYS:
+            raise KeyError(key)
+        if self._views is None:
+            self._views = {}
+        if key not in self._views:
+            self._views[key] = self._materialize(key)
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(AHP_RESULT_KEYS)
+
+    def __len__(self):
+        return len(AHP_RESULT_KEYS)
+
+    def __repr__(self):
+        return f"AHPResult(n={self['n']}, CR={self['CR']}, error={self['error']!r})"
+
+    def _materialize(self, key):
+        batch, b = self._batch, self._index
+        error = batch["error"][b]
+        if key == "error":
+            return error
+        if key in _RESULT_BATCH_KEYS:
+            return None if error and key != "n" else batch.get(key)
+        if error and key not in ("is_consistent", "connected"):
+            return None
+        values = self.array(key)
+        if values is None:
+            return False if key == "is_consistent" else None
+        if key in _RESULT_LIST_KEYS:
+            return values.tolist()
+        if key in _RESULT_BOOL_KEYS:
+            return bool(values)
+        if key in _RESULT_INT_KEYS:
+            return int(values)
+        return float(values)
+
+    def array(self, key):
+        """Giá trị dạng ndarray (view vào lô) cho phép tính tiếp; None nếu không có."""
+        values = self._batch.get(key)
+        return None if values is None else values[self._index]
+
+    def to_compact(self):
+        """Dict JSON được, bỏ các mảng trung gian (_RESULT_COMPACT_OMIT_KEYS)."""
+        if self["error"]:
+            return {"n": self["n"], "error": self["error"], "is_consistent": False, "connected": self["connected"]}
+        return {key: self[key] for key in AHP_RESULT_KEYS if key not in _RESULT_COMPACT_OMIT_KEYS}
+
+    @classmethod
+    def from_compact(cls, data):
+        """Dựng lại từ dict (dạng gọn hoặc dict đầy đủ kiểu cũ)."""
+        batch = {"k": 1, "error": [data.get("error")]}
+        for key in AHP_RESULT_KEYS:
+            value = data.get(key)
+            if key == "error" or value is None:
+                continue
+            batch[key] = value if key in _RESULT_BATCH_KEYS else np.asarray([value])
+        batch.setdefault("n", 0)
+        return cls(batch, 0)
+
+
+def compact_ahp_result(result):
+    """Dạng JSON gọn của một kết quả (AHPResult hoặc dict thường)."""
+    return result.to_compact() if isinstance(result, AHPResult) else result
+
+
+def unpack_ahp_batch(batch_results):
+    """Tách kết quả calculate_ahp_batch thành list AHPResult (mỗi phần tử trỏ vào cùng lô)."""
+    return [AHPResult(batch_results, b) for b in range(batch_results["k"])]
+
+
+def calculate_ahp(matrix_input, matrix_name_for_error="Ma trận", method="approx", **method_options):
+    # Kết quả lỗi vẫn có đủ key mà template matrix.html và result.html mong đợi (giá trị None)
+    results = {"n": 0}
+    try:
+        matrix = np.array(matrix_input, dtype=float)
+        if is_fuzzy_matrix(matrix) and matrix.shape[0] > 0:
+            batch = fuzzy_ahp_batch(matrix[np.newaxis], [matrix_name_for_error], method=method, **method_options)
+            return unpack_ahp_batch(batch)[0]
+        if matrix.ndim != 2 or matrix.shape[0] == 0 or matrix.shape[1] != matrix.shape[0]:
+            results["n"] = matrix.shape[0] if matrix.ndim >= 1 else 0
+            raise ValueError("Ma trận không hợp lệ hoặc không vuông.")
+        batch = calculate_ahp_batch(
+            matrix[np.newaxis], [matrix_name_for_error], method=method, **method_options
+        )
+        return unpack_ahp_batch(batch)[0]
 
     except ValueError as ve:
         error_msg = f"Lỗi dữ liệu AHP ({matrix_name_for_error}): {ve}"
         print(error_msg)
-        final_error_results = {k: None for k in results.keys()}
-        final_error_results.update(
-            {"n": n_val_for_except, "error": error_msg, "is_consistent": False}
-        )
-        return final_error_results
+        results["error"] = error_msg
+        return AHPResult.from_compact(results)
     except Exception as e:
         error_msg = f"Lỗi không xác định trong AHP ({matrix_name_for_error}): {type(e).__name__} - {e}"
         print(error_msg)
-        final_error_results = {k: None for k in results.keys()}
-        final_error_results.update(
-            {"n": n_val_for_except, "error": error_msg, "is_consistent": False}
+        results["error"] = error_msg
+        return AHPResult.from_compact(results)
+
+
+def create_incremental_state(matrix_input, method="approx", matrix_name_for_error="Ma trận"):
+    """
+    Tính đầy đủ một lần và giữ lại các đại lượng phụ (tổng cột, tổng log theo hàng,
+    trọng số) để các lần sửa một ô sau đó dùng update_ahp_judgment.
+    Trả về (state, results) hoặc (None, results) nếu ma trận lỗi.
+    """
+    matrix = np.array(matrix_input, dtype=float)
+    results = calculate_ahp(matrix, matrix_name_for_error, method=method)
+    if results.get("error"):
+        return None, results
+    with np.errstate(divide="ignore"):
+        log_row_sums = np.log(matrix).sum(axis=1)
+    state = {
+        "matrix": matrix,
+        "method": method,
+        "col_sums": matrix.sum(axis=0),
+        "approx_weights": (matrix / matrix.sum(axis=0)).mean(axis=1),
+        "log_row_sums": log_row_sums,
+        "weights": np.array(results["weights"]),
+    }
+    return state, results
+
+
+def update_ahp_judgment(state, i, j, value, tol=EIGEN_TOLERANCE, max_iter=EIGEN_MAX_ITER):
+    """
+    Cập nhật một phán đoán a_ij (và a_ji = 1/a_ij) trên state của create_incremental_state.
+    Chỉ cột i, j thay đổi nên trọng số "approx" và tổng log của RGMM được cập nhật O(n);
+    "eigen" lặp lũy thừa khởi động từ trọng số trước đó nên thường chỉ cần vài vòng.
+    Trả về (state mới, results) với results là AHPResult cùng key như calculate_ahp (normMatrix = None).
+    """
+    matrix = state["matrix"].copy()
+    n = matrix.shape[0]
+    if not (0 <= i < n and 0 <= j < n) or i == j:
+        raise ValueError(f"Ô [{i+1},{j+1}] không hợp lệ cho ma trận {n}x{n}.")
+    value = float(value)
+    if not np.isfinite(value) or value <= 0:
+        raise ValueError(f"Giá trị so sánh phải dương, nhận được {value}.")
+
+    old_value = matrix[i, j]
+    col_sums = state["col_sums"].copy()
+    approx_weights = state["approx_weights"].copy()
+
+    # Bỏ đóng góp cũ của cột i, j vào trung bình hàng, cập nhật ô và tổng cột, cộng đóng góp mới
+    approx_weights -= (matrix[:, i] / col_sums[i] + matrix[:, j] / col_sums[j]) / n
+    matrix[i, j], matrix[j, i] = value, 1.0 / value
+    col_sums[j] += value - old_value
+    col_sums[i] += 1.0 / value - 1.0 / old_value
+    approx_weights += (matrix[:, i] / col_sums[i] + matrix[:, j] / col_sums[j]) / n
+
+    log_row_sums = state["log_row_sums"].copy()
+    log_delta = np.log(value) - np.log(old_value)
+    log_row_sums[i] += log_delta
+    log_row_sums[j] -= log_delta
+
+    method = state["method"]
+    iterations = np.zeros(1, dtype=int)
+    if method == "eigen":
+        weights, iterations = _power_iteration(
+            matrix[np.newaxis], state["weights"][np.newaxis], tol, max_iter
         )
-        return final_error_results
+        weights = weights[0]
+    elif method == "geometric":
+        log_row_means = log_row_sums / n
+        weights = np.exp(log_row_means - log_row_means.max())
+        weights /= weights.sum()
+    else:
+        weights = approx_weights / approx_weights.sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_matrix = np.log(matrix)
+    measures = _consistency_measures(
+        matrix[np.newaxis], weights[np.newaxis], log_matrix[np.newaxis], method
+    )
+    results = AHPResult(
+        {
+            "k": 1,
+            "n": n,
+            "weights": weights[np.newaxis],
+            **measures,
+            "error": [None],
+            "colSums": col_sums[np.newaxis],
+            "method": method,
+            "iterations": iterations,
+            "incomplete": np.zeros(1, dtype=bool),
+            "connected": np.ones(1, dtype=bool),
+            "missing_count": np.zeros(1, dtype=int),
+        }
+    )
+    new_state = {
+        "matrix": matrix,
+        "method": method,
+        "col_sums": col_sums,
+        "approx_weights": approx_weights,
+        "log_row_sums": log_row_sums,
+        "weights": weights,
+    }
+    return new_state, results
 
 
 def get_sorted_criteria_with_weights(criteria_results, db_criteria_tuples):
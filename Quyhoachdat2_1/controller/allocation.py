@@ -0,0 +1,146 @@
+# controller/allocation.py
+import numpy as np
+
+try:
+    from scipy.optimize import linprog
+    from scipy.sparse import csr_matrix
+except ImportError:  # scipy không bắt buộc: chỉ chế độ LP cần đến
+    linprog = csr_matrix = None
+
+ALLOCATION_METHODS = ("greedy", "lp")
+# x_pu của nghiệm LP coi là nguyên (đã giao) khi lớn hơn 1 - sai số này
+ALLOCATION_LP_INTEGRAL_TOL = 1e-6
+# Điểm trong (có crossover về nghiệm đỉnh) nhanh hơn simplex nhiều lần với hàng trăm nghìn biến
+ALLOCATION_LP_SOLVER = "highs-ipm"
+
+
+def available_allocation_methods():
+    """Các phương pháp dùng được trong môi trường hiện tại ("lp" chỉ khi có scipy)."""
+    return tuple(method for method in ALLOCATION_METHODS if method != "lp" or linprog is not None)
+
+
+def _validate_allocation_inputs(suitability, areas, demands):
+    suitability = np.asarray(suitability, dtype=float)
+    areas = np.asarray(areas, dtype=float)
+    demands = np.asarray(demands, dtype=float)
+    if suitability.ndim != 2 or areas.shape != (suitability.shape[0],) or demands.shape != (suitability.shape[1],):
+        raise ValueError(
+            f"Kích thước không khớp: điểm thích hợp (thửa, loại đất) {suitability.shape}, "
+            f"diện tích {areas.shape}, nhu cầu {demands.shape}."
+        )
+    if np.isnan(areas).any() or (areas <= 0).any():
+        raise ValueError("Diện tích mọi thửa đất phải là số dương.")
+    if np.isnan(demands).any() or (demands < 0).any():
+        raise ValueError("Nhu cầu diện tích của mỗi loại đất phải là số không âm.")
+    return suitability, areas, demands
+
+
+def _greedy_fill(suitability, areas, remaining, assignment):
+    """Giao các thửa còn trống theo cặp (thửa, loại đất) điểm giảm dần, trong phần nhu cầu còn lại."""
+    n_uses = suitability.shape[1]
+    flat = np.where(assignment[:, np.newaxis] < 0, suitability, np.nan).ravel()
+    candidates = np.flatnonzero(flat > 0)
+    order = candidates[np.argsort(-flat[candidates], kind="stable")]
+    parcels_left = int((assignment < 0).sum())
+    min_area = areas.min() if areas.size else 0.0
+    for pair in order.tolist():
+        parcel, use = divmod(pair, n_uses)
+        if assignment[parcel] >= 0 or areas[parcel] > remaining[use]:
+            continue
+        assignment[parcel] = use
+        remaining[use] -= areas[parcel]
+        parcels_left -= 1
+        if not parcels_left or (remaining < min_area).all():
+            break
+    return assignment
+
+
+def greedy_allocation(suitability, areas, demands):
+    """
+    Phân bổ tham lam: duyệt mọi cặp (thửa, loại đất) theo điểm thích hợp giảm dần (hàng đợi ưu tiên
+    tĩnh sắp một lần bằng argsort), giao thửa cho loại đất nếu thửa còn trống và diện tích còn vừa nhu cầu.
+    Cặp điểm NaN hoặc không dương bị bỏ qua (thửa không thích hợp cho loại đất đó).
+    """
+    suitability, areas, demands = _validate_allocation_inputs(suitability, areas, demands)
+    assignment = np.full(suitability.shape[0], -1, dtype=np.intp)
+    return _greedy_fill(suitability, areas, demands.copy(), assignment)
+
+
+def lp_allocation(suitability, areas, demands):
+    """
+    Phân bổ theo quy hoạch tuyến tính (scipy.optimize.linprog, HiGHS):
+    max Σ a_p·s_pu·x_pu với Σ_u x_pu ≤ 1 cho mỗi thửa, Σ_p a_p·x_pu ≤ D_u cho mỗi loại đất, 0 ≤ x ≤ 1.
+    Nghiệm đỉnh chỉ có tối đa vài thửa bị chia (cỡ số loại đất); các thửa đó được giao lại bằng tham lam.
+    Giá trị tối ưu LP là cận trên của mọi phân bổ nguyên nên trả về kèm để đo khoảng cách tối ưu.
+    Diện tích thửa bằng nhau thì LP là bài toán vận tải, nghiệm nguyên và chính xác.
+    """
+    if linprog is None:
+        raise ValueError("Chế độ phân bổ LP cần thư viện scipy; hãy dùng chế độ 'greedy'.")
+    suitability, areas, demands = _validate_allocation_inputs(suitability, areas, demands)
+    n_parcels, n_uses = suitability.shape
+    usable = (suitability > 0).ravel()
+    gains = np.where(usable, (areas[:, np.newaxis] * np.nan_to_num(suitability)).ravel(), 0.0)
+    pair_idx = np.arange(n_parcels * n_uses)
+    constraints = csr_matrix(
+        (np.concatenate([np.ones(pair_idx.size), np.repeat(areas, n_uses)]),
+         (np.concatenate([pair_idx // n_uses, n_parcels + pair_idx % n_uses]), np.tile(pair_idx, 2))),
+        shape=(n_parcels + n_uses, pair_idx.size),
+    )
+    result = linprog(
+        -gains,
+        A_ub=constraints,
+        b_ub=np.concatenate([np.ones(n_parcels), demands]),
+        bounds=np.column_stack([np.zeros(pair_idx.size), usable.astype(float)]),
+        method=ALLOCATION_LP_SOLVER,
+    )
+    if result.x is None:
+        raise ValueError(f"Không giải được bài toán phân bổ LP: {result.message}")
+    chosen = result.x.reshape(n_parcels, n_uses) > 1.0 - ALLOCATION_LP_INTEGRAL_TOL
+    assignment = np.where(chosen.any(axis=1), chosen.argmax(axis=1), -1).astype(np.intp)
+    remaining = demands - np.bincount(assignment[assignment >= 0], weights=areas[assignment >= 0], minlength=n_uses)
+    return _greedy_fill(suitability, areas, remaining, assignment), float(-result.fun)
+
+
+def allocate_land(suitability, areas, demands, use_names=None, method="greedy"):
+    """
+    Phân bổ thửa đất cho các loại sử dụng đất dựa trên điểm thích hợp AHP (thửa, loại đất),
+    diện tích thửa và nhu cầu diện tích (trần) của từng loại. Trả về phân bổ (N,) với -1 là chưa giao
+    và bảng tóm tắt JSON được theo loại đất.
+    """
+    if method not in ALLOCATION_METHODS:
+        raise ValueError(f"Phương pháp phân bổ không hợp lệ: {method}. Chọn một trong {ALLOCATION_METHODS}.")
+    suitability, areas, demands = _validate_allocation_inputs(suitability, areas, demands)
+    n_uses = suitability.shape[1]
+    use_names = list(use_names) if use_names is not None else [f"Loại đất {u + 1}" for u in range(n_uses)]
+    upper_bound = None
+    if method == "lp":
+        assignment, upper_bound = lp_allocation(suitability, areas, demands)
+    else:
+        assignment = greedy_allocation(suitability, areas, demands)
+
+    assigned = assignment >= 0
+    uses = assignment[assigned]
+    gains = areas[assigned] * suitability[np.flatnonzero(assigned), uses]
+    allocated_area = np.bincount(uses, weights=areas[assigned], minlength=n_uses)
+    allocated_gain = np.bincount(uses, weights=gains, minlength=n_uses)
+    counts = np.bincount(uses, minlength=n_uses)
+    return {
+        "assignment": assignment,
+        "method": method,
+        "total_suitability": float(gains.sum()),
+        "upper_bound": upper_bound,
+        "optimality_gap": (upper_bound - float(gains.sum())) / upper_bound if upper_bound else None,
+        "assigned_parcels": int(assigned.sum()),
+        "unassigned_parcels": int((~assigned).sum()),
+        "uses": [
+            {
+                "name": use_names[u],
+                "demand": float(demands[u]),
+                "allocated_area": float(allocated_area[u]),
+                "fulfilled": float(allocated_area[u] / demands[u]) if demands[u] > 0 else None,
+                "parcels": int(counts[u]),
+                "mean_suitability": float(allocated_gain[u] / allocated_area[u]) if allocated_area[u] > 0 else None,
+            }
+            for u in range(n_uses)
+        ],
+    }
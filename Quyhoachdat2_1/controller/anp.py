@@ -0,0 +1,268 @@
+# controller/anp.py
+import json
+import sys
+from collections import Counter
+
+import numpy as np
+
+from controller.ahp import calculate_ahp_batch
+
+# Sai số tuyệt đối tối đa giữa hai lũy thừa liên tiếp để coi siêu ma trận đã hội tụ
+ANP_LIMIT_TOL = 1e-9
+# Số lần bình phương tối đa: W^(2^k); 48 lần đủ để mọi thành phần chuyển tiếp tắt hẳn
+ANP_MAX_SQUARINGS = 48
+
+
+def compile_network(spec):
+    """
+    Biên dịch mạng ANP {"clusters": [{"name", "nodes": [...]}],
+    "node_comparisons": [{"with_respect_to": nút, "cluster": cụm, "matrix"}],
+    "cluster_comparisons": [{"with_respect_to": cụm, "clusters": [...], "matrix"}]}.
+    Mỗi so sánh nút cho một khối cột của siêu ma trận: ưu tiên các nút của "cluster" theo ảnh hưởng lên nút
+    "with_respect_to". Cụm không có so sánh cụm thì chia đều trọng số cho các cụm nó chịu ảnh hưởng.
+    """
+    clusters = spec.get("clusters") or []
+    names, node_cluster, cluster_names, cluster_start = [], [], [], []
+    for c, cluster in enumerate(clusters):
+        nodes = [str(node).strip() for node in cluster.get("nodes") or []]
+        if not nodes:
+            raise ValueError(f"Cụm '{cluster.get('name')}' không có nút nào.")
+        cluster_names.append(str(cluster.get("name", "")).strip())
+        cluster_start.append(len(names))
+        names.extend(nodes)
+        node_cluster.extend([c] * len(nodes))
+    if not names:
+        raise ValueError("Mạng ANP cần ít nhất một cụm có nút.")
+    duplicated = [name for name, count in Counter(names + cluster_names).items() if count > 1]
+    if duplicated:
+        raise ValueError(f"Tên nút/cụm trong mạng ANP bị trùng: {', '.join(sorted(duplicated))}.")
+    node_idx = {name: i for i, name in enumerate(names)}
+    cluster_idx = {name: c for c, name in enumerate(cluster_names)}
+    cluster_sizes = np.bincount(node_cluster, minlength=len(cluster_names))
+
+    def lookup(index, name, kind):
+        try:
+            return index[str(name).strip()]
+        except KeyError:
+            raise ValueError(f"Không tìm thấy {kind} '{name}' trong mạng ANP.")
+
+    # Mỗi khối: (cột nút, cụm đích, ma trận so sánh các nút của cụm đích)
+    blocks, seen = [], set()
+    for comparison in spec.get("node_comparisons") or []:
+        column = lookup(node_idx, comparison.get("with_respect_to"), "nút")
+        target = lookup(cluster_idx, comparison.get("cluster"), "cụm")
+        size = int(cluster_sizes[target])
+        matrix = comparison.get("matrix")
+        if matrix is None and size == 1:
+            matrix = [[1.0]]
+        matrix = np.asarray(matrix, dtype=float) if matrix is not None else None
+        if matrix is None or matrix.shape[:2] != (size, size):
+            raise ValueError(
+                f"So sánh cụm '{cluster_names[target]}' theo nút '{names[column]}' cần ma trận {size}x{size}, "
+                f"nhận {'không có' if matrix is None else matrix.shape}."
+            )
+        if (column, target) in seen:
+            raise ValueError(f"Cụm '{cluster_names[target]}' được so sánh hai lần theo nút '{names[column]}'.")
+        seen.add((column, target))
+        blocks.append((column, target, matrix))
+
+    cluster_blocks = []
+    for comparison in spec.get("cluster_comparisons") or []:
+        source = lookup(cluster_idx, comparison.get("with_respect_to"), "cụm")
+        targets = [lookup(cluster_idx, name, "cụm") for name in comparison.get("clusters") or []]
+        matrix = np.asarray(comparison.get("matrix", [[1.0]] if len(targets) == 1 else None), dtype=float)
+        if not targets or matrix.shape[:2] != (len(targets), len(targets)):
+            raise ValueError(
+                f"So sánh cụm theo cụm '{cluster_names[source]}' cần ma trận {len(targets)}x{len(targets)}, "
+                f"nhận {matrix.shape}."
+            )
+        cluster_blocks.append((source, np.array(targets, dtype=int), matrix))
+
+    return {
+        "names": names,
+        "node_cluster": np.array(node_cluster, dtype=int),
+        "cluster_names": cluster_names,
+        "cluster_start": np.array(cluster_start, dtype=int),
+        "cluster_sizes": cluster_sizes,
+        "blocks": blocks,
+        "cluster_blocks": cluster_blocks,
+    }
+
+
+def _batch_weights(matrices, labels, method):
+    """Trọng số và CR của một danh sách ma trận, gộp ma trận cùng kích thước vào một lần gọi batch."""
+    weights = [None] * len(matrices)
+    crs = np.zeros(len(matrices))
+    consistent = np.ones(len(matrices), dtype=bool)
+    errors = []
+    sizes = np.array([matrix.shape[0] for matrix in matrices], dtype=int)
+    for size in np.unique(sizes):
+        ids = np.flatnonzero(sizes == size)
+        batch = calculate_ahp_batch(np.stack([matrices[i] for i in ids]), [labels[i] for i in ids], method=method)
+        errors.extend(err for err in batch["error"] if err)
+        crs[ids] = batch["CR"]
+        consistent[ids] = batch["is_consistent"]
+        for row, i in enumerate(ids):
+            weights[i] = batch["weights"][row]
+    if errors:
+        raise ValueError("; ".join(errors))
+    return weights, crs, consistent
+
+
+def build_supermatrix(compiled, method="approx"):
+    """
+    Siêu ma trận chưa trọng số (cột = nút chịu ảnh hưởng, khối hàng = ưu tiên các nút của cụm đích)
+    và siêu ma trận có trọng số: mỗi khối nhân trọng số cụm rồi chuẩn hóa lại để mọi cột có tổng 1.
+    Cột không chịu ảnh hưởng nào (nút chìm) được gán vòng tự thân để siêu ma trận vẫn ngẫu nhiên theo cột.
+    """
+    names, node_cluster = compiled["names"], compiled["node_cluster"]
+    cluster_names = compiled["cluster_names"]
+    n, k = len(names), len(cluster_names)
+
+    blocks = compiled["blocks"]
+    node_weights, node_crs, node_consistent = _batch_weights(
+        [matrix for _, _, matrix in blocks],
+        [f"Cụm '{cluster_names[target]}' theo nút '{names[column]}'" for column, target, _ in blocks],
+        method,
+    )
+    unweighted = np.zeros((n, n))
+    for (column, target, _), weights in zip(blocks, node_weights):
+        start = compiled["cluster_start"][target]
+        unweighted[start:start + weights.size, column] = weights
+
+    # Trọng số cụm C[a, b]: mức ảnh hưởng của cụm a lên cụm b; mặc định chia đều cho các cụm có khối
+    linked = np.zeros((k, k), dtype=bool)
+    for column, target, _ in blocks:
+        linked[target, node_cluster[column]] = True
+    cluster_weights = linked / np.maximum(linked.sum(axis=0), 1)
+    cluster_blocks = compiled["cluster_blocks"]
+    block_weights, cluster_crs, cluster_consistent = _batch_weights(
+        [matrix for _, _, matrix in cluster_blocks],
+        [f"Các cụm theo cụm '{cluster_names[source]}'" for source, _, _ in cluster_blocks],
+        method,
+    )
+    for (source, targets, _), weights in zip(cluster_blocks, block_weights):
+        cluster_weights[:, source] = 0.0
+        cluster_weights[targets, source] = weights
+
+    weighted = unweighted * cluster_weights[node_cluster[:, np.newaxis], node_cluster[np.newaxis, :]]
+    column_sums = weighted.sum(axis=0)
+    sinks = column_sums <= 0
+    weighted[:, ~sinks] /= column_sums[~sinks]
+    weighted[np.flatnonzero(sinks), np.flatnonzero(sinks)] = 1.0
+
+    crs = np.concatenate([node_crs, cluster_crs])
+    return {
+        "unweighted": unweighted,
+        "weighted": weighted,
+        "cluster_weights": cluster_weights,
+        "sinks": np.flatnonzero(sinks),
+        "node_crs": node_crs,
+        "cluster_crs": cluster_crs,
+        "CR": float(crs.max()) if crs.size else 0.0,
+        "is_consistent": bool(node_consistent.all() and cluster_consistent.all()),
+    }
+
+
+def limit_supermatrix(weighted, tol=ANP_LIMIT_TOL, max_squarings=ANP_MAX_SQUARINGS):
+    """
+    Ma trận giới hạn của siêu ma trận ngẫu nhiên theo cột W.
+    Bình phương liên tiếp P <- P·P (W^2, W^4, ...) đến khi hai lần liên tiếp chênh nhau dưới tol: O(N^3 log k)
+    thay vì nhân k lần. Nếu W·P ≠ P thì W có chu kỳ (không nguyên thủy): đi hết một vòng P, W·P, W²·P, ...
+    đến khi quay về P rồi lấy trung bình Cesàro của vòng. Trả về (ma trận giới hạn, số lần bình phương, chu kỳ).
+    """
+    weighted = np.asarray(weighted, dtype=float)
+    n = weighted.shape[0]
+    if weighted.shape != (n, n) or n == 0:
+        raise ValueError(f"Siêu ma trận phải vuông, nhận {weighted.shape}.")
+    if (weighted < 0).any() or not np.allclose(weighted.sum(axis=0), 1.0):
+        raise ValueError("Siêu ma trận có trọng số phải không âm và mọi cột có tổng bằng 1.")
+
+    power = weighted
+    squarings = 0
+    while squarings < max_squarings:
+        squared = power @ power
+        squared /= squared.sum(axis=0)  # Giữ tổng cột = 1, tránh sai số làm tròn tích lũy
+        squarings += 1
+        converged = np.abs(squared - power).max() < tol
+        power = squared
+        if converged:
+            break
+
+    if np.abs(weighted @ power - power).max() < tol:
+        return power, squarings, 1
+    # Chu kỳ p <= N: các thành phần chuyển tiếp đã tắt sau các lần bình phương nên vòng phải khép lại
+    cycle = [power]
+    current = power
+    for _ in range(n):
+        current = weighted @ current
+        if np.abs(current - power).max() < tol:
+            limit = np.mean(cycle, axis=0)
+            return limit, squarings, len(cycle)
+        cycle.append(current)
+    raise ValueError(
+        f"Siêu ma trận không hội tụ sau {squarings} lần bình phương và không tìm được chu kỳ; "
+        "hãy kiểm tra lại cấu trúc mạng."
+    )
+
+
+def evaluate_network(compiled, method="approx", tol=ANP_LIMIT_TOL):
+    """
+    Giải mạng ANP: siêu ma trận có trọng số, ma trận giới hạn và ưu tiên giới hạn của các nút
+    (trung bình các cột giới hạn; khi W nguyên thủy mọi cột bằng nhau). Ưu tiên cũng được chuẩn hóa
+    trong từng cụm để đọc trực tiếp xếp hạng phương án.
+    """
+    supermatrix = build_supermatrix(compiled, method)
+    limit, squarings, period = limit_supermatrix(supermatrix["weighted"], tol=tol)
+    priorities = limit.mean(axis=1)
+    node_cluster = compiled["node_cluster"]
+    cluster_totals = np.bincount(node_cluster, weights=priorities, minlength=len(compiled["cluster_names"]))
+    cluster_priorities = np.divide(
+        priorities, cluster_totals[node_cluster],
+        out=np.zeros_like(priorities), where=cluster_totals[node_cluster] > 0,
+    )
+    return {
+        **compiled,
+        **supermatrix,
+        "limit": limit,
+        "squarings": squarings,
+        "period": period,
+        "is_cyclic": period > 1,
+        "priorities": priorities,
+        "cluster_priorities": cluster_priorities,
+    }
+
+
+def network_to_records(evaluated):
+    """Ưu tiên giới hạn theo từng cụm, dạng JSON được."""
+    names, node_cluster = evaluated["names"], evaluated["node_cluster"]
+    return {
+        "CR": evaluated["CR"],
+        "is_consistent": evaluated["is_consistent"],
+        "is_cyclic": evaluated["is_cyclic"],
+        "period": evaluated["period"],
+        "squarings": evaluated["squarings"],
+        "clusters": [
+            {
+                "name": cluster_name,
+                "nodes": [
+                    {
+                        "name": names[i],
+                        "limit_priority": float(evaluated["priorities"][i]),
+                        "cluster_priority": float(evaluated["cluster_priorities"][i]),
+                    }
+                    for i in np.flatnonzero(node_cluster == c)
+                ],
+            }
+            for c, cluster_name in enumerate(evaluated["cluster_names"])
+        ],
+    }
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], encoding="utf-8") as spec_file:
+        network_spec = json.load(spec_file)
+    print(json.dumps(
+        network_to_records(evaluate_network(compile_network(network_spec), method=network_spec.get("method", "approx"))),
+        ensure_ascii=False, indent=1,
+    ))
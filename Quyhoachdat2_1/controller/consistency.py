@@ -0,0 +1,144 @@
+# controller/consistency.py
+import numpy as np
+
+from controller.ahp import (
+    CONSISTENCY_THRESHOLD,
+    SAATY_LABELS,
+    SAATY_SCALE,
+    calculate_ahp,
+    calculate_ahp_batch,
+)
+from controller.simulation import saaty_scale_indices
+
+# Số ô lệch nhiều nhất được thử song song ở mỗi bước sửa
+REPAIR_CANDIDATES = 8
+_TOLERANCE = 1e-9
+
+
+def judgment_deviations(matrix, weights):
+    """
+    Mức đóng góp vào sự không nhất quán của từng phán đoán: |ln(a_ij · w_j / w_i)|.
+    Ma trận nhất quán tuyệt đối khi mọi giá trị bằng 0.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    return np.abs(np.log(matrix * weights[np.newaxis, :] / weights[:, np.newaxis]))
+
+
+def suggest_consistency_repairs(
+    matrix_input,
+    labels=None,
+    method="approx",
+    threshold=CONSISTENCY_THRESHOLD,
+    max_edits=None,
+    candidates=REPAIR_CANDIDATES,
+):
+    """
+    Đề xuất tập nhỏ nhất (tham lam) các ô cần sửa để CR <= threshold.
+    Mỗi bước: xếp hạng ô tam giác trên theo |ln(a_ij · w_j / w_i)|, thử `candidates` ô lệch nhất
+    (giá trị Saaty gần w_i / w_j nhất hoặc một bậc về phía đó) trong một lần gọi batch
+    và giữ thay đổi làm CR giảm nhiều nhất.
+    Sau khi đạt ngưỡng, bỏ lại các sửa đổi không còn cần thiết.
+    """
+    matrix = np.array(matrix_input, dtype=float)
+    initial = calculate_ahp(matrix, "Ma trận", method=method)
+    if initial.get("error"):
+        raise ValueError(initial["error"])
+
+    n = matrix.shape[0]
+    rows, cols = np.triu_indices(n, 1)
+    labels = list(labels) if labels is not None else [str(i + 1) for i in range(n)]
+    original_indices = saaty_scale_indices(matrix[rows, cols])
+    current = matrix.copy()
+    current_cr = float(initial["CR"])
+    weights = np.array(initial["weights"])
+    max_edits = len(rows) if max_edits is None else int(max_edits)
+    if max_edits <= 0:
+        raise ValueError("Số ô sửa tối đa phải dương.")
+
+    def is_within_threshold(cr_value):
+        return cr_value <= threshold + _TOLERANCE
+
+    def set_cell(target, pair, value):
+        target[..., rows[pair], cols[pair]] = value
+        target[..., cols[pair], rows[pair]] = 1.0 / value
+
+    edited_pairs = []  # Theo thứ tự sửa lần đầu; một ô có thể được chỉnh tiếp ở bước sau
+    scale = np.array(SAATY_SCALE)
+    for _ in range(2 * len(rows)):
+        if is_within_threshold(current_cr):
+            break
+        deviations = judgment_deviations(current, weights)[rows, cols]
+        current_indices = saaty_scale_indices(current[rows, cols])
+        target_indices = saaty_scale_indices(weights[rows] / weights[cols])
+        # Ô mới chỉ được mở khi chưa vượt max_edits; ô thiếu (NaN) không được đề xuất
+        open_mask = (target_indices != current_indices) & ~np.isnan(current[rows, cols])
+        if len(edited_pairs) >= max_edits:
+            open_mask &= np.isin(np.arange(len(rows)), edited_pairs)
+        n_open = int(open_mask.sum())
+        if n_open == 0:
+            break
+        k = min(int(candidates), n_open)
+        ranked = np.where(open_mask, deviations, -np.inf)
+        top_pairs = np.argpartition(-ranked, k - 1)[:k]
+
+        # Với mỗi ô thử cả giá trị Saaty gần w_i / w_j nhất lẫn một bậc dịch về phía đó
+        step_indices = current_indices[top_pairs] + np.sign(
+            target_indices[top_pairs] - current_indices[top_pairs]
+        )
+        trial_pairs = np.concatenate([top_pairs, top_pairs])
+        trial_values = scale[np.concatenate([target_indices[top_pairs], step_indices])]
+        trials = np.repeat(current[np.newaxis], 2 * k, axis=0)
+        trials[np.arange(2 * k), rows[trial_pairs], cols[trial_pairs]] = trial_values
+        trials[np.arange(2 * k), cols[trial_pairs], rows[trial_pairs]] = 1.0 / trial_values
+        trial_results = calculate_ahp_batch(trials, method=method, use_cache=False)
+        best = int(np.argmin(trial_results["CR"]))
+        if trial_results["CR"][best] >= current_cr - _TOLERANCE:
+            break  # Không ô nào còn làm giảm CR
+
+        pair = int(trial_pairs[best])
+        set_cell(current, pair, trial_values[best])
+        if pair not in edited_pairs:
+            edited_pairs.append(pair)
+        current_cr = float(trial_results["CR"][best])
+        weights = trial_results["weights"][best]
+
+    # Bỏ các sửa đổi thừa: hoàn tác từng ô (sửa sau trước), giữ hoàn tác nếu vẫn đạt ngưỡng
+    if is_within_threshold(current_cr) and len(edited_pairs) > 1:
+        for pair in list(reversed(edited_pairs)):
+            reverted = current.copy()
+            set_cell(reverted, pair, matrix[rows[pair], cols[pair]])
+            reverted_result = calculate_ahp(reverted, "Ma trận", method=method, use_cache=False)
+            if is_within_threshold(reverted_result["CR"]):
+                current, current_cr = reverted, float(reverted_result["CR"])
+                edited_pairs.remove(pair)
+
+    # CR sau từng bước áp dụng lần lượt các sửa đổi, tính trong một lần gọi batch
+    cumulative = np.repeat(matrix[np.newaxis], max(len(edited_pairs), 1), axis=0)
+    for step, pair in enumerate(edited_pairs):
+        set_cell(cumulative[step:], pair, current[rows[pair], cols[pair]])
+    step_crs = calculate_ahp_batch(cumulative, method=method, use_cache=False)["CR"]
+
+    edits = []
+    for step, pair in enumerate(edited_pairs):
+        i, j = int(rows[pair]), int(cols[pair])
+        new_index = int(saaty_scale_indices(current[i, j]))
+        edits.append(
+            {
+                "row": i,
+                "col": j,
+                "row_label": labels[i],
+                "col_label": labels[j],
+                "old_value": SAATY_LABELS[int(original_indices[pair])],
+                "new_value": SAATY_LABELS[new_index],
+                "CR_after": float(step_crs[step]),
+            }
+        )
+    return {
+        "initial_CR": float(initial["CR"]),
+        "final_CR": current_cr,
+        "threshold": threshold,
+        "reached": bool(is_within_threshold(current_cr)),
+        "edits": edits,
+        "repaired_matrix": current.tolist(),
+    }
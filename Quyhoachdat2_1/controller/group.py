@@ -0,0 +1,163 @@
+# controller/group.py
+import numpy as np
+
+from controller.ahp import (
+    CONSISTENCY_THRESHOLD,
+    calculate_ahp,
+    calculate_ahp_batch,
+    unpack_ahp_batch,
+)
+
+
+def cr_expert_weights(expert_crs, threshold=CONSISTENCY_THRESHOLD):
+    """Trọng số chuyên gia theo CR: 1 / (1 + CR / threshold); CR = 0 được 1, CR = threshold được 0.5."""
+    expert_crs = np.asarray(expert_crs, dtype=float)
+    return 1.0 / (1.0 + np.maximum(expert_crs, 0.0) / threshold)
+
+
+def _normalize_expert_weights(expert_weights, n_experts):
+    if expert_weights is None:
+        return np.full(n_experts, 1.0 / n_experts)
+    expert_weights = np.asarray(expert_weights, dtype=float)
+    if expert_weights.shape != (n_experts,) or (expert_weights < 0).any() or expert_weights.sum() <= 0:
+        raise ValueError(f"Trọng số chuyên gia phải là {n_experts} số không âm, tổng dương.")
+    return expert_weights / expert_weights.sum()
+
+
+def _weighted_log_sums(matrices, weights):
+    """Tổng log có trọng số và tổng trọng số theo từng ô, bỏ qua ô thiếu (NaN) của từng chuyên gia."""
+    known = ~np.isnan(matrices)
+    log_sum = np.tensordot(weights, np.log(np.where(known, matrices, 1.0)), axes=1)
+    return log_sum, np.tensordot(weights, known.astype(float), axes=1)
+
+
+def _geometric_mean_from_sums(log_sum, weight_sum):
+    # Ô không chuyên gia nào trả lời vẫn là NaN (ma trận gộp thiếu ô)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(weight_sum > 0, np.exp(log_sum / weight_sum), np.nan)
+
+
+def aggregate_judgments(matrices, expert_weights=None):
+    """
+    AIJ: trung bình nhân có trọng số của các phán đoán trên chồng (experts, ..., n, n).
+    Kết quả vẫn là ma trận nghịch đảo với đường chéo bằng 1; ô thiếu (NaN) của một chuyên gia
+    được bỏ qua và trọng số chia lại cho những người đã trả lời ô đó.
+    """
+    matrices = np.asarray(matrices, dtype=float)
+    if (matrices <= 0).any():
+        raise ValueError("Ma trận so sánh cặp phải có mọi phần tử dương.")
+    weights = _normalize_expert_weights(expert_weights, matrices.shape[0])
+    return _geometric_mean_from_sums(*_weighted_log_sums(matrices, weights))
+
+
+def aggregate_priorities(priorities, expert_weights=None):
+    """AIP: trung bình cộng có trọng số của vector ưu tiên (experts, n) của từng chuyên gia."""
+    priorities = np.asarray(priorities, dtype=float)
+    weights = _normalize_expert_weights(expert_weights, priorities.shape[0])
+    return weights @ priorities
+
+
+class GroupAHPAccumulator:
+    """
+    Gộp dần ý kiến chuyên gia mà không giữ lại ma trận của từng người:
+    chỉ lưu tổng log có trọng số (cho AIJ) và tổng điểm có trọng số (cho AIP).
+    Tổng trọng số của AIJ lưu theo từng ô vì chuyên gia có thể bỏ trống một số phán đoán.
+    """
+
+    def __init__(self, n_criteria, n_alternatives, method="approx", weight_by_cr=False,
+                 threshold=CONSISTENCY_THRESHOLD):
+        self.n_criteria = n_criteria
+        self.n_alternatives = n_alternatives
+        self.method = method
+        self.weight_by_cr = weight_by_cr
+        self.threshold = threshold
+        self.experts = []  # [{"name", "CR", "weight"}] - chỉ thông tin tóm tắt
+        self._weight_sum = 0.0
+        self._log_criteria = np.zeros((n_criteria, n_criteria))
+        self._log_alternatives = np.zeros((n_criteria, n_alternatives, n_alternatives))
+        self._criteria_cell_weights = np.zeros((n_criteria, n_criteria))
+        self._alternative_cell_weights = np.zeros((n_criteria, n_alternatives, n_alternatives))
+        self._score_sum = np.zeros(n_alternatives)
+
+    def add_experts(self, criteria_matrices, alternative_matrices, names=None):
+        """
+        Thêm một lô chuyên gia: criteria_matrices (e, m, m), alternative_matrices (e, m, n, n).
+        Mọi ma trận được tính trong hai lần gọi calculate_ahp_batch.
+        """
+        m, n = self.n_criteria, self.n_alternatives
+        criteria_matrices = np.asarray(criteria_matrices, dtype=float)
+        alternative_matrices = np.asarray(alternative_matrices, dtype=float)
+        n_experts = criteria_matrices.shape[0]
+        if criteria_matrices.shape != (n_experts, m, m) or alternative_matrices.shape != (n_experts, m, n, n):
+            raise ValueError(
+                f"Kích thước không khớp: cần ({n_experts}, {m}, {m}) và ({n_experts}, {m}, {n}, {n}), "
+                f"nhận {criteria_matrices.shape} và {alternative_matrices.shape}."
+            )
+        names = list(names) if names is not None else [
+            f"Chuyên gia {len(self.experts) + e + 1}" for e in range(n_experts)
+        ]
+
+        criteria_batch = calculate_ahp_batch(
+            criteria_matrices, [f"{name} - Tiêu chí" for name in names], method=self.method
+        )
+        alternative_batch = calculate_ahp_batch(
+            alternative_matrices.reshape(-1, n, n),
+            [f"{name} - Phương án {k + 1}" for name in names for k in range(m)],
+            method=self.method,
+        )
+        errors = [err for err in criteria_batch["error"] + alternative_batch["error"] if err]
+        if errors or (criteria_matrices <= 0).any() or (alternative_matrices <= 0).any():
+            raise ValueError("; ".join(errors) or "Ma trận so sánh cặp phải có mọi phần tử dương.")
+
+        # CR của chuyên gia = CR lớn nhất trong các ma trận của người đó
+        expert_crs = np.maximum(
+            criteria_batch["CR"], alternative_batch["CR"].reshape(n_experts, m).max(axis=1)
+        )
+        weights = cr_expert_weights(expert_crs, self.threshold) if self.weight_by_cr else np.ones(n_experts)
+
+        local_weights = alternative_batch["weights"].reshape(n_experts, m, n)
+        scores = np.einsum("ekn,ek->en", local_weights, criteria_batch["weights"])
+        log_sum, cell_weights = _weighted_log_sums(criteria_matrices, weights)
+        self._log_criteria += log_sum
+        self._criteria_cell_weights += cell_weights
+        log_sum, cell_weights = _weighted_log_sums(alternative_matrices, weights)
+        self._log_alternatives += log_sum
+        self._alternative_cell_weights += cell_weights
+        self._score_sum += weights @ scores
+        self._weight_sum += float(weights.sum())
+        self.experts.extend(
+            {"name": name, "CR": float(cr), "weight": float(w)}
+            for name, cr, w in zip(names, expert_crs, weights)
+        )
+        return self.experts[-n_experts:]
+
+    def add_expert(self, criteria_matrix, alternative_matrices, name=None):
+        """Thêm một chuyên gia: criteria_matrix (m, m), alternative_matrices (m, n, n)."""
+        return self.add_experts(
+            np.asarray(criteria_matrix, dtype=float)[np.newaxis],
+            np.asarray(alternative_matrices, dtype=float)[np.newaxis],
+            None if name is None else [name],
+        )[0]
+
+    def result(self):
+        """Kết quả nhóm: AIJ (tính lại AHP trên ma trận gộp) và AIP (gộp điểm cuối của từng người)."""
+        if not self.experts:
+            raise ValueError("Chưa có chuyên gia nào được thêm vào nhóm.")
+        criteria_matrix = _geometric_mean_from_sums(self._log_criteria, self._criteria_cell_weights)
+        alternative_matrices = _geometric_mean_from_sums(self._log_alternatives, self._alternative_cell_weights)
+        criteria_results = calculate_ahp(criteria_matrix, "Ma trận Tiêu chí (nhóm)", method=self.method)
+        alternative_batch = calculate_ahp_batch(alternative_matrices, method=self.method)
+        local_weights = alternative_batch["weights"].T  # (n, m)
+        aij_scores = local_weights @ np.array(criteria_results["weights"])
+        return {
+            "n_experts": len(self.experts),
+            "weight_by_cr": self.weight_by_cr,
+            "experts": list(self.experts),
+            "criteria_matrix": criteria_matrix,
+            "alternative_matrices": alternative_matrices,
+            "criteria_results": criteria_results,
+            "alternative_results": unpack_ahp_batch(alternative_batch),
+            "local_alternative_weights_matrix": local_weights,
+            "aij_scores": aij_scores / aij_scores.sum(),
+            "aip_scores": self._score_sum / self._weight_sum,
+        }
@@ -0,0 +1,121 @@
+# controller/hierarchy.py
+from collections import Counter, deque
+
+import numpy as np
+
+from controller.ahp import calculate_ahp_batch
+
+
+def compile_hierarchy(root):
+    """
+    Biên dịch cây tiêu chí lồng nhau {"name", "matrix", "children": [...]} thành mảng phẳng theo BFS.
+    Con của cùng một nút nằm liền nhau nên mỗi nhánh được mô tả bởi (nút cha, chỉ số con đầu, số con, ma trận).
+    """
+    names, parent, depth = [], [], []
+    branches = []
+    queue = deque([(root, -1, 0)])
+    while queue:
+        node, parent_idx, node_depth = queue.popleft()
+        node_idx = len(names)
+        names.append(str(node.get("name", "")).strip())
+        parent.append(parent_idx)
+        depth.append(node_depth)
+        children = node.get("children") or []
+        if children:
+            matrix = node.get("matrix")
+            if matrix is None and len(children) == 1:
+                matrix = [[1.0]]
+            matrix = np.asarray(matrix, dtype=float) if matrix is not None else None
+            if matrix is None or matrix.shape != (len(children), len(children)):
+                raise ValueError(
+                    f"Nút '{names[-1]}' có {len(children)} nút con nhưng ma trận so sánh "
+                    f"{'không có' if matrix is None else matrix.shape}."
+                )
+            first_child = node_idx + len(queue) + 1
+            branches.append((node_idx, first_child, len(children), matrix))
+            queue.extend((child, node_idx, node_depth + 1) for child in children)
+
+    duplicated = [name for name, count in Counter(names).items() if count > 1]
+    if duplicated:
+        raise ValueError(f"Tên nút trong cây tiêu chí bị trùng: {', '.join(sorted(duplicated))}.")
+    parent = np.array(parent, dtype=int)
+    depth = np.array(depth, dtype=int)
+    has_children = np.zeros(len(names), dtype=bool)
+    has_children[parent[parent >= 0]] = True
+    return {
+        "names": names,
+        "parent": parent,
+        "depth": depth,
+        "levels": [np.flatnonzero(depth == d) for d in range(1, int(depth.max()) + 1)],
+        "branches": branches,
+        "leaves": np.flatnonzero(~has_children),
+    }
+
+
+def evaluate_hierarchy(compiled, method="approx"):
+    """
+    Trọng số cục bộ của mọi nhánh (gộp các ma trận cùng kích thước vào một lần gọi batch)
+    rồi lan truyền trọng số toàn cục theo từng mức: g[con] = g[cha] * w_cục_bộ[con],
+    tương đương nhân vector trọng số mức trên với ma trận chuyển tiếp thưa của mức đó.
+    """
+    names, parent = compiled["names"], compiled["parent"]
+    local_weights = np.ones(len(names))
+    branch_crs = np.zeros(len(compiled["branches"]))
+    branch_consistent = np.ones(len(compiled["branches"]), dtype=bool)
+    errors = []
+
+    sizes = np.array([size for _, _, size, _ in compiled["branches"]], dtype=int)
+    for size in np.unique(sizes):
+        branch_ids = np.flatnonzero(sizes == size)
+        batch = calculate_ahp_batch(
+            np.stack([compiled["branches"][b][3] for b in branch_ids]),
+            [f"Nhánh '{names[compiled['branches'][b][0]]}'" for b in branch_ids],
+            method=method,
+        )
+        errors.extend(err for err in batch["error"] if err)
+        branch_crs[branch_ids] = batch["CR"]
+        branch_consistent[branch_ids] = batch["is_consistent"]
+        # Chỉ số con của mọi nhánh cùng kích thước: (số nhánh, size)
+        child_idx = np.array([compiled["branches"][b][1] for b in branch_ids])[:, np.newaxis] + np.arange(size)
+        local_weights[child_idx] = batch["weights"]
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    global_weights = np.zeros(len(names))
+    global_weights[0] = 1.0
+    for level_nodes in compiled["levels"]:
+        global_weights[level_nodes] = global_weights[parent[level_nodes]] * local_weights[level_nodes]
+
+    return {
+        **compiled,
+        "local_weights": local_weights,
+        "global_weights": global_weights,
+        "branch_crs": branch_crs,
+        "branch_consistent": branch_consistent,
+        "is_consistent": bool(branch_consistent.all()),
+    }
+
+
+def hierarchy_to_records(evaluated):
+    """Danh sách nút theo thứ tự duyệt sâu (để hiển thị thụt lề), dạng JSON được."""
+    names, parent = evaluated["names"], evaluated["parent"]
+    children = [[] for _ in names]
+    for node_idx in range(1, len(names)):
+        children[parent[node_idx]].append(node_idx)
+    branch_cr = {node_idx: evaluated["branch_crs"][b] for b, (node_idx, _, _, _) in enumerate(evaluated["branches"])}
+
+    records, stack = [], [0]
+    while stack:
+        node_idx = stack.pop()
+        records.append(
+            {
+                "name": names[node_idx],
+                "depth": int(evaluated["depth"][node_idx]),
+                "local_weight": float(evaluated["local_weights"][node_idx]),
+                "global_weight": float(evaluated["global_weights"][node_idx]),
+                "CR": float(branch_cr[node_idx]) if node_idx in branch_cr else None,
+                "is_leaf": not children[node_idx],
+            }
+        )
+        stack.extend(reversed(children[node_idx]))
+    return records
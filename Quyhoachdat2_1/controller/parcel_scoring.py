@@ -0,0 +1,256 @@
+# controller/parcel_scoring.py
+import csv
+import heapq
+import json
+import sys
+
+import numpy as np
+
+PARCEL_CHUNK_SIZE = 50000
+PARCEL_DEFAULT_TOP_K = 100
+PARCEL_NORMALIZATION_METHODS = ("minmax", "value_function")
+
+
+def _to_float(token):
+    try:
+        return float(token)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _parse_columns(rows, column_idx):
+    """Lấy các cột tiêu chí của một khúc dòng CSV thành mảng float (rows, m); ô không phải số thành NaN."""
+    cells = np.char.strip(np.array([[row[i] if i < len(row) else "" for i in column_idx] for row in rows], dtype=str))
+    if cells.size == 0:
+        return np.empty((0, len(column_idx)))
+    try:
+        return np.where(cells == "", "nan", cells).astype(float)
+    except ValueError:
+        return np.frompyfunc(_to_float, 1, 1)(cells).astype(float)
+
+
+def read_csv_chunks(path, columns, id_column=None, chunk_size=PARCEL_CHUNK_SIZE, delimiter=","):
+    """
+    Đọc file thuộc tính thửa đất theo từng khúc chunk_size dòng: sinh (mã thửa, giá trị (rows, m)).
+    Chỉ một khúc nằm trong bộ nhớ; id_column None thì mã thửa là số thứ tự dòng dữ liệu.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [name for name in list(columns) + ([id_column] if id_column else []) if name not in header]
+        if missing:
+            raise ValueError(f"File '{path}' thiếu cột: {', '.join(missing)}.")
+        column_idx = [header.index(name) for name in columns]
+        id_idx = header.index(id_column) if id_column else None
+        row_number = 0
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                return
+            if id_idx is None:
+                ids = [str(row_number + r + 1) for r in range(len(rows))]
+            else:
+                ids = [row[id_idx].strip() if id_idx < len(row) else "" for row in rows]
+            row_number += len(rows)
+            yield ids, _parse_columns(rows, column_idx)
+
+
+def _criterion_spec(name, spec):
+    """Gộp cấu hình chuẩn hóa của một tiêu chí với mặc định (cột trùng tên, lợi ích, min-max)."""
+    spec = dict(spec or {})
+    spec.setdefault("column", name)
+    spec.setdefault("direction", "benefit")
+    spec.setdefault("method", "value_function" if "points" in spec else "minmax")
+    if spec["method"] not in PARCEL_NORMALIZATION_METHODS or spec["direction"] not in ("benefit", "cost"):
+        raise ValueError(
+            f"Cấu hình chuẩn hóa tiêu chí '{name}' không hợp lệ: method phải thuộc "
+            f"{PARCEL_NORMALIZATION_METHODS}, direction là 'benefit' hoặc 'cost'."
+        )
+    if spec["method"] == "value_function":
+        points = np.asarray(spec.get("points"), dtype=float)
+        if points.ndim != 2 or points.shape[1] != 2 or points.shape[0] < 2 or (np.diff(points[:, 0]) <= 0).any():
+            raise ValueError(f"Hàm giá trị của tiêu chí '{name}' cần ít nhất 2 điểm [x, y] với x tăng dần.")
+        spec["points"] = points
+    return spec
+
+
+def column_bounds(path, columns, chunk_size=PARCEL_CHUNK_SIZE, delimiter=","):
+    """Lượt thống kê: min/max từng cột bỏ qua NaN, cộng dồn theo khúc nên bộ nhớ không đổi."""
+    low = np.full(len(columns), np.inf)
+    high = np.full(len(columns), -np.inf)
+    for _, values in read_csv_chunks(path, columns, chunk_size=chunk_size, delimiter=delimiter):
+        known = ~np.isnan(values)
+        low = np.minimum(low, np.where(known, values, np.inf).min(axis=0, initial=np.inf))
+        high = np.maximum(high, np.where(known, values, -np.inf).max(axis=0, initial=-np.inf))
+    return low, high
+
+
+def _resolve_bounds(input_path, specs, chunk_size, delimiter):
+    """Cận min-max của từng tiêu chí: lấy từ cấu hình, thiếu thì chạy lượt thống kê column_bounds."""
+    low = np.array([float(spec.get("min", np.nan)) for spec in specs])
+    high = np.array([float(spec.get("max", np.nan)) for spec in specs])
+    needs_bounds = np.array([spec["method"] == "minmax" for spec in specs]) & (np.isnan(low) | np.isnan(high))
+    if needs_bounds.any():
+        data_low, data_high = column_bounds(input_path, [spec["column"] for spec in specs], chunk_size, delimiter)
+        low = np.where(np.isnan(low), data_low, low)
+        high = np.where(np.isnan(high), data_high, high)
+    return low, high
+
+
+def normalize_chunk(values, specs, low, high):
+    """
+    Chuẩn hóa một khúc (rows, m) về [0, 1]: min-max theo chiều lợi ích/chi phí với cận (low, high)
+    hoặc hàm giá trị tuyến tính từng đoạn (np.interp). Cột hằng số cho mọi thửa điểm 1.
+    """
+    normalized = np.empty_like(values)
+    span = high - low
+    for k, spec in enumerate(specs):
+        column = values[:, k]
+        if spec["method"] == "value_function":
+            normalized[:, k] = np.interp(column, spec["points"][:, 0], spec["points"][:, 1])
+            normalized[np.isnan(column), k] = np.nan
+            continue
+        if span[k] <= 0:
+            normalized[:, k] = np.where(np.isnan(column), np.nan, 1.0)
+            continue
+        scaled = np.clip((column - low[k]) / span[k], 0.0, 1.0)
+        normalized[:, k] = scaled if spec["direction"] == "benefit" else 1.0 - scaled
+    return normalized
+
+
+def _push_top_k(heap, ids, scores, k, offset):
+    """Giữ heap nhỏ nhất k phần tử (điểm, số thứ tự, mã): chỉ các ứng viên top-k của khúc được đẩy vào."""
+    candidates = np.flatnonzero(~np.isnan(scores))
+    if candidates.size > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    for i in candidates:
+        item = (float(scores[i]), -(offset + int(i)), ids[i])
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+
+def score_parcel_csv(input_path, criteria_names, criteria_weights, output_path=None, criteria_specs=None,
+                     id_column=None, top_k=PARCEL_DEFAULT_TOP_K, chunk_size=PARCEL_CHUNK_SIZE, delimiter=","):
+    """
+    Chấm điểm thửa đất từ file CSV thuộc tính: điểm = Σ_k w_k · chuẩn_hóa_k(cột_k).
+    Đọc theo khúc, ghi toàn bộ điểm ra output_path (mã thửa, điểm) và giữ heap top_k, nên bộ nhớ
+    không phụ thuộc số dòng. Min-max không khai báo sẵn "min"/"max" cần thêm một lượt thống kê.
+    Dòng thiếu/không phải số ở cột tiêu chí được ghi điểm rỗng và không xếp hạng.
+    """
+    criteria_weights = np.asarray(criteria_weights, dtype=float)
+    if criteria_weights.shape != (len(criteria_names),) or not len(criteria_names):
+        raise ValueError(
+            f"Cần {len(criteria_names)} trọng số cho {len(criteria_names)} tiêu chí, nhận {criteria_weights.shape}."
+        )
+    criteria_specs = criteria_specs or {}
+    specs = [_criterion_spec(name, criteria_specs.get(name)) for name in criteria_names]
+    columns = [spec["column"] for spec in specs]
+    chunk_size, top_k = max(int(chunk_size), 1), max(int(top_k), 0)
+
+    low, high = _resolve_bounds(input_path, specs, chunk_size, delimiter)
+
+    heap = []
+    n_parcels = n_invalid = 0
+    total = 0.0
+    score_min, score_max = np.inf, -np.inf
+    output_file = open(output_path, "w", newline="", encoding="utf-8") if output_path else None
+    try:
+        writer = csv.writer(output_file) if output_file else None
+        if writer:
+            writer.writerow([id_column or "row", "score"])
+        for ids, values in read_csv_chunks(input_path, columns, id_column, chunk_size, delimiter):
+            scores = normalize_chunk(values, specs, low, high) @ criteria_weights
+            valid = ~np.isnan(scores)
+            if writer:
+                writer.writerows(zip(ids, np.where(valid, np.char.mod("%.6f", scores), "")))
+            if top_k:
+                _push_top_k(heap, ids, scores, top_k, n_parcels)
+            n_parcels += len(ids)
+            n_invalid += int((~valid).sum())
+            if valid.any():
+                total += float(scores[valid].sum())
+                score_min = min(score_min, float(scores[valid].min()))
+                score_max = max(score_max, float(scores[valid].max()))
+    finally:
+        if output_file:
+            output_file.close()
+
+    n_valid = n_parcels - n_invalid
+    return {
+        "n_parcels": n_parcels,
+        "invalid_rows": n_invalid,
+        "top_k": top_k,
+        "top": [(parcel_id, score) for score, _, parcel_id in sorted(heap, reverse=True)],
+        "mean": total / n_valid if n_valid else None,
+        "min": score_min if n_valid else None,
+        "max": score_max if n_valid else None,
+        "bounds": {name: [float(lo), float(hi)] for name, lo, hi in zip(criteria_names, low, high)},
+        "output_path": output_path,
+    }
+
+
+def parcel_suitability_matrix(input_path, analyses, area_column, criteria_specs=None, id_column=None,
+                              chunk_size=PARCEL_CHUNK_SIZE, delimiter=","):
+    """
+    Điểm thích hợp (thửa, phân tích) cho nhiều phân tích AHP cùng lúc, mỗi phân tích là
+    (tên tiêu chí, trọng số), ví dụ một phân tích cho mỗi loại sử dụng đất. Các cột tiêu chí dùng chung
+    chỉ đọc và chuẩn hóa một lần; điểm của một phân tích là NaN nếu thửa thiếu tiêu chí phân tích đó dùng.
+    Trả về (mã thửa, diện tích (N,), điểm (N, số phân tích)).
+    """
+    criteria_specs = criteria_specs or {}
+    names = list(dict.fromkeys(name for criteria_names, _ in analyses for name in criteria_names))
+    weight_matrix = np.zeros((len(names), len(analyses)))
+    for u, (criteria_names, criteria_weights) in enumerate(analyses):
+        if len(criteria_names) != len(criteria_weights) or not len(criteria_names):
+            raise ValueError(f"Phân tích thứ {u + 1} cần số trọng số bằng số tiêu chí.")
+        weight_matrix[[names.index(name) for name in criteria_names], u] = criteria_weights
+    specs = [_criterion_spec(name, criteria_specs.get(name)) for name in names]
+    columns = [spec["column"] for spec in specs]
+    chunk_size = max(int(chunk_size), 1)
+    low, high = _resolve_bounds(input_path, specs, chunk_size, delimiter)
+
+    ids, areas, scores = [], [], []
+    used = (weight_matrix > 0).astype(float)
+    for chunk_ids, values in read_csv_chunks(input_path, columns + [area_column], id_column, chunk_size, delimiter):
+        normalized = normalize_chunk(values[:, :-1], specs, low, high)
+        missing = np.isnan(normalized)
+        chunk_scores = np.where(missing, 0.0, normalized) @ weight_matrix
+        chunk_scores[(missing.astype(float) @ used) > 0] = np.nan
+        ids.extend(chunk_ids)
+        areas.append(values[:, -1])
+        scores.append(chunk_scores)
+    if not ids:
+        raise ValueError(f"File '{input_path}' không có dòng dữ liệu thửa đất nào.")
+    return ids, np.concatenate(areas), np.vstack(scores)
+
+
+def score_parcels_with_analysis(analysis_id, input_path, output_path=None, criteria_specs=None,
+                                session_db_id_check=None, **options):
+    """Dùng trọng số tiêu chí của một phân tích đã lưu (get_ahp_analysis_by_id) để chấm điểm file CSV."""
+    from model.model import get_ahp_analysis_by_id  # Import muộn: chỉ cần DB khi lấy trọng số đã lưu
+
+    analysis = get_ahp_analysis_by_id(analysis_id, session_db_id_check)
+    if not analysis:
+        raise ValueError(f"Không tìm thấy phân tích AHP ID {analysis_id}.")
+    criteria_names, criteria_weights = analysis.get("criteria_names"), analysis.get("criteria_weights")
+    if not criteria_names or not criteria_weights or len(criteria_names) != len(criteria_weights):
+        raise ValueError(f"Phân tích AHP ID {analysis_id} không có trọng số tiêu chí hợp lệ.")
+    summary = score_parcel_csv(input_path, criteria_names, criteria_weights, output_path, criteria_specs, **options)
+    summary["analysis_id"] = analysis_id
+    summary["analysis_name"] = analysis.get("analysis_name")
+    return summary
+
+
+if __name__ == "__main__":
+    # python -m controller.parcel_scoring <analysis_id> <input.csv> <output.csv> [cấu_hình.json]
+    spec = {}
+    if len(sys.argv) > 4:
+        with open(sys.argv[4], encoding="utf-8") as spec_file:
+            spec = json.load(spec_file)
+    result = score_parcels_with_analysis(
+        int(sys.argv[1]), sys.argv[2], sys.argv[3], spec.get("criteria"),
+        **{key: spec[key] for key in ("id_column", "top_k", "chunk_size", "delimiter") if key in spec}
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=1))
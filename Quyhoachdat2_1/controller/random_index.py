@@ -0,0 +1,167 @@
+# controller/random_index.py
+import json
+import os
+import threading
+
+import numpy as np
+
+# Bảng RI mô phỏng lưu cạnh module, sinh một lần (python -m controller.random_index) và nạp khi import
+RANDOM_INDEX_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "random_index_table.json")
+# n ngoài bảng đóng gói được mô phỏng lúc chạy và giữ trong bộ nhớ; đặt AHP_RI_CACHE_DIR để lưu thêm
+# vào thư mục ghi được đó cho các tiến trình sau (file trong package chỉ CLI mới ghi)
+RANDOM_INDEX_CACHE_DIR = os.environ.get("AHP_RI_CACHE_DIR")
+RANDOM_INDEX_SAMPLES = 20000
+RANDOM_INDEX_SEED = 20240601
+RANDOM_INDEX_BATCH_SIZE = 2000
+RANDOM_INDEX_PRECOMPUTED_MAX_N = 30
+
+_SAATY_SCALE = np.array([1 / 9, 1 / 8, 1 / 7, 1 / 6, 1 / 5, 1 / 4, 1 / 3, 1 / 2, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+_table_lock = threading.Lock()
+
+
+def _load_table(path=RANDOM_INDEX_TABLE_PATH):
+    """Đọc bảng RI từ đĩa; thiếu file hoặc file hỏng thì bắt đầu bảng rỗng."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+        table["values"] = {
+            method: {int(n): float(ri) for n, ri in values.items()}
+            for method, values in table.get("values", {}).items()
+        }
+        return table
+    except (OSError, ValueError, AttributeError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Không đọc được bảng RI '{path}': {e}")
+        return {"samples": RANDOM_INDEX_SAMPLES, "seed": RANDOM_INDEX_SEED, "values": {}}
+
+
+def _save_table(table, path=RANDOM_INDEX_TABLE_PATH):
+    # Ghi file tạm rồi thay thế để tiến trình khác không đọc phải file ghi dở
+    serializable = {
+        "samples": table["samples"],
+        "seed": table["seed"],
+        "values": {
+            method: {str(n): ri for n, ri in sorted(values.items())}
+            for method, values in sorted(table["values"].items())
+        },
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(serializable, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Không ghi được bảng RI '{path}': {e}")
+
+
+def _runtime_table_path():
+    return os.path.join(RANDOM_INDEX_CACHE_DIR, "random_index_table.json") if RANDOM_INDEX_CACHE_DIR else None
+
+
+def _load_runtime_values(table):
+    """Gộp các RI đã mô phỏng lúc chạy (thư mục cache) vào bảng, nếu cùng số mẫu/seed."""
+    path = _runtime_table_path()
+    if not path:
+        return table
+    extra = _load_table(path)
+    if (extra["samples"], extra["seed"]) == (table["samples"], table["seed"]):
+        for method, values in extra["values"].items():
+            merged = table["values"].setdefault(method, {})
+            for n, ri in values.items():
+                merged.setdefault(n, ri)
+    return table
+
+
+def _save_runtime_values():
+    # Ghi lại file của thư mục cache (kèm giá trị tiến trình khác đã ghi), không đụng file đóng gói
+    path = _runtime_table_path()
+    if not path:
+        return
+    table = {
+        "samples": _RI_TABLE["samples"],
+        "seed": _RI_TABLE["seed"],
+        "values": {method: dict(values) for method, values in _runtime_values.items()},
+    }
+    try:
+        os.makedirs(RANDOM_INDEX_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        print(f"Không tạo được thư mục cache RI '{RANDOM_INDEX_CACHE_DIR}': {e}")
+        return
+    _save_table(_load_runtime_values(table), path)
+
+
+_RI_TABLE = _load_runtime_values(_load_table())
+_runtime_values = {}  # Chỉ các giá trị mô phỏng lúc chạy: method -> {n: RI}
+
+
+def simulate_random_index(n, method="approx", n_samples=RANDOM_INDEX_SAMPLES, seed=RANDOM_INDEX_SEED,
+                          batch_size=RANDOM_INDEX_BATCH_SIZE):
+    """
+    RI(n) = CI trung bình của n_samples ma trận nghịch đảo ngẫu nhiên (tam giác trên chọn đều
+    trên 17 giá trị thang Saaty), trọng số tính bằng đúng phương pháp `method` qua engine batch.
+    Seed con sinh từ (seed, n) nên từng giá trị tái lập được độc lập với các n khác.
+    """
+    from controller.ahp import batch_priority_weights  # Import muộn: ahp.py nạp module này khi khởi động
+
+    n = int(n)
+    if n <= 2:
+        return 0.0
+    rng = np.random.default_rng(np.random.SeedSequence([int(seed), n]))
+    rows, cols = np.triu_indices(n, 1)
+    ci_sum = 0.0
+    for start in range(0, int(n_samples), int(batch_size)):
+        size = min(int(batch_size), int(n_samples) - start)
+        values = _SAATY_SCALE[rng.integers(0, len(_SAATY_SCALE), size=(size, len(rows)))]
+        matrices = np.ones((size, n, n))
+        matrices[:, rows, cols] = values
+        matrices[:, cols, rows] = 1.0 / values
+        weights = batch_priority_weights(matrices, method=method)
+        # λmax = trung bình (A·w)_i / w_i, cùng định nghĩa với calculate_ahp_batch
+        lambda_max = (np.einsum("bij,bj->bi", matrices, weights) / weights).mean(axis=1)
+        ci_sum += float(((lambda_max - n) / (n - 1)).sum())
+    return ci_sum / int(n_samples)
+
+
+def random_index(n, method="approx"):
+    """
+    RI cho ma trận n x n theo phương pháp tính trọng số `method`.
+    Tra bảng đã nạp; n chưa có thì mô phỏng với số mẫu/seed ghi trong bảng, giữ trong bộ nhớ
+    và chỉ ghi ra RANDOM_INDEX_CACHE_DIR nếu được cấu hình.
+    """
+    n = int(n)
+    if n <= 2:
+        return 0.0
+    cached = _RI_TABLE["values"].get(method, {}).get(n)
+    if cached is not None:
+        return cached
+    with _table_lock:
+        cached = _RI_TABLE["values"].get(method, {}).get(n)
+        if cached is None:
+            cached = round(simulate_random_index(n, method, _RI_TABLE["samples"], _RI_TABLE["seed"]), 4)
+            _RI_TABLE["values"].setdefault(method, {})[n] = cached
+            _runtime_values.setdefault(method, {})[n] = cached
+            _save_runtime_values()
+    return cached
+
+
+def generate_random_index_table(max_n=RANDOM_INDEX_PRECOMPUTED_MAX_N, methods=None,
+                                n_samples=RANDOM_INDEX_SAMPLES, seed=RANDOM_INDEX_SEED):
+    """Sinh lại toàn bộ bảng RI cho n = 3..max_n và ghi đè file đóng gói (dùng qua CLI)."""
+    from controller.ahp import PRIORITIZATION_METHODS
+
+    table = {"samples": int(n_samples), "seed": int(seed), "values": {}}
+    for method in methods or PRIORITIZATION_METHODS:
+        table["values"][method] = {
+            n: round(simulate_random_index(n, method, n_samples, seed), 4) for n in range(3, max_n + 1)
+        }
+    _save_table(table)
+    _RI_TABLE.clear()
+    _RI_TABLE.update(table)
+    _runtime_values.clear()
+    return table
+
+
+if __name__ == "__main__":
+    generated = generate_random_index_table()
+    for method_name, method_values in generated["values"].items():
+        print(method_name, method_values)
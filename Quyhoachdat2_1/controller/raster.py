@@ -0,0 +1,244 @@
+# controller/raster.py
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from controller.ahp import calculate_ahp
+
+RASTER_TILE_SIZE = 1024
+RASTER_NODATA = -9999.0
+RASTER_OUTPUT_DTYPE = "float32"
+# Số ô tối đa mỗi tiến trình nhận một lần khi phân phối tile cho ProcessPoolExecutor
+RASTER_MAP_CHUNKSIZE = 8
+
+_BYTEORDER_CODES = {"little": "<", "i": "<", "lsbfirst": "<", "big": ">", "m": ">", "msbfirst": ">"}
+
+
+def _header_path(path):
+    return os.path.splitext(path)[0] + ".hdr"
+
+
+def read_raster_header(path):
+    """
+    Đọc file .hdr đi kèm raster nhị phân thô: mỗi dòng "khóa giá trị" (nrows, ncols, dtype,
+    nodata, byteorder, offset), tương tự header ESRI BIL.
+    """
+    header = {}
+    with open(_header_path(path), encoding="utf-8") as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                header[parts[0].strip().lower()] = parts[1].strip()
+    try:
+        byteorder = _BYTEORDER_CODES[header.get("byteorder", "little").lower()]
+        return {
+            "shape": (int(header["nrows"]), int(header["ncols"])),
+            "dtype": np.dtype(header.get("dtype", "float32")).newbyteorder(byteorder),
+            "nodata": float(header["nodata"]) if "nodata" in header else None,
+            "offset": int(header.get("offset", 0)),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Header raster '{_header_path(path)}' không hợp lệ: {e}")
+
+
+def open_raster(path, mode="r"):
+    """Mở raster dạng memmap (không nạp vào RAM): .npy qua np.load, định dạng khác qua header .hdr."""
+    if not os.path.exists(path):
+        raise ValueError(f"Không tìm thấy raster '{path}'.")
+    if path.lower().endswith(".npy"):
+        raster = np.load(path, mmap_mode=mode)
+        nodata = None
+    else:
+        header = read_raster_header(path)
+        raster = np.memmap(path, dtype=header["dtype"], mode=mode, offset=header["offset"], shape=header["shape"])
+        nodata = header["nodata"]
+    if raster.ndim != 2:
+        raise ValueError(f"Raster '{path}' phải là lưới 2 chiều, nhận {raster.shape}.")
+    return raster, nodata
+
+
+def create_raster(path, shape, dtype=RASTER_OUTPUT_DTYPE, nodata=RASTER_NODATA):
+    """Tạo raster kết quả trên đĩa (.npy hoặc nhị phân thô + .hdr) rồi đóng lại; các tile ghi vào sau."""
+    shape = tuple(int(size) for size in shape)
+    if path.lower().endswith(".npy"):
+        raster = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    else:
+        dtype = np.dtype(dtype)
+        with open(_header_path(path), "w", encoding="utf-8") as f:
+            f.write(
+                f"nrows {shape[0]}\nncols {shape[1]}\ndtype {dtype.name}\nnodata {nodata}\n"
+                f"byteorder {'big' if dtype.byteorder == '>' else 'little'}\n"
+            )
+        raster = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    raster.flush()
+    del raster
+
+
+def compile_reclass_table(table):
+    """
+    Chuẩn hóa bảng phân loại lại về dạng mảng:
+    - {"breaks": [b1, ..., bk], "values": [v0, ..., vk]}: khoảng (-inf, b1) -> v0, [b1, b2) -> v1, ...
+    - {"classes": {mã: giá trị}}: raster phân loại, mã không có trong bảng thành nodata.
+    None nghĩa là giữ nguyên giá trị lớp.
+    """
+    if table is None:
+        return None
+    if "breaks" in table:
+        breaks = np.asarray(table["breaks"], dtype=float)
+        values = np.asarray(table.get("values"), dtype=float)
+        if breaks.ndim != 1 or values.shape != (breaks.size + 1,) or (np.diff(breaks) <= 0).any():
+            raise ValueError("Bảng phân loại lại cần 'breaks' tăng dần và đúng len(breaks) + 1 'values'.")
+        return ("breaks", breaks, values)
+    if "classes" in table:
+        codes = np.array([float(code) for code in table["classes"]])
+        values = np.array([float(value) for value in table["classes"].values()])
+        order = np.argsort(codes)
+        if codes.size == 0:
+            raise ValueError("Bảng phân loại lại 'classes' không có mã nào.")
+        return ("classes", codes[order], values[order])
+    raise ValueError("Bảng phân loại lại phải có 'breaks'/'values' hoặc 'classes'.")
+
+
+def reclassify(values, compiled):
+    """Phân loại lại một khối giá trị (float) theo bảng đã compile; giá trị không khớp lớp thành NaN."""
+    if compiled is None:
+        return values
+    kind, keys, mapped = compiled
+    if kind == "breaks":
+        return mapped[np.searchsorted(keys, values, side="right")]
+    idx = np.clip(np.searchsorted(keys, values), 0, keys.size - 1)
+    return np.where(keys[idx] == values, mapped[idx], np.nan)
+
+
+def raster_tiles(shape, tile_size=RASTER_TILE_SIZE):
+    """Sinh cửa sổ (hàng đầu, hàng cuối, cột đầu, cột cuối) phủ kín raster theo tile vuông."""
+    rows, cols = shape
+    for r0 in range(0, rows, tile_size):
+        for c0 in range(0, cols, tile_size):
+            yield r0, min(r0 + tile_size, rows), c0, min(c0 + tile_size, cols)
+
+
+def _overlay_tile(layer_paths, layer_nodata, compiled_tables, weights, output_path, out_nodata, window):
+    """
+    Tính một tile: đọc cửa sổ của từng lớp, phân loại lại, cộng có trọng số rồi ghi vào raster kết quả.
+    Hàm mức module để ProcessPoolExecutor pickle được; mỗi lần gọi tự mở memmap nên bộ nhớ chỉ là một tile.
+    Trả về (số ô hợp lệ, tổng, min, max) của tile.
+    """
+    r0, r1, c0, c1 = window
+    total = np.zeros((r1 - r0, c1 - c0))
+    valid = np.ones(total.shape, dtype=bool)
+    for path, nodata, compiled, weight in zip(layer_paths, layer_nodata, compiled_tables, weights):
+        layer, header_nodata = open_raster(path)
+        block = np.asarray(layer[r0:r1, c0:c1], dtype=float)
+        nodata = header_nodata if nodata is None else nodata
+        if nodata is not None:
+            valid &= block != nodata
+        valid &= np.isfinite(block)
+        block = reclassify(block, compiled)
+        valid &= np.isfinite(block)
+        total += weight * block
+        del layer
+    output, _ = open_raster(output_path, mode="r+")
+    output[r0:r1, c0:c1] = np.where(valid, total, out_nodata)
+    output.flush()
+    del output
+    count = int(valid.sum())
+    if not count:
+        return 0, 0.0, np.inf, -np.inf
+    scores = total[valid]
+    return count, float(scores.sum()), float(scores.min()), float(scores.max())
+
+
+def weighted_overlay(layer_paths, weights, output_path, reclass_tables=None, layer_nodata=None,
+                     tile_size=RASTER_TILE_SIZE, workers=None, nodata=RASTER_NODATA,
+                     dtype=RASTER_OUTPUT_DTYPE):
+    """
+    Chồng lớp có trọng số: S = Σ_k w_k · phân_loại_lại_k(lớp_k) trên từng tile.
+    Các lớp được memmap và xử lý theo tile nên bộ nhớ không phụ thuộc kích thước raster;
+    workers > 1 chia tile cho ProcessPoolExecutor, mỗi tiến trình ghi thẳng vào vùng riêng của file kết quả.
+    Ô là nodata ở bất kỳ lớp nào (hoặc không khớp bảng phân loại) thành nodata.
+    """
+    layer_paths = [str(path) for path in layer_paths]
+    weights = np.asarray(weights, dtype=float)
+    m = len(layer_paths)
+    if m == 0 or weights.shape != (m,):
+        raise ValueError(f"Cần {m} trọng số cho {m} lớp raster, nhận {weights.shape}.")
+    reclass_tables = list(reclass_tables) if reclass_tables is not None else [None] * m
+    layer_nodata = list(layer_nodata) if layer_nodata is not None else [None] * m
+    if len(reclass_tables) != m or len(layer_nodata) != m:
+        raise ValueError("Số bảng phân loại lại / giá trị nodata phải bằng số lớp raster.")
+    compiled_tables = [compile_reclass_table(table) for table in reclass_tables]
+
+    shapes = set()
+    for path in layer_paths:
+        layer, _ = open_raster(path)
+        shapes.add(layer.shape)
+        del layer
+    if len(shapes) != 1:
+        raise ValueError(f"Các lớp raster phải cùng kích thước, nhận {sorted(shapes)}.")
+    shape = shapes.pop()
+    tile_size = max(int(tile_size), 1)
+
+    create_raster(output_path, shape, dtype=dtype, nodata=nodata)
+    windows = list(raster_tiles(shape, tile_size))
+    tile_args = (layer_paths, layer_nodata, compiled_tables, weights, output_path, nodata)
+    if workers and workers > 1 and len(windows) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tile_stats = list(executor.map(
+                _overlay_tile, *zip(*[tile_args] * len(windows)), windows, chunksize=RASTER_MAP_CHUNKSIZE
+            ))
+    else:
+        tile_stats = [_overlay_tile(*tile_args, window) for window in windows]
+
+    count = sum(stats[0] for stats in tile_stats)
+    return {
+        "output_path": output_path,
+        "shape": list(shape),
+        "tile_size": tile_size,
+        "n_tiles": len(windows),
+        "weights": weights.tolist(),
+        "valid_cells": count,
+        "nodata": nodata,
+        "mean": sum(stats[1] for stats in tile_stats) / count if count else None,
+        "min": min(stats[2] for stats in tile_stats) if count else None,
+        "max": max(stats[3] for stats in tile_stats) if count else None,
+    }
+
+
+def ahp_suitability_raster(criteria_matrix, layer_paths, output_path, reclass_tables=None,
+                           method="approx", **overlay_options):
+    """Trọng số tiêu chí từ calculate_ahp rồi chồng lớp; ma trận lỗi thì báo ValueError như các route."""
+    criteria_results = calculate_ahp(criteria_matrix, "Ma trận Tiêu chí (raster)", method=method)
+    if criteria_results.get("error"):
+        raise ValueError(criteria_results["error"])
+    summary = weighted_overlay(
+        layer_paths, criteria_results["weights"], output_path, reclass_tables, **overlay_options
+    )
+    summary["CR"] = criteria_results["CR"]
+    return summary
+
+
+def run_overlay_spec(spec):
+    """
+    Chạy từ file cấu hình JSON: {"layers": [{"path", "reclass", "nodata"}], "output",
+    "weights" hoặc "criteria_matrix", tùy chọn "tile_size", "workers", "method"}.
+    """
+    layers = spec.get("layers") or []
+    options = {key: spec[key] for key in ("tile_size", "workers", "nodata") if key in spec}
+    options["layer_nodata"] = [layer.get("nodata") for layer in layers]
+    layer_paths = [layer["path"] for layer in layers]
+    reclass_tables = [layer.get("reclass") for layer in layers]
+    if "criteria_matrix" in spec:
+        return ahp_suitability_raster(
+            spec["criteria_matrix"], layer_paths, spec["output"], reclass_tables,
+            method=spec.get("method", "approx"), **options
+        )
+    return weighted_overlay(layer_paths, spec["weights"], spec["output"], reclass_tables, **options)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], encoding="utf-8") as spec_file:
+        print(json.dumps(run_overlay_spec(json.load(spec_file)), ensure_ascii=False, indent=1))
@@ -0,0 +1,128 @@
+# controller/ratings.py
+import numpy as np
+
+from controller.ahp import calculate_ahp_batch
+
+RATINGS_DEFAULT_TOP_K = 50
+# Số thửa tính mỗi lần khi tra bảng mức, giữ bộ nhớ tạm cố định với hàng trăm nghìn thửa
+RATINGS_CHUNK_SIZE = 65536
+
+
+def grade_priorities(grade_matrices, criteria_names=None, method="approx"):
+    """
+    Ưu tiên lý tưởng của các mức đánh giá từng tiêu chí: trọng số ma trận so sánh cặp các mức
+    chia cho mức cao nhất (mức tốt nhất = 1). Ma trận cùng kích thước được tính chung một lô.
+    Trả về (bảng (m, số mức lớn nhất) đệm NaN, CR (m,)).
+    """
+    m = len(grade_matrices)
+    names = criteria_names or [f"Tiêu chí {k + 1}" for k in range(m)]
+    sizes = np.array([np.shape(matrix)[0] for matrix in grade_matrices], dtype=int)
+    if m == 0 or (sizes < 1).any():
+        raise ValueError("Mỗi tiêu chí cần ít nhất một mức đánh giá.")
+    table = np.full((m, int(sizes.max())), np.nan)
+    crs = np.zeros(m)
+    errors = []
+    for size in np.unique(sizes):
+        idx = np.flatnonzero(sizes == size)
+        batch = calculate_ahp_batch(
+            np.stack([np.asarray(grade_matrices[k], dtype=float) for k in idx]),
+            [f"Mức đánh giá ({names[k]})" for k in idx],
+            method=method,
+        )
+        errors.extend(err for err in batch["error"] if err)
+        table[idx, :size] = batch["weights"] / batch["weights"].max(axis=1, keepdims=True)
+        crs[idx] = batch["CR"]
+    if errors:
+        raise ValueError("; ".join(errors))
+    return table, crs
+
+
+def encode_grades(values, grade_names, criterion_name=""):
+    """Đổi cột tên mức (N,) thành chỉ số mức (N,) bằng np.unique, mỗi tên khác nhau chỉ tra một lần."""
+    tokens = np.char.strip(np.asarray(values, dtype=object).astype(str))
+    unique_tokens, inverse = np.unique(tokens, return_inverse=True)
+    lookup = {str(name).strip(): g for g, name in enumerate(grade_names)}
+    unknown = [token for token in unique_tokens if token not in lookup]
+    if unknown:
+        raise ValueError(
+            f"Mức không hợp lệ cho tiêu chí '{criterion_name}': {', '.join(unknown[:5])}"
+            f"{' ...' if len(unknown) > 5 else ''} (hợp lệ: {', '.join(map(str, grade_names))})."
+        )
+    return np.array([lookup[token] for token in unique_tokens], dtype=np.intp)[inverse]
+
+
+def score_parcels(grade_indices, criteria_weights, grade_table, chunk_size=RATINGS_CHUNK_SIZE):
+    """
+    Điểm từng thửa = Σ_k w_k · ưu tiên(mức của thửa theo tiêu chí k).
+    grade_indices (N, m) số nguyên; tra bảng đã nhân trọng số theo từng khúc chunk_size thửa.
+    """
+    grade_indices = np.asarray(grade_indices)
+    criteria_weights = np.asarray(criteria_weights, dtype=float)
+    m = grade_table.shape[0]
+    if grade_indices.ndim != 2 or grade_indices.shape[1] != m or criteria_weights.shape != (m,):
+        raise ValueError(
+            f"Kích thước không khớp: cần mức (N, {m}) và trọng số ({m},), "
+            f"nhận {grade_indices.shape} và {criteria_weights.shape}."
+        )
+    weighted_table = grade_table * criteria_weights[:, np.newaxis]
+    grade_counts = np.sum(~np.isnan(grade_table), axis=1)
+    if ((grade_indices < 0) | (grade_indices >= grade_counts)).any():
+        raise ValueError("Chỉ số mức đánh giá nằm ngoài số mức của tiêu chí.")
+    criteria_idx = np.arange(m)
+    scores = np.empty(grade_indices.shape[0])
+    for start in range(0, grade_indices.shape[0], chunk_size):
+        chunk = grade_indices[start:start + chunk_size]
+        scores[start:start + chunk_size] = weighted_table[criteria_idx, chunk].sum(axis=1)
+    return scores
+
+
+def top_k_parcels(scores, k=RATINGS_DEFAULT_TOP_K):
+    """Chỉ số k thửa điểm cao nhất, giảm dần: argpartition O(N) rồi chỉ sắp xếp k phần tử."""
+    scores = np.asarray(scores, dtype=float)
+    k = min(int(k), scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def evaluate_ratings(criteria_weights, grade_names, grade_matrices, grade_indices,
+                     criteria_names=None, method="approx", top_k=RATINGS_DEFAULT_TOP_K):
+    """
+    AHP đo tuyệt đối (ratings): trọng số tiêu chí lấy từ calculate_ahp, ưu tiên mức từ các ma trận nhỏ,
+    chấm điểm toàn bộ thửa và giữ top_k. Trả về dict gồm scores (N,), top (chỉ số), local_top
+    (top_k, m) ưu tiên mức của các thửa top, grade_table, grade_crs và thống kê điểm.
+    """
+    grade_table, grade_crs = grade_priorities(grade_matrices, criteria_names, method)
+    scores = score_parcels(grade_indices, criteria_weights, grade_table)
+    top = top_k_parcels(scores, top_k)
+    local_top = grade_table[np.arange(grade_table.shape[0]), np.asarray(grade_indices)[top]]
+    quantiles = np.percentile(scores, [25, 50, 75]) if scores.size else np.full(3, np.nan)
+    return {
+        "scores": scores,
+        "top": top,
+        "local_top": local_top,
+        "grade_table": grade_table,
+        "grade_crs": grade_crs,
+        "grades": [
+            {
+                "criterion": criteria_names[k] if criteria_names else f"Tiêu chí {k + 1}",
+                "CR": float(grade_crs[k]),
+                "grades": [
+                    {"name": str(name), "priority": float(grade_table[k, g])}
+                    for g, name in enumerate(grade_names[k])
+                ],
+            }
+            for k in range(grade_table.shape[0])
+        ],
+        "summary": {
+            "n_parcels": int(scores.size),
+            "top_k": int(top.size),
+            "mean": float(scores.mean()) if scores.size else None,
+            "min": float(scores.min()) if scores.size else None,
+            "max": float(scores.max()) if scores.size else None,
+            "q25": float(quantiles[0]),
+            "median": float(quantiles[1]),
+            "q75": float(quantiles[2]),
+        },
+    }
@@ -0,0 +1,135 @@
+# controller/sensitivity.py
+import numpy as np
+
+SWEEP_DEFAULT_POINTS = 21
+SWEEP_MAX_POINTS = 201
+_TOLERANCE = 1e-12
+
+
+def _prepare_inputs(criteria_weights, local_weights_matrix):
+    weights = np.asarray(criteria_weights, dtype=float)
+    local = np.asarray(local_weights_matrix, dtype=float)
+    if weights.ndim != 1 or local.ndim != 2 or local.shape[1] != weights.shape[0]:
+        raise ValueError(
+            f"Kích thước không khớp: trọng số tiêu chí {weights.shape}, ma trận trọng số phương án {local.shape}."
+        )
+    if not (np.isfinite(weights).all() and np.isfinite(local).all()):
+        raise ValueError("Dữ liệu trọng số chứa NaN/Infinity.")
+    scores = local @ weights
+    # Phần điểm không thuộc tiêu chí k: R[a, k] = S_a - w_k * L[a, k]
+    rest = scores[:, np.newaxis] - local * weights[np.newaxis, :]
+    # Khi w_k thay đổi, các trọng số còn lại co giãn theo tỷ lệ (1 - w_k') / (1 - w_k)
+    remaining = 1.0 - weights
+    safe_remaining = np.where(remaining > _TOLERANCE, remaining, 1.0)
+    return weights, local, scores, rest, safe_remaining
+
+
+def rank_reversal_thresholds(criteria_weights, local_weights_matrix):
+    """
+    Với mỗi tiêu chí k, tính lượng thay đổi δ nhỏ nhất của w_k (các trọng số khác co giãn
+    theo tỷ lệ để tổng vẫn bằng 1) làm đảo thứ hạng một cặp phương án bất kỳ.
+    Điểm mỗi phương án tuyến tính theo δ nên ngưỡng có dạng đóng:
+    δ* = -(S_a - S_b) / (slope_a - slope_b), tính vector hóa trên (tiêu chí × cặp phương án).
+    """
+    weights, local, scores, rest, safe_remaining = _prepare_inputs(
+        criteria_weights, local_weights_matrix
+    )
+    n_alternatives, n_criteria = local.shape
+
+    slopes = local - rest / safe_remaining[np.newaxis, :]  # (n, m)
+    score_diff = scores[:, np.newaxis] - scores[np.newaxis, :]  # (n, n)
+    slope_diff = slopes.T[:, :, np.newaxis] - slopes.T[:, np.newaxis, :]  # (m, n, n)
+
+    deltas = np.full((n_criteria, n_alternatives, n_alternatives), np.nan)
+    np.divide(
+        -score_diff[np.newaxis, :, :],
+        slope_diff,
+        out=deltas,
+        where=np.abs(slope_diff) > _TOLERANCE,
+    )
+    new_weights = weights[:, np.newaxis, np.newaxis] + deltas
+    pair_mask = np.triu(np.ones((n_alternatives, n_alternatives), dtype=bool), 1)
+    feasible = (
+        pair_mask[np.newaxis, :, :]
+        & np.isfinite(deltas)
+        & (new_weights >= -_TOLERANCE)
+        & (new_weights <= 1.0 + _TOLERANCE)
+    )
+    deltas = np.where(feasible, deltas, np.nan)
+
+    abs_flat = np.abs(deltas).reshape(n_criteria, -1)
+    has_reversal = np.isfinite(abs_flat).any(axis=1)
+    best_flat = np.argmin(np.where(np.isfinite(abs_flat), abs_flat, np.inf), axis=1)
+    min_delta = np.where(has_reversal, deltas.reshape(n_criteria, -1)[np.arange(n_criteria), best_flat], np.nan)
+    pair_a, pair_b = np.unravel_index(best_flat, (n_alternatives, n_alternatives))
+
+    relative = np.full(n_criteria, np.nan)
+    np.divide(min_delta, weights, out=relative, where=has_reversal & (weights > _TOLERANCE))
+
+    return {
+        "deltas": deltas,
+        "min_delta": min_delta,
+        "relative_change": relative,
+        "pair": np.stack([pair_a, pair_b], axis=1),
+        "has_reversal": has_reversal,
+        "scores": scores,
+    }
+
+
+def weight_sweep(criteria_weights, local_weights_matrix, points=SWEEP_DEFAULT_POINTS):
+    """
+    Đường cong độ nhạy: điểm các phương án khi w_k chạy từ 0 đến 1 cho từng tiêu chí.
+    Trả về (grid (points,), scores (m, points, n)).
+    """
+    points = int(min(max(points, 2), SWEEP_MAX_POINTS))
+    _, local, _, rest, safe_remaining = _prepare_inputs(criteria_weights, local_weights_matrix)
+    grid = np.linspace(0.0, 1.0, points)
+    scale = (1.0 - grid)[np.newaxis, :] / safe_remaining[:, np.newaxis]  # (m, P)
+    scores = (
+        scale[:, :, np.newaxis] * rest.T[:, np.newaxis, :]
+        + grid[np.newaxis, :, np.newaxis] * local.T[:, np.newaxis, :]
+    )
+    return grid, scores
+
+
+def analyze_sensitivity(analysis_data, points=SWEEP_DEFAULT_POINTS):
+    """Phân tích độ nhạy cho một bản ghi AHPAnalyses đã lưu; trả về dict có thể jsonify."""
+    criteria_names = analysis_data.get("criteria_names") or []
+    alternatives = analysis_data.get("alternatives") or []
+    criteria_weights = analysis_data.get("criteria_weights")
+    local_matrix = analysis_data.get("local_alternative_weights_matrix")
+    if not criteria_weights or not local_matrix:
+        raise ValueError("Bản ghi phân tích thiếu trọng số tiêu chí hoặc ma trận trọng số phương án.")
+
+    thresholds = rank_reversal_thresholds(criteria_weights, local_matrix)
+    grid, sweep_scores = weight_sweep(criteria_weights, local_matrix, points)
+
+    def to_float_or_none(value):
+        return float(value) if np.isfinite(value) else None
+
+    per_criterion = []
+    for k, crit_name in enumerate(criteria_names):
+        a, b = thresholds["pair"][k]
+        has_reversal = bool(thresholds["has_reversal"][k])
+        per_criterion.append(
+            {
+                "criterion": crit_name,
+                "weight": float(criteria_weights[k]),
+                "min_delta": to_float_or_none(thresholds["min_delta"][k]),
+                "relative_change": to_float_or_none(thresholds["relative_change"][k]),
+                "reversed_pair": [alternatives[a], alternatives[b]] if has_reversal else None,
+                "sweep": sweep_scores[k].tolist(),
+            }
+        )
+    finite_deltas = np.abs(thresholds["min_delta"][thresholds["has_reversal"]])
+    return {
+        "alternatives": alternatives,
+        "scores": thresholds["scores"].tolist(),
+        "sweep_grid": grid.tolist(),
+        "criteria": per_criterion,
+        "most_sensitive_criterion": (
+            criteria_names[int(np.nanargmin(np.abs(thresholds["min_delta"])))]
+            if finite_deltas.size
+            else None
+        ),
+    }
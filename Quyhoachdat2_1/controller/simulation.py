@@ -0,0 +1,134 @@
+# controller/simulation.py
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from controller.ahp import SAATY_SCALE, batch_priority_weights
+
+MONTE_CARLO_DEFAULT_SAMPLES = 10000
+MONTE_CARLO_BATCH_SIZE = 1000
+MONTE_CARLO_DEFAULT_RADIUS = 1
+MONTE_CARLO_CI_LEVEL = 0.95
+
+_LOG_SAATY_SCALE = np.log(np.array(SAATY_SCALE))
+
+
+def saaty_scale_indices(matrices):
+    """Chỉ số (0..16) trên thang Saaty của mỗi phần tử; giá trị lệch thang được làm tròn trong không gian log."""
+    log_values = np.log(np.asarray(matrices, dtype=float))
+    upper = np.clip(np.searchsorted(_LOG_SAATY_SCALE, log_values), 1, len(SAATY_SCALE) - 1)
+    lower = upper - 1
+    pick_lower = (log_values - _LOG_SAATY_SCALE[lower]) < (_LOG_SAATY_SCALE[upper] - log_values)
+    return np.where(pick_lower, lower, upper)
+
+
+def _perturb_matrices(scale_indices, n_samples, radius, rng):
+    """
+    Sinh n_samples bản nhiễu của chồng ma trận (..., n, n): mỗi phán đoán tam giác trên
+    dịch ngẫu nhiên đều trong [-radius, radius] bậc trên thang Saaty, tam giác dưới là nghịch đảo.
+    """
+    n = scale_indices.shape[-1]
+    rows, cols = np.triu_indices(n, 1)
+    base = scale_indices[..., rows, cols]
+    offsets = rng.integers(-radius, radius + 1, size=(n_samples,) + base.shape)
+    values = np.array(SAATY_SCALE)[np.clip(base + offsets, 0, len(SAATY_SCALE) - 1)]
+    samples = np.ones((n_samples,) + scale_indices.shape, dtype=float)
+    samples[..., rows, cols] = values
+    samples[..., cols, rows] = 1.0 / values
+    return samples
+
+
+def _simulate_chunk(criteria_indices, alternative_indices, n_samples, radius, seed_seq, method):
+    """Một lô mô phỏng; hàm mức module để ProcessPoolExecutor pickle được."""
+    rng = np.random.default_rng(seed_seq)
+    n_criteria, n_alternatives = alternative_indices.shape[0], alternative_indices.shape[1]
+
+    criteria_samples = _perturb_matrices(criteria_indices, n_samples, radius, rng)
+    alternative_samples = _perturb_matrices(alternative_indices, n_samples, radius, rng)
+
+    criteria_weights = batch_priority_weights(criteria_samples, method=method)
+    alternative_weights = batch_priority_weights(
+        alternative_samples.reshape(-1, n_alternatives, n_alternatives), method=method
+    ).reshape(n_samples, n_criteria, n_alternatives)
+
+    scores = np.einsum("skn,sk->sn", alternative_weights, criteria_weights)
+    # ranks[s, a] = hạng (0 = tốt nhất) của phương án a trong mẫu s
+    ranks = np.argsort(np.argsort(-scores, axis=1), axis=1)
+    rank_counts = np.bincount(
+        (np.arange(n_alternatives)[np.newaxis, :] * n_alternatives + ranks).ravel(),
+        minlength=n_alternatives * n_alternatives,
+    ).reshape(n_alternatives, n_alternatives)
+    return rank_counts, scores
+
+
+def simulate_ahp_uncertainty(
+    criteria_matrix,
+    alternative_matrices,
+    n_samples=MONTE_CARLO_DEFAULT_SAMPLES,
+    radius=MONTE_CARLO_DEFAULT_RADIUS,
+    seed=None,
+    batch_size=MONTE_CARLO_BATCH_SIZE,
+    workers=None,
+    method="approx",
+    ci_level=MONTE_CARLO_CI_LEVEL,
+):
+    """
+    Mô phỏng Monte Carlo độ bất định của xếp hạng AHP.
+    criteria_matrix: (m, m); alternative_matrices: (m, n, n).
+    Mỗi lô dùng một SeedSequence con sinh từ `seed` nên kết quả tái lập được
+    bất kể số tiến trình; workers > 1 chia các lô cho ProcessPoolExecutor.
+    Trả về dict JSON được: chỉ số chấp nhận thứ hạng (n x n), trung bình và khoảng tin cậy điểm.
+    """
+    criteria_matrix = np.asarray(criteria_matrix, dtype=float)
+    alternative_matrices = np.asarray(alternative_matrices, dtype=float)
+    if criteria_matrix.ndim != 2 or alternative_matrices.ndim != 3:
+        raise ValueError("Cần ma trận tiêu chí (m, m) và chồng ma trận phương án (m, n, n).")
+    if alternative_matrices.shape[0] != criteria_matrix.shape[0]:
+        raise ValueError(
+            f"Số ma trận phương án ({alternative_matrices.shape[0]}) không khớp số tiêu chí ({criteria_matrix.shape[0]})."
+        )
+    if np.isnan(criteria_matrix).any() or np.isnan(alternative_matrices).any():
+        raise ValueError("Mô phỏng chỉ áp dụng cho ma trận đầy đủ, hãy điền các ô còn thiếu.")
+    if (criteria_matrix <= 0).any() or (alternative_matrices <= 0).any():
+        raise ValueError("Ma trận so sánh cặp phải có mọi phần tử dương.")
+    n_samples, radius, batch_size = int(n_samples), int(radius), max(int(batch_size), 1)
+    if n_samples <= 0 or radius < 0:
+        raise ValueError("Số mẫu phải dương và bán kính nhiễu không âm.")
+
+    root_seq = np.random.SeedSequence(seed)
+    chunk_sizes = [batch_size] * (n_samples // batch_size)
+    if n_samples % batch_size:
+        chunk_sizes.append(n_samples % batch_size)
+    child_seqs = root_seq.spawn(len(chunk_sizes))
+
+    criteria_indices = saaty_scale_indices(criteria_matrix)
+    alternative_indices = saaty_scale_indices(alternative_matrices)
+    chunk_args = [
+        (criteria_indices, alternative_indices, size, radius, child_seq, method)
+        for size, child_seq in zip(chunk_sizes, child_seqs)
+    ]
+    if workers and workers > 1 and len(chunk_args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(_simulate_chunk, *zip(*chunk_args)))
+    else:
+        chunk_results = [_simulate_chunk(*args) for args in chunk_args]
+
+    rank_counts = sum(counts for counts, _ in chunk_results)
+    all_scores = np.concatenate([scores for _, scores in chunk_results], axis=0)
+    tail = (1.0 - ci_level) / 2.0 * 100.0
+    ci_low, ci_high = np.percentile(all_scores, [tail, 100.0 - tail], axis=0)
+    rank_acceptability = rank_counts / float(n_samples)
+
+    return {
+        "n_samples": n_samples,
+        "radius": radius,
+        "seed": root_seq.entropy,
+        "method": method,
+        "ci_level": ci_level,
+        "rank_acceptability": rank_acceptability.tolist(),
+        "first_rank_probability": rank_acceptability[:, 0].tolist(),
+        "score_mean": all_scores.mean(axis=0).tolist(),
+        "score_std": all_scores.std(axis=0).tolist(),
+        "score_ci_low": ci_low.tolist(),
+        "score_ci_high": ci_high.tolist(),
+    }
@@ -0,0 +1,115 @@
+# model/catalog.py
+import logging
+import threading
+import time
+
+import pyodbc
+
+from model.model import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Giây giữa hai lần kiểm tra phiên bản danh mục; trong khoảng này mọi tra cứu không cần round trip nào
+CATALOG_VERSION_CHECK_INTERVAL = 5.0
+# Phiên bản rẻ của hai bảng danh mục (số dòng + checksum id/name): đổi khi worker khác thêm/sửa/xóa
+CATALOG_VERSION_SQL = """
+    SELECT
+        (SELECT COUNT_BIG(*) FROM Criteria),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(id, name)) FROM Criteria),
+        (SELECT COUNT_BIG(*) FROM Alternatives),
+        (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(id, name)) FROM Alternatives)
+"""
+
+
+class CatalogTable:
+    """Một bảng danh mục (id, name) đã nạp, kèm chỉ mục id -> name và name -> id."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows)
+        self.name_by_id = dict(self.rows)
+        self.id_by_name = {name: row_id for row_id, name in self.rows}
+
+    def by_ids(self, ids):
+        """[(id, name)] theo thứ tự id của các id có trong bảng, như WHERE id IN (...) ORDER BY id."""
+        wanted = {int(row_id) for row_id in ids}
+        return [(row_id, self.name_by_id[row_id]) for row_id in sorted(wanted) if row_id in self.name_by_id]
+
+
+class CatalogCache:
+    """
+    Cache hai bảng Criteria và Alternatives trong tiến trình. Ghi qua add_criteria/add_alternative
+    gọi invalidate(); thay đổi từ worker khác được phát hiện bằng CATALOG_VERSION_SQL,
+    chạy tối đa một lần mỗi CATALOG_VERSION_CHECK_INTERVAL giây.
+    """
+
+    def __init__(self, check_interval=CATALOG_VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._tables = None # (criteria, alternatives)
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._tables = None
+            self._version = None
+
+    def tables(self):
+        with self._lock:
+            if self._tables is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._tables
+            conn = None
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                version = tuple(cursor.execute(CATALOG_VERSION_SQL).fetchone())
+                if self._tables is None or version != self._version:
+                    cursor.execute("SELECT id, name FROM Criteria")
+                    criteria = CatalogTable((row.id, row.name) for row in cursor.fetchall())
+                    cursor.execute("SELECT id, name FROM Alternatives")
+                    alternatives = CatalogTable((row.id, row.name) for row in cursor.fetchall())
+                    self._tables, self._version = (criteria, alternatives), version
+                    logger.debug("Đã nạp lại danh mục: %d tiêu chí, %d phương án.", len(criteria.rows), len(alternatives.rows))
+                self._checked_at = time.monotonic()
+            except pyodbc.Error as ex:
+                logger.error(f"Lỗi khi nạp danh mục tiêu chí/phương án: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+                if self._tables is None: # Chưa từng nạp được: trả danh mục rỗng như các hàm model, không cache
+                    return CatalogTable([]), CatalogTable([])
+            finally:
+                if conn: conn.close()
+            return self._tables
+
+
+_catalog = CatalogCache()
+
+
+def criteria_catalog():
+    return _catalog.tables()[0]
+
+
+def alternatives_catalog():
+    return _catalog.tables()[1]
+
+
+def invalidate_catalog():
+    _catalog.invalidate()
+
+
+def get_criteria_by_ids(criteria_ids_list):
+    """Như model.get_criteria_by_ids nhưng tra chỉ mục trong bộ nhớ; ID không hợp lệ trả về []."""
+    if not criteria_ids_list: return []
+    try:
+        return criteria_catalog().by_ids(criteria_ids_list)
+    except ValueError as ve:
+        logger.error(f"Lỗi chuyển đổi ID tiêu chí sang integer: {ve}")
+        return []
+
+
+def get_alternatives_by_ids(alternative_ids_list):
+    """Như model.get_alternatives_by_ids nhưng tra chỉ mục trong bộ nhớ; ID không hợp lệ trả về []."""
+    if not alternative_ids_list: return []
+    try:
+        return alternatives_catalog().by_ids(alternative_ids_list)
+    except ValueError as ve:
+        logger.error(f"Lỗi chuyển đổi ID phương án sang integer: {ve}")
+        return []
@@ -1,7 +1,15 @@
 # model/model.py
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
 import pyodbc
 import json # Cần thiết cho việc serialize/deserialize dữ liệu JSON
 
+# Log theo mức thay cho print: mặc định chỉ cảnh báo/lỗi, bật DEBUG để xem chi tiết truy vấn
+logger = logging.getLogger(__name__)
+
 # --- Cấu hình kết nối Database ---
 CONN_STR = (
     r"DRIVER={SQL Server};"
@@ -12,16 +20,167 @@ CONN_STR = (
     # r'PWD=your_password;'
 )
 
+# --- Pool kết nối: mở kết nối SQL Server tốn phần lớn thời gian DB của mỗi request ---
+DB_POOL_SIZE = 8 # Tổng số kết nối tối đa (đang mượn + rảnh)
+DB_POOL_TIMEOUT = 10.0 # Giây chờ tối đa khi mọi kết nối đều đang được mượn
+DB_POOL_MAX_LIFETIME = 1800.0 # Giây; kết nối già hơn bị đóng và tạo mới
+DB_POOL_PING_AFTER = 30.0 # Kết nối rảnh lâu hơn thì kiểm tra bằng SELECT 1 trước khi cho mượn
+
+
+class PooledConnection:
+    """Bọc kết nối pyodbc mượn từ pool: close() trả kết nối về pool thay vì đóng thật."""
+
+    def __init__(self, pool, raw_conn, created_at):
+        self._pool = pool
+        self._raw_conn = raw_conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._raw_conn is None:
+            raise pyodbc.ProgrammingError("HY010", "Kết nối đã được trả về pool.")
+        return getattr(self._raw_conn, name)
+
+    def close(self):
+        if self._raw_conn is not None:
+            raw_conn, self._raw_conn = self._raw_conn, None
+            self._pool.release(raw_conn, self._created_at)
+
+
+class ConnectionPool:
+    """
+    Pool kết nối có giới hạn, an toàn đa luồng. Kết nối rảnh được dùng lại theo LIFO;
+    kết nối quá DB_POOL_MAX_LIFETIME hoặc không qua kiểm tra sống bị đóng và tạo lại.
+    """
+
+    def __init__(self, connect, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, ping_after=DB_POOL_PING_AFTER):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = [] # (kết nối, thời điểm tạo, rảnh từ lúc)
+        self._in_use = 0
+        self._counters = {"checkouts": 0, "creations": 0, "waits": 0, "timeouts": 0, "discards": 0, "ping_failures": 0}
+
+    def _reserve(self):
+        """Giữ một chỗ trong pool: trả về một kết nối rảnh, hoặc None nghĩa là được phép tạo kết nối mới."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waited = False
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise pyodbc.OperationalError(
+                        "HYT00", f"Hết thời gian chờ ({self.timeout}s) lấy kết nối từ pool ({self.size} kết nối đều đang bận)."
+                    )
+                if not waited:
+                    self._counters["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            return self._idle.pop() if self._idle else None
+
+    def _discard(self, raw_conn):
+        try:
+            raw_conn.close()
+        except pyodbc.Error:
+            pass
+        with self._cond:
+            self._in_use -= 1
+            self._counters["discards"] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _is_alive(raw_conn):
+        try:
+            cursor = raw_conn.cursor()
+            cursor.execute("SELECT 1").fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self):
+        while True:
+            entry = self._reserve()
+            if entry is None:
+                try:
+                    raw_conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._counters["creations"] += 1
+                    self._counters["checkouts"] += 1
+                return PooledConnection(self, raw_conn, created_at)
+
+            raw_conn, created_at, idle_since = entry
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self._discard(raw_conn)
+                continue
+            if now - idle_since >= self.ping_after and not self._is_alive(raw_conn):
+                with self._cond:
+                    self._counters["ping_failures"] += 1
+                self._discard(raw_conn)
+                continue
+            with self._cond:
+                self._counters["checkouts"] += 1
+            return PooledConnection(self, raw_conn, created_at)
+
+    def release(self, raw_conn, created_at):
+        """Nhận lại kết nối: rollback giao dịch dở dang; kết nối lỗi hoặc quá tuổi thì đóng hẳn."""
+        try:
+            raw_conn.rollback()
+        except pyodbc.Error:
+            self._discard(raw_conn)
+            return
+        if time.monotonic() - created_at > self.max_lifetime:
+            self._discard(raw_conn)
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((raw_conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """Đóng mọi kết nối rảnh (kết nối đang mượn sẽ vào pool khi được trả)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw_conn, _, _ in idle:
+            try:
+                raw_conn.close()
+            except pyodbc.Error:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {"size": self.size, "in_use": self._in_use, "idle": len(self._idle), **self._counters}
+
+
+_db_pool = ConnectionPool(lambda: pyodbc.connect(CONN_STR))
+
+
 def get_db_connection():
-    """Tạo và trả về một kết nối database SQL Server."""
+    """Mượn một kết nối database SQL Server từ pool; conn.close() trả kết nối về pool."""
     try:
-        conn = pyodbc.connect(CONN_STR)
-        return conn
+        return _db_pool.acquire()
     except pyodbc.Error as ex:
         error_message = ex.args[1] if len(ex.args) > 1 else str(ex)
-        print(f"LỖI KẾT NỐI DATABASE SQL SERVER: {error_message}")
+        logger.error(f"LỖI KẾT NỐI DATABASE SQL SERVER: {error_message}")
         raise
 
+
+def get_db_pool_stats():
+    """Số liệu pool kết nối: in_use, idle, checkouts, creations, waits, timeouts, discards, ping_failures."""
+    return _db_pool.stats()
+
 # --- Hàm CRUD cho Tiêu chí (Criteria) ---
 def get_criteria_from_db():
     conn = None
@@ -32,7 +191,7 @@ def get_criteria_from_db():
         criteria = [(row.id, row.name) for row in cursor.fetchall()]
         return criteria
     except pyodbc.Error as ex:
-        print(f"Lỗi khi lấy tiêu chí từ DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi lấy tiêu chí từ DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return []
     finally:
         if conn: conn.close()
@@ -52,10 +211,10 @@ def get_criteria_by_ids(criteria_ids_list):
         criteria = [(row.id, row.name) for row in cursor.fetchall()]
         return criteria
     except pyodbc.Error as ex:
-        print(f"Lỗi khi lấy tiêu chí theo IDs: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi lấy tiêu chí theo IDs: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return []
     except ValueError as ve:
-        print(f"Lỗi chuyển đổi ID tiêu chí sang integer: {ve}")
+        logger.error(f"Lỗi chuyển đổi ID tiêu chí sang integer: {ve}")
         return []
     finally:
         if conn: conn.close()
@@ -68,12 +227,14 @@ def add_criteria(name, description=""):
         db_description = description if description and description.strip() else None
         cursor.execute("INSERT INTO Criteria (name, description) VALUES (?, ?)", name, db_description)
         conn.commit()
+        from model.catalog import invalidate_catalog # Import muộn: model.catalog import model.model
+        invalidate_catalog() # Ghi xuyên: lần tra cứu sau nạp lại danh mục
         return True
     except pyodbc.IntegrityError: 
-        print(f"Tiêu chí '{name}' đã tồn tại trong DB (vi phạm UNIQUE constraint).")
+        logger.warning(f"Tiêu chí '{name}' đã tồn tại trong DB (vi phạm UNIQUE constraint).")
         return False
     except pyodbc.Error as ex:
-        print(f"Lỗi khi thêm tiêu chí '{name}' vào DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi thêm tiêu chí '{name}' vào DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return False
     finally:
         if conn: conn.close()
@@ -88,7 +249,7 @@ def get_all_alternatives():
         alternatives = [(row.id, row.name) for row in cursor.fetchall()]
         return alternatives
     except pyodbc.Error as ex:
-        print(f"Lỗi khi lấy phương án từ DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi lấy phương án từ DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return []
     finally:
         if conn: conn.close()
@@ -108,10 +269,10 @@ def get_alternatives_by_ids(alternative_ids_list):
         alternatives = [(row.id, row.name) for row in cursor.fetchall()]
         return alternatives
     except pyodbc.Error as ex:
-        print(f"Lỗi khi lấy phương án theo IDs: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi lấy phương án theo IDs: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return []
     except ValueError as ve:
-        print(f"Lỗi chuyển đổi ID phương án sang integer: {ve}")
+        logger.error(f"Lỗi chuyển đổi ID phương án sang integer: {ve}")
         return []
     finally:
         if conn: conn.close()
@@ -124,209 +285,238 @@ def add_alternative(name, description=""):
         db_description = description if description and description.strip() else None
         cursor.execute("INSERT INTO Alternatives (name, description) VALUES (?, ?)", name, db_description)
         conn.commit()
+        from model.catalog import invalidate_catalog # Import muộn: model.catalog import model.model
+        invalidate_catalog() # Ghi xuyên: lần tra cứu sau nạp lại danh mục
         return True
     except pyodbc.IntegrityError:
-        print(f"Phương án '{name}' đã tồn tại trong DB (vi phạm UNIQUE constraint).")
+        logger.warning(f"Phương án '{name}' đã tồn tại trong DB (vi phạm UNIQUE constraint).")
         return False
     except pyodbc.Error as ex:
-        print(f"Lỗi khi thêm phương án '{name}' vào DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi khi thêm phương án '{name}' vào DB: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return False
     finally:
         if conn: conn.close()
 
 # --- Hàm quản lý Session ---
+# Cache flask_session_id -> Session.id trong tiến trình: phần lớn request không cần round trip nào
+SESSION_ID_CACHE_TTL = 600.0 # Giây; hết hạn thì tra lại CSDL (phòng trường hợp dòng Session bị xóa)
+SESSION_ID_CACHE_MAX_ENTRIES = 4096
+_session_id_cache = OrderedDict() # flask_session_id -> (session_db_id, hết hạn lúc)
+_session_id_cache_lock = threading.Lock()
+
+# Upsert nguyên tử trong một round trip: UPDLOCK + HOLDLOCK khóa khoảng khóa của flask_session_id
+# nên hai request đồng thời của cùng phiên không thể cùng INSERT (UQ_Session_FlaskSessionId chặn nốt)
+SESSION_UPSERT_SQL = """
+    SET NOCOUNT ON;
+    DECLARE @id INT;
+    SELECT @id = id FROM Session WITH (UPDLOCK, HOLDLOCK) WHERE flask_session_id = ?;
+    IF @id IS NULL
+    BEGIN
+        INSERT INTO Session (flask_session_id) VALUES (?);
+        SET @id = CAST(SCOPE_IDENTITY() AS INT);
+    END
+    SELECT @id AS id;
+"""
+
+
 def get_or_create_session_db_id(flask_session_id_value):
+    """
+    Session.id của flask_session_id: tra cache trong tiến trình (TTL) trước,
+    chưa có thì chạy SESSION_UPSERT_SQL rồi lưu vào cache.
+    """
     if not flask_session_id_value:
-        print("MODEL ERROR: get_or_create_session_db_id được gọi với flask_session_id_value rỗng/None.")
+        logger.error("get_or_create_session_db_id được gọi với flask_session_id_value rỗng/None.")
         return None
-    
-    print(f"MODEL DEBUG: Bắt đầu get_or_create_session_db_id cho flask_session_id: {flask_session_id_value}")
+
+    with _session_id_cache_lock:
+        cached = _session_id_cache.get(flask_session_id_value)
+        if cached is not None and cached[1] > time.monotonic():
+            _session_id_cache.move_to_end(flask_session_id_value)
+            return cached[0]
+
+    session_db_id = None
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # 1. Kiểm tra xem flask_session_id đã tồn tại chưa
-        cursor.execute("SELECT id FROM Session WHERE flask_session_id = ?", flask_session_id_value)
-        row = cursor.fetchone()
-        print(f"MODEL DEBUG: Tìm kiếm flask_session_id '{flask_session_id_value}', row: {row}")
-        
-        if row:
-            session_db_id = row.id
-            print(f"MODEL DEBUG: Tìm thấy session_db_id có sẵn: {session_db_id}")
-            return session_db_id
+        id_row = cursor.execute(SESSION_UPSERT_SQL, flask_session_id_value, flask_session_id_value).fetchone()
+        if id_row and id_row[0] is not None:
+            session_db_id = int(id_row[0])
+            conn.commit()
+            logger.debug("Session DB ID %s cho flask_session_id %s", session_db_id, flask_session_id_value)
         else:
-            # 2. flask_session_id chưa tồn tại, tiến hành INSERT
-            print(f"MODEL DEBUG: Không tìm thấy, đang tạo session DB mới cho flask_session_id: {flask_session_id_value}")
-            
-            # Sử dụng OUTPUT INSERTED.id
-            # Câu lệnh này sẽ thực hiện INSERT và ngay lập tức trả về cột 'id' của dòng vừa được chèn.
-            sql_insert_and_output_id = "INSERT INTO Session (flask_session_id) OUTPUT INSERTED.id VALUES (?);"
-            
-            # Thực thi câu lệnh
-            cursor.execute(sql_insert_and_output_id, (flask_session_id_value,))
-            
-            # Lấy kết quả từ OUTPUT clause
-            id_row = cursor.fetchone() 
-            print(f"MODEL DEBUG: Kết quả từ OUTPUT INSERTED.id: {id_row}")
-            
-            if id_row and id_row[0] is not None:
-                session_db_id = int(id_row[0])
-                conn.commit() # Commit transaction sau khi đã lấy được ID thành công
-                print(f"MODEL DEBUG: Đã tạo và commit session DB mới với ID (dùng OUTPUT): {session_db_id}")
-                return session_db_id
-            else:
-                # Điều này không nên xảy ra nếu INSERT thành công và OUTPUT được dùng đúng cách
-                print("MODEL ERROR: OUTPUT INSERTED.id không trả về ID hợp lệ sau khi INSERT vào Session. Thực hiện rollback.")
-                conn.rollback() 
-                return None
-            
+            logger.error("Upsert Session không trả về ID hợp lệ cho flask_session_id %s. Thực hiện rollback.", flask_session_id_value)
+            conn.rollback()
+            return None
     except pyodbc.Error as ex:
         error_message = ex.args[1] if len(ex.args) > 1 else str(ex)
-        print(f"MODEL ERROR: Lỗi pyodbc.Error trong get_or_create_session_db_id: {error_message}")
+        logger.error("Lỗi pyodbc.Error trong get_or_create_session_db_id: %s", error_message)
         if conn: conn.rollback() # Đảm bảo rollback nếu có lỗi DB
         return None
     except Exception as e: # Bắt các lỗi không mong muốn khác
-        print(f"MODEL ERROR: Lỗi Exception không mong muốn trong get_or_create_session_db_id: {e}")
+        logger.exception("Lỗi Exception không mong muốn trong get_or_create_session_db_id: %s", e)
         if conn: conn.rollback()
         return None
     finally:
         if conn: 
             conn.close()
+
+    with _session_id_cache_lock:
+        _session_id_cache[flask_session_id_value] = (session_db_id, time.monotonic() + SESSION_ID_CACHE_TTL)
+        _session_id_cache.move_to_end(flask_session_id_value)
+        while len(_session_id_cache) > SESSION_ID_CACHE_MAX_ENTRIES:
+            _session_id_cache.popitem(last=False)
+    return session_db_id
 # --- Hàm lưu trữ các bước AHP trung gian ---
 # Sử dụng session_db_id (INT) là khóa ngoại đến bảng Session(id)
 # Tên cột trong DB cho khóa ngoại này là 'session_id' theo script SQL của bạn
-def save_criteria_weights(session_db_id, criteria_list_with_ids, weights):
-    if not all([session_db_id, criteria_list_with_ids, weights is not None]):
-        print("Lỗi: Thiếu session_db_id, danh sách tiêu chí hoặc trọng số khi lưu CriteriaWeights.")
-        return False
+# Mỗi bảng kết quả theo phiên: cột được ghi (ngoài session_id)
+SESSION_TABLE_COLUMNS = {
+    "CriteriaWeights": ("criteria_id", "weight"),
+    "AlternativeScores": ("alternative_id", "criteria_id", "score"),
+    "CriteriaComparison": ("criteria_id_1", "criteria_id_2", "comparison_value"),
+}
+
+
+def _matrix_shape(matrix, n_rows):
+    if hasattr(matrix, 'shape'):
+        return tuple(matrix.shape)
+    if isinstance(matrix, list) and n_rows > 0 and isinstance(matrix[0], list):
+        return (len(matrix), len(matrix[0]))
+    return None
+
+
+def _criteria_weight_rows(criteria_list_with_ids, weights):
+    if len(criteria_list_with_ids) != len(weights):
+        raise ValueError(f"Số lượng tiêu chí ({len(criteria_list_with_ids)}) và trọng số ({len(weights)}) không khớp.")
+    return [(crit_id, float(weight)) for (crit_id, _), weight in zip(criteria_list_with_ids, weights)]
+
+
+def _alternative_score_rows(alternative_list_with_ids, criteria_list_with_ids, alternative_local_weights_matrix):
+    rows, cols = len(alternative_list_with_ids), len(criteria_list_with_ids)
+    current_shape = _matrix_shape(alternative_local_weights_matrix, rows)
+    if current_shape != (rows, cols):
+        raise ValueError(f"Kích thước ma trận ({current_shape}) không khớp với ({rows}, {cols}) khi lưu AlternativeScores.")
+    return [
+        (alt_id, crit_id, float(score_value))
+        for (alt_id, _), score_row in zip(alternative_list_with_ids, alternative_local_weights_matrix)
+        for (crit_id, _), score_value in zip(criteria_list_with_ids, score_row)
+    ]
+
+
+def _comparison_rows(criteria_list_with_ids, comparison_matrix):
+    n_criteria = len(criteria_list_with_ids)
+    current_shape = _matrix_shape(comparison_matrix, n_criteria)
+    if current_shape != (n_criteria, n_criteria):
+        raise ValueError(f"Kích thước ma trận ({current_shape}) không khớp với ({n_criteria}, {n_criteria}) khi lưu CriteriaComparison.")
+    return [
+        (crit_id_1, crit_id_2, float(value))
+        for (crit_id_1, _), value_row in zip(criteria_list_with_ids, comparison_matrix)
+        for (crit_id_2, _), value in zip(criteria_list_with_ids, value_row)
+        if not math.isnan(float(value)) # Ô thiếu (ma trận không đầy đủ): không lưu dòng nào
+    ]
+
+
+def _replace_session_rows(cursor, table, session_db_id, rows):
+    """
+    Thay toàn bộ dòng của một phiên trong bảng kết quả: DELETE rồi INSERT cả lô bằng fast_executemany
+    (một lần gửi mảng tham số thay vì mỗi ô một round trip). Chạy trong giao dịch của bên gọi.
+    """
+    columns = SESSION_TABLE_COLUMNS[table] + ("session_id",)
+    cursor.execute(f"DELETE FROM {table} WHERE session_id = ?", session_db_id)
+    if rows:
+        cursor.fast_executemany = True
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+            [row + (session_db_id,) for row in rows],
+        )
+
+
+def _save_session_tables(session_db_id, table_rows, label):
+    """Ghi nhiều bảng kết quả của một phiên trong MỘT giao dịch; table_rows: [(bảng, hàm tạo dòng), ...]."""
     conn = None
     try:
+        writes = [(table, build_rows()) for table, build_rows in table_rows] # Kiểm tra dữ liệu trước khi mở kết nối
         conn = get_db_connection()
         cursor = conn.cursor()
-        # Tên cột trong DB là 'session_id'
-        cursor.execute("DELETE FROM CriteriaWeights WHERE session_id = ?", session_db_id)
-        if len(criteria_list_with_ids) != len(weights):
-            raise ValueError(f"Số lượng tiêu chí ({len(criteria_list_with_ids)}) và trọng số ({len(weights)}) không khớp.")
-        
-        for idx, (crit_id, _) in enumerate(criteria_list_with_ids):
-             cursor.execute("INSERT INTO CriteriaWeights (criteria_id, weight, session_id) VALUES (?, ?, ?)",
-                            crit_id, float(weights[idx]), session_db_id)
+        for table, rows in writes:
+            _replace_session_rows(cursor, table, session_db_id, rows)
         conn.commit()
         return True
     except pyodbc.Error as ex:
-        print(f"Lỗi DB khi lưu CriteriaWeights cho session_db_id {session_db_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi DB khi lưu {label} cho session_db_id {session_db_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         if conn: conn.rollback()
         return False
     except ValueError as e:
-         print(f"Lỗi dữ liệu khi lưu CriteriaWeights: {e}")
-         if conn: conn.rollback()
-         return False
+        logger.error(f"Lỗi dữ liệu khi lưu {label}: {e}")
+        if conn: conn.rollback()
+        return False
     finally:
         if conn: conn.close()
 
+
+def save_criteria_weights(session_db_id, criteria_list_with_ids, weights):
+    if not all([session_db_id, criteria_list_with_ids, weights is not None]):
+        logger.error("Lỗi: Thiếu session_db_id, danh sách tiêu chí hoặc trọng số khi lưu CriteriaWeights.")
+        return False
+    return _save_session_tables(
+        session_db_id, [("CriteriaWeights", lambda: _criteria_weight_rows(criteria_list_with_ids, weights))], "CriteriaWeights"
+    )
+
 def save_alternative_scores(session_db_id, alternative_list_with_ids, criteria_list_with_ids, alternative_local_weights_matrix):
     if not all([session_db_id, alternative_list_with_ids, criteria_list_with_ids, alternative_local_weights_matrix is not None]):
-        print("Lỗi: Thiếu dữ liệu đầu vào khi lưu AlternativeScores.")
-        return False
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Tên cột trong DB là 'session_id'
-        cursor.execute("DELETE FROM AlternativeScores WHERE session_id = ?", session_db_id)
-        
-        rows = len(alternative_list_with_ids)
-        cols = len(criteria_list_with_ids)
-        
-        current_shape = None
-        if hasattr(alternative_local_weights_matrix, 'shape'): 
-            current_shape = alternative_local_weights_matrix.shape
-        elif isinstance(alternative_local_weights_matrix, list) and rows > 0 and isinstance(alternative_local_weights_matrix[0], list):
-            current_shape = (len(alternative_local_weights_matrix), len(alternative_local_weights_matrix[0]))
-        
-        if current_shape != (rows, cols):
-             raise ValueError(f"Kích thước ma trận ({current_shape}) không khớp với ({rows}, {cols}) khi lưu AlternativeScores.")
-
-        for alt_idx in range(rows):
-            alt_id = alternative_list_with_ids[alt_idx][0]
-            for crit_idx in range(cols):
-                crit_id = criteria_list_with_ids[crit_idx][0]
-                score_value = alternative_local_weights_matrix[alt_idx][crit_idx]
-                cursor.execute("INSERT INTO AlternativeScores (alternative_id, criteria_id, score, session_id) VALUES (?, ?, ?, ?)",
-                               alt_id, crit_id, float(score_value), session_db_id)
-        conn.commit()
-        return True
-    except pyodbc.Error as ex:
-        print(f"Lỗi DB khi lưu AlternativeScores cho session_db_id {session_db_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
-        if conn: conn.rollback()
-        return False
-    except ValueError as e:
-        print(f"Lỗi dữ liệu khi lưu AlternativeScores: {e}")
-        if conn: conn.rollback()
+        logger.error("Lỗi: Thiếu dữ liệu đầu vào khi lưu AlternativeScores.")
         return False
-    finally:
-        if conn: conn.close()
+    return _save_session_tables(
+        session_db_id,
+        [("AlternativeScores", lambda: _alternative_score_rows(
+            alternative_list_with_ids, criteria_list_with_ids, alternative_local_weights_matrix))],
+        "AlternativeScores",
+    )
 
 def save_criteria_comparison_matrix(session_db_id, criteria_list_with_ids, comparison_matrix):
     if not all([session_db_id, criteria_list_with_ids, comparison_matrix is not None]):
-        print("Lỗi: Thiếu dữ liệu đầu vào khi lưu CriteriaComparison.")
+        logger.error("Lỗi: Thiếu dữ liệu đầu vào khi lưu CriteriaComparison.")
         return False
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Tên cột trong DB là 'session_id'
-        cursor.execute("DELETE FROM CriteriaComparison WHERE session_id = ?", session_db_id)
-        n_criteria = len(criteria_list_with_ids)
-
-        current_shape = None
-        if hasattr(comparison_matrix, 'shape'):
-            current_shape = comparison_matrix.shape
-        elif isinstance(comparison_matrix, list) and n_criteria > 0 and isinstance(comparison_matrix[0], list):
-            current_shape = (len(comparison_matrix), len(comparison_matrix[0]))
-
-        if current_shape != (n_criteria, n_criteria):
-             raise ValueError(f"Kích thước ma trận ({current_shape}) không khớp với ({n_criteria}, {n_criteria}) khi lưu CriteriaComparison.")
-
-        for i in range(n_criteria):
-            crit_id_1 = criteria_list_with_ids[i][0]
-            for j in range(n_criteria):
-                crit_id_2 = criteria_list_with_ids[j][0]
-                value = comparison_matrix[i][j]
-                cursor.execute("""
-                    INSERT INTO CriteriaComparison (criteria_id_1, criteria_id_2, comparison_value, session_id)
-                    VALUES (?, ?, ?, ?)
-                """, crit_id_1, crit_id_2, float(value), session_db_id)
-        conn.commit()
-        return True
-    except pyodbc.Error as ex:
-        print(f"Lỗi DB khi lưu CriteriaComparison cho session_db_id {session_db_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
-        if conn: conn.rollback()
-        return False
-    except ValueError as e:
-        print(f"Lỗi dữ liệu khi lưu CriteriaComparison: {e}")
-        if conn: conn.rollback()
+    return _save_session_tables(
+        session_db_id,
+        [("CriteriaComparison", lambda: _comparison_rows(criteria_list_with_ids, comparison_matrix))],
+        "CriteriaComparison",
+    )
+
+def save_criteria_step(session_db_id, criteria_list_with_ids, weights, comparison_matrix=None):
+    """Lưu trọng số tiêu chí và (nếu có) ma trận so sánh của bước 1 trong cùng một giao dịch."""
+    if not all([session_db_id, criteria_list_with_ids, weights is not None]):
+        logger.error("Lỗi: Thiếu session_db_id, danh sách tiêu chí hoặc trọng số khi lưu bước tiêu chí.")
         return False
-    finally:
-        if conn: conn.close()
+    table_rows = [("CriteriaWeights", lambda: _criteria_weight_rows(criteria_list_with_ids, weights))]
+    if comparison_matrix is not None:
+        table_rows.append(("CriteriaComparison", lambda: _comparison_rows(criteria_list_with_ids, comparison_matrix)))
+    return _save_session_tables(session_db_id, table_rows, "CriteriaWeights/CriteriaComparison")
 
 # --- HÀM CRUD CHO AHPAnalyses (LỊCH SỬ KẾT QUẢ CUỐI CÙNG) ---
 # Sử dụng session_db_id (INT) là khóa ngoại đến bảng Session(id)
 
 
-def save_ahp_analysis(session_db_id, analysis_data):
-    """Lưu một kết quả phân tích AHP hoàn chỉnh vào bảng AHPAnalyses."""
+def save_ahp_analysis(session_db_id, analysis_data, alternative_scores=None):
+    """
+    Lưu một kết quả phân tích AHP hoàn chỉnh vào bảng AHPAnalyses.
+    alternative_scores: (phương án, tiêu chí, ma trận điểm cục bộ) để ghi AlternativeScores
+    trong cùng giao dịch, mỗi phân tích chỉ một lần commit.
+    """
     if not session_db_id:
-        print("MODEL ERROR: session_db_id không hợp lệ khi gọi save_ahp_analysis.")
+        logger.error("session_db_id không hợp lệ khi gọi save_ahp_analysis.")
         return None
     
-    print(f"MODEL DEBUG: Bắt đầu save_ahp_analysis cho session_db_id: {session_db_id}")
+    logger.debug("Bắt đầu save_ahp_analysis cho session_db_id: %s", session_db_id)
     conn = None
     analysis_id = None 
     try:
+        score_rows = _alternative_score_rows(*alternative_scores) if alternative_scores is not None else None
         conn = get_db_connection()
         cursor = conn.cursor()
+        if score_rows is not None:
+            _replace_session_rows(cursor, "AlternativeScores", session_db_id, score_rows)
         
         sql_params = (
             session_db_id,
@@ -340,6 +530,9 @@ def save_ahp_analysis(session_db_id, analysis_data):
             analysis_data.get('cr_criteria'), 
             1 if analysis_data.get('is_consistent_criteria') else 0, 
             json.dumps(analysis_data.get('alternative_crs', {})),
+            json.dumps(analysis_data.get('uncertainty')),
+            json.dumps(analysis_data.get('hierarchy')),
+            json.dumps(analysis_data.get('ratings')),
             analysis_data.get('notes') 
         )
 
@@ -351,36 +544,36 @@ def save_ahp_analysis(session_db_id, analysis_data):
                 criteria_list_json, alternatives_list_json,
                 criteria_weights_json, local_alternative_weights_matrix_json,
                 final_alternative_scores_json, ranked_alternatives_json,
-                criteria_cr, criteria_is_consistent, alternative_crs_json, notes
+                criteria_cr, criteria_is_consistent, alternative_crs_json,
+                uncertainty_json, hierarchy_json, ratings_json, notes
             ) 
             OUTPUT INSERTED.analysis_id -- Lấy giá trị của cột analysis_id vừa được chèn
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?); 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?); 
         """
         
         cursor.execute(sql_insert_with_output, sql_params)
-        print("MODEL DEBUG: Đã thực hiện INSERT vào AHPAnalyses với OUTPUT clause.")
         
         analysis_id_row = cursor.fetchone() # Lấy kết quả từ OUTPUT clause
-        print(f"MODEL DEBUG: Kết quả từ OUTPUT INSERTED.analysis_id: {analysis_id_row}")
+        logger.debug("Kết quả từ OUTPUT INSERTED.analysis_id: %s", analysis_id_row)
 
         if analysis_id_row and analysis_id_row[0] is not None:
             analysis_id = int(analysis_id_row[0])
             conn.commit()
-            print(f"MODEL SUCCESS: Đã lưu AHPAnalysis với ID: {analysis_id} cho session_db_id: {session_db_id}")
+            logger.info("Đã lưu AHPAnalysis với ID: %s cho session_db_id: %s", analysis_id, session_db_id)
             return analysis_id 
         else:
             # Điều này rất lạ nếu INSERT thành công nhưng OUTPUT không trả về gì
-            print("MODEL ERROR: OUTPUT INSERTED.analysis_id không trả về ID hợp lệ. Thực hiện rollback.")
+            logger.error("OUTPUT INSERTED.analysis_id không trả về ID hợp lệ. Thực hiện rollback.")
             conn.rollback()
             return None
 
     except pyodbc.Error as ex:
         error_message = ex.args[1] if len(ex.args) > 1 else str(ex)
-        print(f"MODEL ERROR (pyodbc): Lỗi khi lưu AHPAnalysis (ID có thể là {analysis_id}): {error_message}")
+        logger.error(f"Lỗi khi lưu AHPAnalysis (ID có thể là {analysis_id}): {error_message}")
         if conn: conn.rollback()
         return None
     except Exception as e: 
-        print(f"MODEL ERROR (Exception): Lỗi không mong muốn khi lưu AHPAnalysis (ID có thể là {analysis_id}): {e}")
+        logger.exception(f"Lỗi không mong muốn khi lưu AHPAnalysis (ID có thể là {analysis_id}): {e}")
         if conn: conn.rollback()
         return None
     finally:
@@ -407,11 +600,64 @@ def get_ahp_analyses_by_session_db_id(session_db_id):
         analyses = [dict(zip(columns, row)) for row in cursor.fetchall()]
         return analyses
     except pyodbc.Error as ex:
-        print(f"Lỗi DB khi lấy danh sách AHP Analyses: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi DB khi lấy danh sách AHP Analyses: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return []
     finally:
         if conn: conn.close()
 
+# Số phân tích tối đa mỗi trang lịch sử, kể cả khi bên gọi xin nhiều hơn
+AHP_HISTORY_MAX_PAGE_SIZE = 100
+
+def get_ahp_analyses_page(session_db_id, page_size=20, after=None, before=None):
+    """
+    Một trang lịch sử phân tích theo keyset (created_at DESC, analysis_id ASC) trong một phiên: đúng thứ tự
+    khóa của IX_AHPAnalyses_Session_CreatedAt (session_db_id, created_at DESC, analysis_id, INCLUDE analysis_name),
+    nên SQL Server seek vào phiên rồi chỉ đọc TOP (n + 1) dòng kể từ khóa, không key lookup, không sort, không OFFSET.
+    after/before: khóa (created_at, analysis_id) của dòng cuối/đầu trang đang xem.
+    Trả về {"analyses", "next_key", "prev_key"}; khóa là None khi không còn trang theo hướng đó.
+    """
+    page = {"analyses": [], "next_key": None, "prev_key": None}
+    if not session_db_id: return page
+    page_size = max(1, min(int(page_size), AHP_HISTORY_MAX_PAGE_SIZE))
+    if before is not None: # Trang mới hơn: đọc ngược chỉ mục rồi đảo lại
+        keyset, order, key = "AND (created_at > ? OR (created_at = ? AND analysis_id < ?))", "created_at ASC, analysis_id DESC", before
+    elif after is not None:
+        keyset, order, key = "AND (created_at < ? OR (created_at = ? AND analysis_id > ?))", "created_at DESC, analysis_id ASC", after
+    else:
+        keyset, order, key = "", "created_at DESC, analysis_id ASC", None
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT TOP (?) analysis_id, session_db_id, analysis_name, created_at
+            FROM AHPAnalyses
+            WHERE session_db_id = ? {keyset}
+            ORDER BY {order}
+        """, [page_size + 1, session_db_id] + ([key[0], key[0], int(key[1])] if key else []))
+        columns = [column[0] for column in cursor.description]
+        analyses = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except pyodbc.Error as ex:
+        logger.error(f"Lỗi DB khi lấy trang lịch sử AHP Analyses: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        return page
+    finally:
+        if conn: conn.close()
+
+    has_more = len(analyses) > page_size
+    analyses = analyses[:page_size]
+    if before is not None:
+        analyses.reverse()
+    if not analyses:
+        return page
+    first_key = (analyses[0]["created_at"], analyses[0]["analysis_id"])
+    last_key = (analyses[-1]["created_at"], analyses[-1]["analysis_id"])
+    page["analyses"] = analyses
+    if before is not None:
+        page["prev_key"], page["next_key"] = (first_key if has_more else None), last_key
+    else:
+        page["prev_key"], page["next_key"] = (first_key if after is not None else None), (last_key if has_more else None)
+    return page
+
 def get_ahp_analysis_by_id(analysis_id, session_db_id_check=None):
     """
     Lấy chi tiết một phân tích AHP dựa trên analysis_id.
@@ -447,8 +693,11 @@ def get_ahp_analysis_by_id(analysis_id, session_db_id_check=None):
                 analysis_data['alternative_scores'] = json.loads(analysis_data.get('final_alternative_scores_json', 'null'))
                 analysis_data['ranked_alternatives'] = json.loads(analysis_data.get('ranked_alternatives_json', 'null'))
                 analysis_data['alternative_crs'] = json.loads(analysis_data.get('alternative_crs_json', '{}')) 
+                analysis_data['uncertainty'] = json.loads(analysis_data.get('uncertainty_json') or 'null')
+                analysis_data['hierarchy'] = json.loads(analysis_data.get('hierarchy_json') or 'null')
+                analysis_data['ratings'] = json.loads(analysis_data.get('ratings_json') or 'null')
             except json.JSONDecodeError as je:
-                print(f"Lỗi JSON decode cho analysis_id {analysis_id}: {je}. Dữ liệu JSON có thể không hợp lệ.")
+                logger.warning(f"Lỗi JSON decode cho analysis_id {analysis_id}: {je}. Dữ liệu JSON có thể không hợp lệ.")
                 # Gán giá trị mặc định nếu parse lỗi để tránh lỗi khi render template
                 default_if_json_error = lambda key: [] if 'list' in key or 'names' in key or 'alternatives' in key and 'scores' not in key else ({} if 'crs' in key else None)
                 for k in ['criteria_list_json', 'alternatives_list_json', 'criteria_weights_json', 'local_alternative_weights_matrix_json', 'final_alternative_scores_json', 'ranked_alternatives_json', 'alternative_crs_json']:
@@ -470,7 +719,79 @@ def get_ahp_analysis_by_id(analysis_id, session_db_id_check=None):
             return analysis_data
         return None
     except pyodbc.Error as ex:
-        print(f"Lỗi DB khi lấy chi tiết AHP Analysis ID {analysis_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        logger.error(f"Lỗi DB khi lấy chi tiết AHP Analysis ID {analysis_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        return None
+    finally:
+        if conn: conn.close()
+
+def save_land_allocation(session_db_id, allocation_data):
+    """Lưu kết quả phân bổ đất (tóm tắt theo loại đất và danh sách thửa được giao) vào bảng LandAllocations."""
+    if not session_db_id:
+        logger.error("session_db_id không hợp lệ khi gọi save_land_allocation.")
+        return None
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO LandAllocations (
+                session_db_id, allocation_name, method, analysis_ids_json,
+                summary_json, assignment_json, total_suitability
+            )
+            OUTPUT INSERTED.allocation_id
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+        """, (
+            session_db_id,
+            allocation_data.get('allocation_name'),
+            allocation_data.get('method'),
+            json.dumps(allocation_data.get('analysis_ids', [])),
+            json.dumps(allocation_data.get('summary')),
+            json.dumps(allocation_data.get('assignment', {})),
+            allocation_data.get('total_suitability'),
+        ))
+        allocation_id_row = cursor.fetchone()
+        if allocation_id_row and allocation_id_row[0] is not None:
+            conn.commit()
+            return int(allocation_id_row[0])
+        conn.rollback()
+        return None
+    except pyodbc.Error as ex:
+        logger.error(f"Lỗi khi lưu LandAllocation: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn: conn.close()
+
+def get_land_allocation_by_id(allocation_id, session_db_id_check=None):
+    """Lấy chi tiết một lần phân bổ đất; có thể kiểm tra session_db_id_check để đảm bảo quyền sở hữu."""
+    if not allocation_id: return None
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sql_query = "SELECT * FROM LandAllocations WHERE allocation_id = ?"
+        params = [allocation_id]
+        if session_db_id_check is not None:
+            sql_query += " AND session_db_id = ?"
+            params.append(session_db_id_check)
+        cursor.execute(sql_query, tuple(params))
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        if not row:
+            return None
+        allocation_data = dict(zip(columns, row))
+        try:
+            allocation_data['analysis_ids'] = json.loads(allocation_data.get('analysis_ids_json') or '[]')
+            allocation_data['summary'] = json.loads(allocation_data.get('summary_json') or 'null')
+            allocation_data['assignment'] = json.loads(allocation_data.get('assignment_json') or '{}')
+        except json.JSONDecodeError as je:
+            logger.warning(f"Lỗi JSON decode cho allocation_id {allocation_id}: {je}.")
+            return None
+        for k in [k for k in allocation_data if k.endswith('_json')]:
+            del allocation_data[k]
+        return allocation_data
+    except pyodbc.Error as ex:
+        logger.error(f"Lỗi DB khi lấy LandAllocation ID {allocation_id}: {ex.args[1] if len(ex.args) > 1 else str(ex)}")
         return None
     finally:
         if conn: conn.close()
@@ -479,3 +800,49 @@ def get_ahp_analysis_by_id(analysis_id, session_db_id_check=None):
 # if __name__ == '__main__':
 #     print("Thực thi init_db() để đảm bảo các bảng tồn tại (chỉ chạy khi cần thiết lập DB)...")
 #     init_db()
+
+
+def benchmark_session_writes(n_alternatives=15, n_criteria=15, repeats=5):
+    """
+    Đo thông lượng ghi AlternativeScores: từng dòng một execute (cách cũ) so với _replace_session_rows
+    (fast_executemany). Mỗi lần đo chạy trong một giao dịch rồi rollback nên không để lại dữ liệu.
+    """
+    session_db_id = get_or_create_session_db_id("benchmark-bulk-writes")
+    criteria, alternatives = get_criteria_from_db(), get_all_alternatives()
+    if not session_db_id or not criteria or not alternatives:
+        raise ValueError("Cần CSDL có sẵn tiêu chí và phương án để chạy benchmark.")
+    criteria_tuples = [criteria[k % len(criteria)] for k in range(n_criteria)]
+    alternative_tuples = [alternatives[k % len(alternatives)] for k in range(n_alternatives)]
+    rows = _alternative_score_rows(alternative_tuples, criteria_tuples, [[0.5] * n_criteria for _ in range(n_alternatives)])
+
+    def write_per_row(cursor):
+        cursor.execute("DELETE FROM AlternativeScores WHERE session_id = ?", session_db_id)
+        for row in rows:
+            cursor.execute("INSERT INTO AlternativeScores (alternative_id, criteria_id, score, session_id) VALUES (?, ?, ?, ?)",
+                           *row, session_db_id)
+
+    def write_bulk(cursor):
+        _replace_session_rows(cursor, "AlternativeScores", session_db_id, rows)
+
+    results = {"rows": len(rows)}
+    conn = get_db_connection()
+    try:
+        for name, write in (("per_row", write_per_row), ("bulk", write_bulk)):
+            elapsed = []
+            for _ in range(repeats):
+                cursor = conn.cursor()
+                start = time.perf_counter()
+                write(cursor)
+                elapsed.append(time.perf_counter() - start)
+                conn.rollback()
+            results[name] = {"best_seconds": min(elapsed), "rows_per_second": len(rows) / min(elapsed)}
+    finally:
+        conn.close()
+    results["speedup"] = results["per_row"]["best_seconds"] / results["bulk"]["best_seconds"]
+    return results
+
+
+if __name__ == '__main__':
+    # python -m model.model [số phương án] [số tiêu chí]
+    import sys
+    print(json.dumps(benchmark_session_writes(*(int(arg) for arg in sys.argv[1:3])), indent=1))
@@ -130,6 +130,9 @@ CREATE TABLE AHPAnalyses (
     criteria_cr FLOAT,                                    -- CR của tiêu chí
     criteria_is_consistent BIT,                           -- CR hợp lệ?
     alternative_crs_json NVARCHAR(MAX),                   -- CR các PA (JSON)
+    uncertainty_json NVARCHAR(MAX),                       -- Mô phỏng Monte Carlo độ bất định xếp hạng (JSON)
+    hierarchy_json NVARCHAR(MAX),                         -- Cây tiêu chí phân cấp, trọng số cục bộ/toàn cục (JSON)
+    ratings_json NVARCHAR(MAX),                           -- Thang mức theo tiêu chí và thống kê điểm thửa đất (JSON)
 
     notes NVARCHAR(MAX)        );                         -- Ghi chú
 
@@ -144,6 +147,29 @@ ON UPDATE CASCADE;
 -- Bạn có thể thêm Index để tăng tốc độ truy vấn nếu cần, ví dụ:
 CREATE INDEX IX_AHPAnalyses_SessionDbId ON AHPAnalyses(session_db_id);
 CREATE INDEX IX_AHPAnalyses_CreatedAt ON AHPAnalyses(created_at DESC);
+-- Trang lịch sử /history (keyset theo phiên): seek đúng phiên rồi đọc TOP (n + 1) theo thứ tự chỉ mục, không sort
+CREATE INDEX IX_AHPAnalyses_Session_CreatedAt ON AHPAnalyses(session_db_id, created_at DESC, analysis_id) INCLUDE (analysis_name);
+
+-- CSDL đã tạo trước khi có cột mô phỏng: ALTER TABLE AHPAnalyses ADD uncertainty_json NVARCHAR(MAX) NULL;
+-- CSDL đã tạo trước khi có cây tiêu chí: ALTER TABLE AHPAnalyses ADD hierarchy_json NVARCHAR(MAX) NULL;
+-- CSDL đã tạo trước khi có chấm điểm thang mức: ALTER TABLE AHPAnalyses ADD ratings_json NVARCHAR(MAX) NULL;
+-- CSDL đã tạo trước khi phân trang lịch sử: CREATE INDEX IX_AHPAnalyses_Session_CreatedAt ON AHPAnalyses(session_db_id, created_at DESC, analysis_id) INCLUDE (analysis_name);
+
+-- Phân bổ đất: mỗi lần phân bổ dùng nhiều phân tích AHP (một phân tích cho mỗi loại sử dụng đất)
+CREATE TABLE LandAllocations (
+    allocation_id INT PRIMARY KEY IDENTITY(1,1),
+    session_db_id INT NOT NULL,
+    allocation_name NVARCHAR(500),
+    created_at DATETIME2 DEFAULT GETDATE(),
+    method NVARCHAR(20),                                  -- greedy / lp
+    analysis_ids_json NVARCHAR(MAX) NOT NULL,             -- ID các AHPAnalyses dùng làm điểm thích hợp (JSON)
+    summary_json NVARCHAR(MAX),                           -- Nhu cầu, diện tích đã giao theo loại đất (JSON)
+    assignment_json NVARCHAR(MAX),                        -- Mã thửa được giao cho từng loại đất (JSON)
+    total_suitability FLOAT,
+    CONSTRAINT FK_LandAllocations_Session FOREIGN KEY (session_db_id)
+        REFERENCES [Session](id) ON DELETE CASCADE
+);
+CREATE INDEX IX_LandAllocations_SessionDbId ON LandAllocations(session_db_id);
 
 ALTER TABLE Session ADD flask_session_id NVARCHAR(255)
 ALTER TABLE Session ADD CONSTRAINT UQ_Session_FlaskSessionId UNIQUE (flask_session_id)